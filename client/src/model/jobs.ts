@@ -25,6 +25,7 @@ export interface Job {
   file: File
   download_link?: string
   file_name_original: string
+  file_hash?: string // hash of the uploaded file, thumbnails and toolpaths are stored under it
   date?: Date
   status?: string
   progress?: number //store progress of job
@@ -223,11 +224,15 @@ export function useGetJobs() {
       issues?: number[],
       startdate: string = '',
       enddate: string = '',
-      countOnly?: number
+      countOnly?: number,
+      cursor?: string
     ) {
+      // responds [jobs, total, next cursor]. Passing the next cursor of a page as `cursor` loads the
+      // following page without an offset scan; the total is then null (only counted on the first page).
       try {
         const response = await api(
-          `getjobs?page=${page}&pageSize=${pageSize}&printerIds=${JSON.stringify(printerIds)}&oldestFirst=${oldestFirst}&searchJob=${encodeURIComponent(searchJob)}&searchCriteria=${encodeURIComponent(searchCriteria)}&searchTicketId=${encodeURIComponent(searchTicketId)}&favoriteOnly=${favoriteOnly}&issueIds=${JSON.stringify(issues)}&startdate=${startdate}&enddate=${enddate}&fromError=${fromError}&countOnly=${countOnly}`
+          `getjobs?page=${page}&pageSize=${pageSize}&printerIds=${JSON.stringify(printerIds)}&oldestFirst=${oldestFirst}&searchJob=${encodeURIComponent(searchJob)}&searchCriteria=${encodeURIComponent(searchCriteria)}&searchTicketId=${encodeURIComponent(searchTicketId)}&favoriteOnly=${favoriteOnly}&issueIds=${JSON.stringify(issues)}&startdate=${startdate}&enddate=${enddate}&fromError=${fromError}&countOnly=${countOnly}` +
+          (cursor !== undefined ? `&cursor=${encodeURIComponent(cursor)}` : '')
         )
         return response
       } catch (error) {
@@ -489,6 +494,136 @@ export function useGetFile() {
   }
 }
 
+// [first line, byte offset, layer height] of every ;LAYER_CHANGE in the uploaded file
+export type GcodeIndex = {
+  lines: number
+  size: number
+  layers: Array<[number, number, number | null]>
+  file_name: string
+}
+
+export function useGetGcodeIndex() {
+  return {
+    async getGcodeIndex(job: Job): Promise<GcodeIndex | undefined> {
+      try {
+        return await api(`getgcodeindex?jobid=${job.id}`)
+      } catch (error) {
+        console.error(error)
+        toast.error('An error occurred while retrieving the file')
+        return undefined
+      }
+    }
+  }
+}
+
+// G-code of layers start to end - 1 only, so the viewer never downloads the whole file at once
+export function useGetGcodeLayers() {
+  return {
+    async getGcodeLayers(job: Job, start: number, end: number): Promise<string | undefined> {
+      try {
+        const response = await fetch(`${API_ROOT.value}/getgcode?jobid=${job.id}&unit=layers&start=${start}&end=${end}`)
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`)
+        }
+        return await response.text()
+      } catch (error) {
+        console.error(error)
+        toast.error('An error occurred while retrieving the file')
+        return undefined
+      }
+    }
+  }
+}
+
+// The thumbnail embedded by the slicer (or drawn by the server when there is none), as an image URL.
+// It is addressed by the file hash, so the browser caches it.
+export function thumbnailUrl(job: Job, width: number = 0) {
+  return job.file_hash ? `${API_ROOT.value}/thumbnail/${job.file_hash}?width=${width}` : undefined
+}
+
+// [layer height, byte offset, extrusion vertices, travel vertices] of every layer of the toolpath
+export type ToolpathLayers = Array<[number | null, number, number, number]>
+
+// the toolpath at every level of detail: level 0 has every move, the next ones are merged down to a
+// grid of `cell` mm
+export type ToolpathIndex = {
+  levels: Array<{ cell: number | null; layers: ToolpathLayers }>
+  bounds: [[number, number, number], [number, number, number]] | null
+}
+
+// The toolpath of a file is built in the background after it is uploaded: until it is ready the
+// server answers 202, and the request is sent again after the Retry-After it gives
+async function fetchToolpath(url: string, attempts: number = 60): Promise<Response> {
+  for (let attempt = 1; ; attempt++) {
+    const response = await fetch(url)
+    if (response.status !== 202 || attempt === attempts) {
+      if (!response.ok || response.status === 202) {
+        throw new Error(`HTTP error! status: ${response.status}`)
+      }
+      return response
+    }
+    const seconds = Number(response.headers.get('Retry-After')) || 5
+    await new Promise((resolve) => setTimeout(resolve, seconds * 1000))
+  }
+}
+
+export function useGetToolpathIndex() {
+  return {
+    async getToolpathIndex(job: Job): Promise<ToolpathIndex | undefined> {
+      try {
+        const response = await fetchToolpath(`${API_ROOT.value}/gettoolpathindex?jobid=${job.id}`)
+        return await response.json()
+      } catch (error) {
+        console.error(error)
+        toast.error('An error occurred while retrieving the toolpath')
+        return undefined
+      }
+    }
+  }
+}
+
+// Float32 (x, y, z) vertex pairs of layers start to end - 1 at a level of detail, built on the server
+// and cached there, so the viewers do not parse the G-code themselves
+export function useGetToolpath() {
+  return {
+    async getToolpath(job: Job, start: number, end: number, level: number = 0): Promise<Float32Array | undefined> {
+      try {
+        const response = await fetchToolpath(`${API_ROOT.value}/gettoolpath?jobid=${job.id}&start=${start}&end=${end}&level=${level}`)
+        return new Float32Array(await response.arrayBuffer())
+      } catch (error) {
+        console.error(error)
+        toast.error('An error occurred while retrieving the toolpath')
+        return undefined
+      }
+    }
+  }
+}
+
+// The coarsest level whose grid is still finer than a pixel, for a view showing mmPerPixel
+export function pickToolpathLevel(index: ToolpathIndex, mmPerPixel: number) {
+  let level = 0
+  index.levels.forEach((detail, i) => {
+    if (detail.cell !== null && detail.cell <= mmPerPixel) {
+      level = i
+    }
+  })
+  return level
+}
+
+// The extrusion vertices of layers start to end - 1 out of a /gettoolpath buffer for the same layers
+export function extrusionVertices(layers: ToolpathLayers, buffer: Float32Array, start: number, end: number) {
+  const selected = layers.slice(start, end)
+  const vertices = new Float32Array(selected.reduce((count, layer) => count + layer[2] * 3, 0))
+  let read = 0
+  let written = 0
+  for (const [, , extrusion, travel] of selected) {
+    vertices.set(buffer.subarray(read, read + extrusion * 3), written)
+    written += extrusion * 3
+    read += (extrusion + travel) * 3
+  }
+  return vertices
+}
+
 export function useClearSpace() {
   return {
     async clearSpace() {
@@ -639,9 +774,11 @@ export function useRemoveIssue() {
 
 export function useDownloadCsv() {
   return {
-    async csv(allJobs: number, jobIds?: number[]): Promise<void> {
+    // Downloads the jobs as CSV or NDJSON (one JSON object per line): all of them, the ones in jobIds,
+    // or the ones the job history filters select (the getjobs parameters). The server streams the file.
+    async csv(allJobs: number, jobIds?: number[], filters?: object, format: 'csv' | 'ndjson' = 'csv'): Promise<void> {
       try {
-        const response = await download(`downloadcsv`, { allJobs, jobIds })
+        const response = await download(`downloadcsv`, { allJobs, jobIds, filters, format })
 
         if (!response.ok) {
           throw new Error('HTTP error ' + response.status)
@@ -653,11 +790,9 @@ export function useDownloadCsv() {
         const dateString = ('0' + (date.getMonth() + 1)).slice(-2) + ('0' + date.getDate()).slice(-2) + date.getFullYear();
         
         // Generate the filename
-        const filename = `jobs_${dateString}.csv`
+        const filename = `jobs_${dateString}.${format}`
 
         saveAs(blob, filename)
-
-        await deleteCSVFromServer()
       } catch (error) {
         console.error('An error occurred while downloading the CSV:', error)
         toast.error('An error occurred while downloading the CSV')
@@ -665,14 +800,3 @@ export function useDownloadCsv() {
     }
   }
 }
-
-export async function deleteCSVFromServer() {
-  try {
-    const response = await api(`removeCSV`)
-    console.log('DELETE RES ', response)
-    return response
-  } catch (error) {
-    console.error(error)
-    toast.error('An error occurred while removing the issue')
-  }
-}
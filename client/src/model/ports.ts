@@ -21,6 +21,8 @@ export interface Device {
   error?: string
   canPause?: number
   queue?: Job[] //  Store job array to store queue for each printer.
+  queue_epoch?: string // id of the server queue that queue_seq counts in
+  queue_seq?: number // sequence number of the last queue_update applied to queue
   isQueueExpanded?: boolean
   isInfoExpanded?: boolean
   extruder_temp?: number
@@ -27,12 +27,54 @@ export function setupStatusSocket(printers: any) {
   })
 }
 
+// queue_update carries one change (insert, remove, move, reorder) numbered by seq, or the whole
+// queue (snapshot) after a resync. A gap in seq means an update was missed, so ask for a snapshot.
+// seq counts within an epoch: a printer reset or a server restart starts a new queue, numbered from 0
+// again under a new epoch, so an op from another epoch than ours asks for a snapshot too.
+function applyQueueUpdate(printer: Device, data: any) {
+  const queue = printer.queue ?? []
+  switch (data.op) {
+    case 'insert':
+      queue.splice(data.index, 0, data.job)
+      break
+    case 'remove': {
+      const index = queue.findIndex((job) => job.id === data.jobid)
+      if (index !== -1) queue.splice(index, 1)
+      break
+    }
+    case 'move': {
+      const index = queue.findIndex((job) => job.id === data.jobid)
+      if (index !== -1) queue.splice(data.to, 0, queue.splice(index, 1)[0])
+      break
+    }
+    case 'reorder': {
+      const byId = new Map(queue.map((job) => [job.id, job]))
+      printer.queue = data.order.map((id: number) => byId.get(id)).filter((job: any) => job)
+      return
+    }
+  }
+  printer.queue = queue
+}
+
 export function setupQueueSocket(printers: any) {
   socket.value.on('queue_update', (data: any) => {
     if (printers) {
       const printer = printers.value.find((p: Device) => p.id === data.printerid)
       if (printer) {
-        printer.queue = data.queue
+        if (data.op === 'snapshot') {
+          printer.queue = data.queue
+          printer.queue_epoch = data.epoch
+          printer.queue_seq = data.seq
+        } else if (printer.queue_epoch !== data.epoch) {
+          socket.value.emit('queue_resync', { printerid: printer.id })
+        } else if (printer.queue_seq !== undefined && data.seq <= printer.queue_seq) {
+          // already part of the queue we have
+        } else if (printer.queue_seq === undefined || data.seq !== printer.queue_seq + 1) {
+          socket.value.emit('queue_resync', { printerid: printer.id })
+        } else {
+          applyQueueUpdate(printer, data)
+          printer.queue_seq = data.seq
+        }
       }
     } else {
       console.error('printers or printers.value is undefined')
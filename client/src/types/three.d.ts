@@ -0,0 +1,54 @@
+// The part of three.js the toolpath viewer uses (GCode3DImageViewer.vue). three itself is the copy
+// gcode-preview depends on.
+declare module 'three' {
+    export class Vector3 {
+        x: number
+        y: number
+        z: number
+        set(x: number, y: number, z: number): this
+        distanceTo(v: Vector3): number
+    }
+
+    export class Euler {
+        x: number
+        y: number
+        z: number
+    }
+
+    export class Object3D {
+        position: Vector3
+        rotation: Euler
+        children: Object3D[]
+        add(...objects: Object3D[]): this
+        clear(): this
+        lookAt(x: number, y: number, z: number): void
+    }
+
+    export class Group extends Object3D {}
+
+    export class Camera extends Object3D {}
+
+    export class PerspectiveCamera extends Camera {
+        fov: number
+    }
+
+    export class BufferAttribute {}
+
+    export class Float32BufferAttribute extends BufferAttribute {
+        constructor(array: ArrayLike<number>, itemSize: number)
+    }
+
+    export class BufferGeometry {
+        setAttribute(name: string, attribute: BufferAttribute): this
+        dispose(): void
+    }
+
+    export class LineBasicMaterial {
+        constructor(parameters?: { color?: string | number })
+    }
+
+    export class LineSegments extends Object3D {
+        constructor(geometry?: BufferGeometry, material?: LineBasicMaterial)
+        geometry: BufferGeometry
+    }
+}
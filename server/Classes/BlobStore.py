@@ -0,0 +1,207 @@
+import glob
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+from threading import RLock
+
+
+class BlobStore:
+    # Content-addressed store for G-code files, kept on disk next to the database instead of inside it.
+    # An object is named after the SHA-256 of its uncompressed content and stored gzip-compressed at
+    # <root>/<first two hex digits>/<hash>.gz, so identical uploads and reruns share one object.
+    # Objects are written to a temporary file and renamed into place, so a reader never sees half of one.
+    #
+    # Each object is a series of gzip members of member_size uncompressed bytes (still one valid gzip
+    # file). BlobWriter.members records where they start, so openAt can start reading in the middle.
+    #
+    # An object is deleted once no job refers to it (Job.releaseBlobs), but an upload of the same
+    # content may be about to refer to it again. So an upload pins the objects it stores, in the same
+    # step as it finds them stored already or stores them, and unpins them once its job row is
+    # committed. The delete checks the pins and the references and unlinks under `lock`, which the
+    # commit and pin step takes too.
+    def __init__(self, root, member_size=1 << 20):
+        self.root = root
+        self.member_size = member_size
+        self.tmp = os.path.join(root, "tmp")
+        os.makedirs(self.tmp, exist_ok=True)
+        self.lock = RLock()
+        self.__pins = {}  # hash -> number of uploads holding it
+
+    def path(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.gz")
+
+    # Files derived from an object (indexes, toolpaths...), stored and deleted along with it
+    def sidecarPath(self, digest, name, ext="json"):
+        return os.path.join(self.root, digest[:2], f"{digest}.{name}.{ext}")
+
+    def readSidecar(self, digest, name):
+        try:
+            with open(self.sidecarPath(digest, name), "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def writeSidecar(self, digest, name, data):
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp)
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.sidecarPath(digest, name))
+
+    # Returns a temporary binary file for a sidecar, moved into place with commitSidecar
+    def sidecarWriter(self):
+        return tempfile.NamedTemporaryFile(dir=self.tmp, delete=False)
+
+    def commitSidecar(self, f, digest, name, ext):
+        f.close()
+        os.replace(f.name, self.sidecarPath(digest, name, ext))
+
+    def exists(self, digest):
+        return os.path.isfile(self.path(digest))
+
+    # Stores uncompressed content and returns its hash
+    def put(self, data):
+        with self.writer() as blob:
+            blob.write(data)
+        return blob.hash
+
+    # Returns a writer that hashes and compresses what is written to it and stores it on close.
+    # replace=True rewrites an object that is already stored (same content, new framing).
+    # pin=True pins the object as it is stored, for the caller to unpin.
+    def writer(self, replace=False, pin=False):
+        return BlobWriter(self, replace, pin)
+
+    # Keeps objects from being deleted until unpin. Returns False if one of them is not stored.
+    def pin(self, *digests):
+        with self.lock:
+            for digest in digests:
+                self.__pins[digest] = self.__pins.get(digest, 0) + 1
+            return all(self.exists(digest) for digest in digests)
+
+    def unpin(self, *digests):
+        with self.lock:
+            for digest in digests:
+                count = self.__pins.get(digest, 0) - 1
+                if count > 0:
+                    self.__pins[digest] = count
+                else:
+                    self.__pins.pop(digest, None)
+
+    def isPinned(self, digest):
+        return digest in self.__pins
+
+    # The stored object as gzip bytes
+    def read(self, digest):
+        with open(self.path(digest), "rb") as f:
+            return f.read()
+
+    # The uncompressed content as a binary stream
+    def open(self, digest):
+        return gzip.open(self.path(digest), "rb")
+
+    # The uncompressed content from offset on. members is the BlobWriter.members list of the object.
+    def openAt(self, digest, offset, members):
+        member = max((m for m in members if m[1] <= offset), key=lambda m: m[1], default=[0, 0])
+        f = open(self.path(digest), "rb")
+        f.seek(member[0])
+        stream = gzip.GzipFile(fileobj=f)
+        stream.myfileobj = f  # closed along with the stream
+        remaining = offset - member[1]
+        while remaining > 0:
+            skipped = len(stream.read(min(remaining, 1 << 16)))
+            if skipped == 0:
+                break
+            remaining -= skipped
+        return stream
+
+    # Returns the number of bytes freed
+    def delete(self, digest):
+        freed = 0
+        for path in [self.path(digest)] + glob.glob(self.sidecarPath(digest, "*", "*")):
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                freed += size
+            except FileNotFoundError:
+                pass
+        return freed
+
+    # Bytes used by the objects and their sidecars
+    def totalSize(self):
+        total = 0
+        for folder in os.scandir(self.root):
+            if folder.is_dir() and folder.path != self.tmp:
+                total += sum(entry.stat().st_size for entry in os.scandir(folder.path) if entry.is_file())
+        return total
+
+    # Returns False if the same content was already stored (and is kept as it is)
+    def commit(self, tmp_path, digest, replace=False, pin=False):
+        path = self.path(digest)
+        with self.lock:
+            if pin:
+                self.pin(digest)
+            if os.path.exists(path) and not replace:
+                os.remove(tmp_path)
+                return False
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+            return True
+
+
+class BlobWriter:
+    def __init__(self, store, replace=False, pin=False):
+        self.store = store
+        self.replace = replace
+        self.pin = pin
+        self.hash = None
+        self.created = False  # whether this write stored the object, members describe the stored file only then
+        self.size = 0  # uncompressed bytes written
+        self.members = [[0, 0]]  # [compressed offset, uncompressed offset] of each gzip member
+        fd, self.tmp_path = tempfile.mkstemp(dir=store.tmp)
+        self.__file = os.fdopen(fd, "wb")
+        self.__gzip = self.__newMember()
+        self.__sha = hashlib.sha256()
+
+    def __newMember(self):
+        # mtime=0 so the same content always compresses to the same bytes
+        return gzip.GzipFile(fileobj=self.__file, mode="wb", mtime=0)
+
+    def write(self, data):
+        self.__sha.update(data)
+        written = 0
+        while written < len(data):
+            # members are cut at fixed uncompressed offsets, whatever the size of the writes
+            room = self.store.member_size - (self.size - self.members[-1][1])
+            if room == 0:
+                self.__gzip.close()
+                self.members.append([self.__file.tell(), self.size])
+                self.__gzip = self.__newMember()
+                continue
+            part = data[written:written + room]
+            self.__gzip.write(part)
+            self.size += len(part)
+            written += len(part)
+        return len(data)
+
+    def close(self):
+        if self.hash is not None:
+            return
+        self.__gzip.close()
+        self.__file.close()
+        self.hash = self.__sha.hexdigest()
+        self.created = self.store.commit(self.tmp_path, self.hash, self.replace, self.pin)
+
+    def abort(self):
+        self.__gzip.close()
+        self.__file.close()
+        os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
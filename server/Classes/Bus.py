@@ -0,0 +1,76 @@
+from threading import Lock
+
+
+class Bus:
+    # In-process dispatch for the calls the printer threads make into the rest of the server (they
+    # used to POST to the server's own routes). A command has exactly one handler and send() returns
+    # what it returns; an event goes to every subscriber and publish() returns nothing. Both run on the
+    # caller's thread, in its app context. Handlers are registered in app.py; the HTTP routes for
+    # external clients send the same commands.
+    def __init__(self):
+        self.__handlers = {}  # command type -> handler
+        self.__subscribers = {}  # event type -> tuple of handlers, replaced on subscribe
+        self.__lock = Lock()
+
+    def handle(self, command_type, handler):
+        with self.__lock:
+            if command_type in self.__handlers:
+                raise ValueError(f"{command_type.__name__} already has a handler")
+            self.__handlers[command_type] = handler
+
+    def send(self, command):
+        handler = self.__handlers.get(type(command))
+        if handler is None:
+            raise LookupError(f"No handler for {type(command).__name__}")
+        return handler(command)
+
+    def subscribe(self, event_type, handler):
+        with self.__lock:
+            self.__subscribers[event_type] = self.__subscribers.get(event_type, ()) + (handler,)
+
+    # A failing subscriber does not keep the event from the others, or fail the publisher
+    def publish(self, event):
+        for handler in self.__subscribers.get(type(event), ()):
+            try:
+                handler(event)
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+
+
+# commands
+
+class RepairPorts:
+    # Points registered printers whose port moved (replugged, renumbered) at their new device
+    pass
+
+
+class RestoreQueue:
+    # Restarts a printer's thread with its queue kept, in the given status (a reset out of "error")
+    def __init__(self, printer_id, status):
+        self.printer_id = printer_id
+        self.status = status
+
+
+class UpdateJobStatus:
+    # Writes a job's status now, for the clients that set it over HTTP. Returns what
+    # Job.update_job_status returns: the result, or a 404 or 500 response
+    def __init__(self, job_id, status):
+        self.job_id = job_id
+        self.status = status
+
+
+# events
+
+class JobStatusReported:
+    # A printer moved one of its jobs to a new status (printing, complete, error, cancelled)
+    def __init__(self, printer_id, job_id, status):
+        self.printer_id = printer_id
+        self.job_id = job_id
+        self.status = status
+
+
+class JobReleased:
+    # A queued job was released to print (the user confirmed the bed is clear)
+    def __init__(self, printer_id, job_id):
+        self.printer_id = printer_id
+        self.job_id = job_id
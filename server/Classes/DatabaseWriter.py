@@ -0,0 +1,63 @@
+import queue
+import time
+from threading import Event, Thread
+
+
+class DatabaseWriter(Thread):
+    # One background thread for the database writes nobody waits on, like the job statuses reported
+    # by the printer threads. write() only queues the statement. The thread gathers what comes in
+    # for up to `interval` seconds (or `batch_size` writes), keeps the last write per key, so a job
+    # that went printing then complete in the meantime is written once, and hands the batch to
+    # `apply`, which runs it in one transaction (see app.py): one commit and one turn on the SQLite
+    # write lock per batch instead of one per status.
+    def __init__(self, apply, batch_size, interval):
+        super().__init__(daemon=True)
+        self.apply = apply
+        self.batch_size = batch_size
+        self.interval = interval
+        self.queue = queue.Queue()
+        self.written = 0  # statements applied
+        self.batches = 0  # commits
+
+    def run(self):
+        while True:
+            pending, waiting = {}, []
+            item = self.queue.get()
+            deadline = time.monotonic() + self.interval
+            while True:
+                if isinstance(item, Event):
+                    waiting.append(item)  # flush(): write what is pending now
+                    break
+                key, statement = item
+                pending.pop(key, None)
+                pending[key] = statement
+                remaining = deadline - time.monotonic()
+                if len(pending) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if pending:
+                try:
+                    self.apply(list(pending.values()))
+                    self.written += len(pending)
+                    self.batches += 1
+                except Exception as e:
+                    print(f"Unexpected error: {e}")
+            for done in waiting:
+                done.set()
+
+    # Statements with the same key replace each other until they are written; without a key
+    # every statement is written
+    def write(self, statement, key=None):
+        self.queue.put((object() if key is None else key, statement))
+
+    # Blocks until everything written before has been committed, so a direct write that follows
+    # cannot be overwritten by an older queued one
+    def flush(self, timeout=None):
+        if not self.is_alive():
+            return False
+        done = Event()
+        self.queue.put(done)
+        return done.wait(timeout)
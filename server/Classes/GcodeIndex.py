@@ -0,0 +1,96 @@
+import re
+import zlib
+
+
+class GcodeIndex:
+    # Where the lines and layers of an uploaded G-code file start, built while the file is stored
+    # (see readLines) and kept next to it in the blob store. With the gzip member offsets of the
+    # stored object it lets a line, layer or byte range be read without decompressing the whole file.
+    STEP = 1000  # a line checkpoint every STEP lines
+
+    def __init__(self):
+        self.lines = 0
+        self.size = 0
+        self.checkpoints = []  # byte offset of line n * STEP
+        self.layers = []  # [first line, byte offset, layer height or None] of each ;LAYER_CHANGE
+        self.__layer_change = False
+
+    # raw is one line of the file as bytes, with its newline
+    def add(self, raw):
+        if self.lines % self.STEP == 0:
+            self.checkpoints.append(self.size)
+        if raw.startswith(b";LAYER_CHANGE"):
+            self.layers.append([self.lines, self.size, None])
+            self.__layer_change = True
+        elif self.__layer_change:
+            # the ";Z:" comment right after ";LAYER_CHANGE" holds the layer height
+            match = re.match(rb";Z:(\d+\.?\d*)", raw)
+            if match:
+                self.layers[-1][2] = float(match.group(1))
+            self.__layer_change = False
+        self.lines += 1
+        self.size += len(raw)
+
+    def toJson(self, members):
+        return {
+            "lines": self.lines,
+            "size": self.size,
+            "step": self.STEP,
+            "checkpoints": self.checkpoints,
+            "layers": self.layers,
+            "members": members,
+        }
+
+
+# [start, end) byte offsets of layers first to last - 1. Anything before the first layer (start
+# G-code) belongs to layer 0, the last layer runs to the end of the file.
+def layerBytes(index, first, last):
+    layers = index["layers"]
+    if not layers:
+        return 0, index["size"]
+    first = max(0, min(first, len(layers)))
+    last = max(first, min(last, len(layers)))
+    start = 0 if first == 0 else layers[first][1] if first < len(layers) else index["size"]
+    end = layers[last][1] if last < len(layers) else index["size"]
+    return start, end
+
+
+# Yields bytes start to end - 1 of the stored file
+def readByteRange(store, digest, index, start, end, chunk_size=1 << 16):
+    start = max(0, min(start, index["size"]))
+    end = max(start, min(end, index["size"]))
+    with store.openAt(digest, start, index["members"]) as stream:
+        remaining = end - start
+        while remaining > 0:
+            chunk = stream.read(min(chunk_size, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+# Yields lines first to last - 1 of the stored file, starting from the closest checkpoint
+def readLineRange(store, digest, index, first, last):
+    first = max(0, min(first, index["lines"]))
+    last = max(first, min(last, index["lines"]))
+    if first == last:
+        return
+    checkpoint = first // index["step"]
+    with store.openAt(digest, index["checkpoints"][checkpoint], index["members"]) as stream:
+        for _ in range(first - checkpoint * index["step"]):
+            stream.readline()
+        for _ in range(last - first):
+            line = stream.readline()
+            if not line:
+                break
+            yield line
+
+
+# gzip-compresses a stream of chunks as it goes, for a Content-Encoding: gzip response
+def gzipStream(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,134 @@
+import re
+
+
+# Strips whitespace and inline comments from a G-code line. Returns "" for empty and comment-only lines.
+def stripComment(line):
+    line = line.strip()
+    if ";" in line:  # Remove inline comments
+        line = line.split(";")[0].strip()
+    return line
+
+
+def parseTimeEstimate(comment_lines):
+    # job_line can look two ways:
+    # 1. ;TIME:seconds
+    # 2. ; estimated printing time (normal mode) = minutes seconds
+    # if first line contains "FLAVOR", then the second line contains the time estimate in the format of ";TIME:seconds"
+    if "FLAVOR" in comment_lines[0]:
+        time_line = comment_lines[1]
+        time_seconds = int(time_line.split(":")[1])
+    else:
+        # search for the line that contains "printing time", then the time estimate is in the format of "; estimated printing time (normal mode) = minutes seconds"
+        time_line = next(line for line in comment_lines if "time" in line)
+        time_values = re.findall(r'\d+', time_line)
+
+        # Initialize all time units to 0
+        time_days = time_hours = time_minutes = time_seconds = 0
+
+        # Assign values from right to left (seconds, minutes, hours, days)
+        time_values = time_values[::-1]
+        if len(time_values) > 0:
+            time_seconds = int(time_values[0])
+        if len(time_values) > 1:
+            time_minutes = int(time_values[1])
+        if len(time_values) > 2:
+            time_hours = int(time_values[2])
+        if len(time_values) > 3:
+            time_days = int(time_values[3])
+
+        # Calculate total time in seconds
+        time_seconds = time_days * 24 * 60 * 60 + time_hours * 60 * 60 + time_minutes * 60 + time_seconds
+    return time_seconds
+
+
+class GcodeScanner:
+    # Collects the command count, the layer index and the slicer metadata of a G-code file one line
+    # at a time, so a file never has to be held in memory to find them.
+    def __init__(self):
+        self.total_lines = 0  # lines that are actually sent to the printer
+        self.max_layer_height = 0.0
+        # [command index, layer height] for every layer comment. The height is None when the
+        # slicer does not write a ";Z:" line after ";LAYER_CHANGE".
+        self.layers = []
+        self.comment_head = []  # first two comment lines, where the ;FLAVOR / ;TIME header lives
+        self.time_line = None  # first comment line that mentions the print time
+        self.__layer_change = False
+
+    # Returns the command itself (without comment) if the line is sent to the printer, else ""
+    def feed(self, line):
+        if "layer" in line.lower() and line.lstrip().startswith(";"):
+            if not self.layers or self.layers[-1][0] != self.total_lines:
+                self.layers.append([self.total_lines, None])
+
+        if line.startswith(";") and line.strip():
+            # the ";Z:" comment right after ";LAYER_CHANGE" holds the layer height. The last one is the max.
+            if self.__layer_change:
+                match = re.search(r";Z:(\d+\.?\d*)", line)
+                if match:
+                    self.max_layer_height = float(match.group(1))
+                    self.layers[-1][1] = self.max_layer_height
+            self.__layer_change = ";LAYER_CHANGE" in line
+
+            if len(self.comment_head) < 2:
+                self.comment_head.append(line)
+            if self.time_line is None and "time" in line:
+                self.time_line = line
+            return ""
+
+        command = stripComment(line)
+        if command:
+            self.total_lines += 1
+        return command
+
+    def getTotalTime(self):
+        if not self.comment_head:
+            return 0
+        comment_lines = list(self.comment_head)
+        if self.time_line is not None:
+            comment_lines.append(self.time_line)
+        try:
+            return parseTimeEstimate(comment_lines)
+        except (StopIteration, IndexError, ValueError):
+            # no estimate in a format we know
+            return 0
+
+    def getMetadata(self):
+        return {
+            "total_lines": self.total_lines,
+            "max_layer_height": self.max_layer_height,
+            "total_time": self.getTotalTime(),
+            "layers": self.layers,
+        }
+
+
+# Yields the lines of a binary stream read in chunks of chunk_size. Every chunk is also written to
+# sink (if given), so a file can be stored and scanned in the same pass, and every raw line is added
+# to index (a GcodeIndex, if given).
+def readLines(stream, sink=None, index=None, chunk_size=1 << 16):
+    rest = b""
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        if sink is not None:
+            sink.write(chunk)
+        *lines, rest = (rest + chunk).split(b"\n")
+        for line in lines:
+            if index is not None:
+                index.add(line + b"\n")
+            yield line.decode("utf-8", errors="replace") + "\n"
+    if rest:
+        if index is not None:
+            index.add(rest)
+        yield rest.decode("utf-8", errors="replace")
+
+
+# Compiles G-code into the stream parseGcode sends: one command per line, no comments or blank
+# lines. Commands are written to the binary stream `out` as they are read; returns the metadata.
+def compileGcode(lines, out):
+    scan = GcodeScanner()
+    for line in lines:
+        command = scan.feed(line)
+        if command:
+            out.write(f"{command}\n".encode("utf-8"))
+    return scan.getMetadata()
@@ -0,0 +1,153 @@
+import gzip
+import logging
+import logging.handlers
+import queue
+import time
+from threading import Event, Lock, Thread
+
+
+class JobLogWriter(Thread):
+    # One background thread that formats and writes the log records of every running job. The
+    # threads feeding the printers only put records on a bounded queue (see JobLogHandler). The
+    # writer takes them in batches. The console is flushed once per batch; the compressed log files
+    # every flush_interval seconds (and when idle), which keeps them readable while the job runs
+    # without sync-flushing the compressor for every few lines.
+    def __init__(self, maxsize, batch_size, flush_interval):
+        super().__init__(daemon=True)
+        self.queue = queue.Queue(maxsize)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.__unflushed = set()  # file targets written since the last flush
+        self.__last_flush = time.monotonic()
+
+    def run(self):
+        while True:
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                self.__flushFiles()
+                continue
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            consoles = set()
+            for handler, record in batch:
+                if isinstance(record, Event):
+                    # everything this job logged before closing is in the files by now
+                    self.__close(handler)
+                    record.set()
+                    continue
+                for target in handler.targets:
+                    if record.levelno >= target.level:
+                        target.handle(record)
+                        if isinstance(target, logging.FileHandler):
+                            self.__unflushed.add(target)
+                        else:
+                            consoles.add(target)
+            for target in consoles:
+                target.flush()
+            if time.monotonic() - self.__last_flush >= self.flush_interval:
+                self.__flushFiles()
+
+    def __flushFiles(self):
+        for target in self.__unflushed:
+            target.flush()
+        self.__unflushed.clear()
+        self.__last_flush = time.monotonic()
+
+    def __close(self, handler):
+        if handler.dropped:
+            record = logging.makeLogRecord({
+                "name": handler.name, "module": "JobLogWriter", "levelno": logging.WARNING, "levelname": "WARNING",
+                "msg": f"{handler.dropped} log records were dropped because the log buffer was full",
+            })
+            for target in handler.targets:
+                target.handle(record)
+        for target in handler.targets:
+            target.close()
+            self.__unflushed.discard(target)
+
+
+class JobLogHandler(logging.handlers.QueueHandler):
+    # Replaces the console and file handlers on a job's logger. emit only queues the record; the
+    # targets are formatted and written on the JobLogWriter thread. When the buffer is full the
+    # record is dropped and counted, and the count is written to the log when it is closed.
+    def __init__(self, writer, targets):
+        super().__init__(writer.queue)
+        self.writer = writer
+        self.targets = targets
+        self.dropped = 0
+        self.__closed = False
+
+    def prepare(self, record):
+        return record  # formatted on the writer thread
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait((self, record))
+        except queue.Full:
+            self.dropped += 1
+
+    # Blocks until the writer has written this job's records and closed its files, for up to timeout
+    # seconds. If the writer thread is gone the files are closed here, with what it had written.
+    # Returns False if they were not closed in time.
+    def close(self, timeout=10):
+        if self.__closed:
+            return True
+        self.__closed = True
+        try:
+            if not self.writer.is_alive():
+                for target in self.targets:
+                    target.close()
+                return True
+            done = Event()
+            try:
+                self.queue.put((self, done), timeout=timeout)
+            except queue.Full:
+                return False
+            return done.wait(timeout)
+        finally:
+            super().close()
+
+
+class BatchedStreamHandler(logging.StreamHandler):
+    # Leaves flushing to the writer, once per batch
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+class GzipFileHandler(logging.FileHandler):
+    # Writes the log gzip-compressed as it goes, so there is nothing left to compress when the job
+    # ends. Each flush is a zlib sync point: the file reads back (zcat) up to there while it is open.
+    def __init__(self, filename, mode="w"):
+        super().__init__(filename, mode=mode, encoding="utf-8")
+
+    def _open(self):
+        return gzip.open(self.baseFilename, self.mode + "t", encoding=self.encoding)
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+
+
+writer = None
+writer_lock = Lock()
+
+
+def getWriter(maxsize, batch_size, flush_interval):
+    global writer
+    with writer_lock:
+        if writer is None:
+            writer = JobLogWriter(maxsize, batch_size, flush_interval)
+            writer.start()
+    return writer
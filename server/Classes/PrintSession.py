@@ -0,0 +1,320 @@
+import time
+import traceback
+from collections import deque
+from datetime import datetime
+
+from models.config import Config
+
+# commands that block the firmware or change the print state. These are never pipelined:
+# everything in flight is acknowledged before they are sent, and nothing follows them until they are.
+SYNC_COMMANDS = ("M0", "M1", "M600", "M601", "M602")
+
+# session states
+SENDING = "sending"  # feeding commands while the window has room
+DRAINING = "draining"  # waiting for every in-flight command before a pause, color change or the end
+SYNC = "sync"  # waiting for the "ok" of a command the server sent itself (M601, M602, M600)
+PAUSED = "paused"  # M601 acknowledged, waiting for the status to go back to printing
+RESUMING = "resuming"  # M602 acknowledged, giving the printer 2 seconds before sending again
+DONE = "done"
+
+
+def isSync(command):
+    return command.split()[0].upper() in SYNC_COMMANDS
+
+
+class PrintSession:
+    # State machine for one print. It never waits by itself: it is fed events (onLine for every
+    # response line, onTimeout when the printer has been silent for a read timeout, tick about once
+    # a second) and writes to the printer whenever the window allows. The SerialReactor drives the
+    # sessions of every printer from one thread; runBlocking drives a single one on the caller's thread.
+    def __init__(self, printer, job, commands, logger, logFile, onDone=None):
+        self.printer = printer
+        self.job = job
+        self.commands = commands  # compiled command stream, one command per line
+        self.logger = logger
+        self.logFile = logFile
+        self.onDone = onDone
+        self.state = SENDING
+        self.verdict = None
+
+        gcode_meta = job.getGcodeMeta()
+        self.total_lines = gcode_meta["total_lines"]
+        # [command index, layer height] of each layer, and the next one to reach
+        self.layers = gcode_meta["layers"]
+        self.next_layer = 0
+        self.command_index = 0  # commands taken from the stream
+        self.sent_lines = 0  # commands acknowledged by the printer
+        self.next_command = None
+
+        # (command, bytes, from file) for every command written and not acknowledged yet
+        self.inflight = deque()
+        self.inflight_bytes = 0
+        self.after_drain = None
+        self.after_sync = None
+        self.resume_at = 0
+
+        # commands per second, reported every few seconds and at the end of the print
+        self.send_start = time.monotonic()
+        self.last_rate_update = self.send_start
+
+    def start(self):
+        self.printer.responseCount = 0
+        self.pump()
+
+    # Blocking driver: one printer, one thread. Used where the reactor is not available.
+    def runBlocking(self):
+        self.start()
+        while self.state != DONE:
+            if self.state == PAUSED:
+                # setStatus wakes the printer up when the print is resumed or cleared
+                self.printer.waitFor(lambda: self.printer.getStatus() in ("printing", "complete") or self.printer.terminated == 1, 1)
+                self.tick()
+                continue
+            if self.state == RESUMING:
+                time.sleep(max(0, self.resume_at - time.monotonic()))
+                self.tick()
+                continue
+            try:
+                response = self.printer.ser.readline().decode("utf-8").strip()
+            except Exception as e:
+                self.fail(e)
+                break
+            if response == "":
+                self.onTimeout()
+            else:
+                self.onLine(response)
+            self.tick()
+        return self.verdict
+
+    # --- events ---
+
+    def onLine(self, response):
+        if self.state == DONE:
+            return
+        try:
+            response = self.printer.handleResponse(response, self.logger)
+            if response is None:  # the printer reported an error
+                return self.finish("error")
+
+            if "ok" in response and self.inflight:
+                command, size, from_file = self.inflight.popleft()
+                self.inflight_bytes -= size
+                if from_file:
+                    self.logger.info(f"Command: {command}, Received: {response}")
+                    self.afterAck(command)
+                elif self.state == SYNC and not self.inflight:
+                    self.logger.info(f"Command: {command}, Received: {response}")
+                    self.state, action = SENDING, self.after_sync
+                    self.after_sync = None
+                    action()
+            self.pump()
+        except Exception as e:
+            self.fail(e)
+
+    def onTimeout(self):
+        if self.state == DONE:
+            return
+        try:
+            self.printer.handleResponse("", self.logger)
+        except Exception as e:
+            self.fail(e)
+
+    def tick(self):
+        if self.state == DONE:
+            return
+        try:
+            if self.printer.terminated == 1:
+                return self.finish(None)
+
+            if self.state == PAUSED:
+                stat = self.printer.getStatus()
+                if stat == "printing":
+                    self.printer.prevMes = "M602"
+                    self.sendSync("M602", self.resumed)  # resume command for prusa
+                elif stat == "complete":
+                    self.finish("cancelled")
+
+            elif self.state == RESUMING and time.monotonic() >= self.resume_at:
+                self.job.setTime(self.job.colorEta(), 1)
+                self.job.setTime(self.job.calculateColorChangeTotal(), 0)
+                self.job.setTime(datetime.min, 3)
+                self.state = SENDING
+                self.pump()
+        except Exception as e:
+            self.fail(e)
+
+    def fail(self, e):
+        if self.state == DONE:
+            return
+        self.logger.error(e)
+        self.logger.error("".join(traceback.format_exception(None, e, e.__traceback__)))
+        self.printer.setError(e)
+        self.finish("error")
+
+    # --- sending ---
+
+    def pump(self):
+        if self.state == DRAINING and not self.inflight:
+            self.state, action = SENDING, self.after_drain
+            self.after_drain = None
+            action()
+
+        while self.state == SENDING:
+            if self.printer.terminated == 1:
+                return self.finish(None)
+
+            if self.next_command is None:
+                line = self.commands.readline()
+                if line == "":
+                    # end of file: wait for the printer to acknowledge the commands still in flight
+                    return self.drainThen(self.complete)
+                self.next_command = line.strip()
+                if len(self.next_command) == 0:
+                    self.next_command = None
+                    continue
+
+            if not self.hasRoom(self.next_command):
+                return
+            command, self.next_command = self.next_command, None
+            self.beforeSend(command)
+            self.write(command, True)
+
+    def hasRoom(self, command):
+        if not self.inflight:
+            return True
+        if not self.printer.isStreaming() or isSync(command) or isSync(self.inflight[-1][0]):
+            return False
+        return (
+            len(self.inflight) < Config['streaming_window']
+            and self.inflight_bytes + len(command) + 1 <= Config['streaming_rx_buffer']
+        )
+
+    def write(self, command, from_file):
+        data = f"{command}\n".encode("utf-8")
+        self.printer.ser.write(data)
+        self.inflight.append((command, len(data), from_file))
+        self.inflight_bytes += len(data)
+        self.logger.debug(f"Command: {command}")
+
+    def sendSync(self, command, then):
+        self.state = SYNC
+        self.after_sync = then
+        self.write(command, False)
+
+    def drainThen(self, action):
+        self.state = DRAINING
+        self.after_drain = action
+        if not self.inflight:
+            self.pump()
+
+    # --- per command bookkeeping ---
+
+    def beforeSend(self, command):
+        job = self.job
+        # layer comments were stripped at upload; the layer index tells where each layer starts
+        while self.next_layer < len(self.layers) and self.layers[self.next_layer][0] <= self.command_index:
+            current_layer_height = self.layers[self.next_layer][1]
+            self.next_layer += 1
+            if self.printer.status == 'colorchange' and job.getFilePause() == 0 and self.printer.colorbuff == 0:
+                self.printer.setColorChangeBuffer(1)
+            if current_layer_height is not None:
+                job.setCurrentLayerHeight(current_layer_height)
+        self.command_index += 1
+
+        if ("M569" in command or "M107" in command) and job.getTimeStarted() == 0:
+            job.setTimeStarted(1)
+            job.setTime(job.calculateEta(), 1)
+            job.setTime(datetime.now(), 2)
+
+    def afterAck(self, command):
+        job = self.job
+        printer = self.printer
+
+        if job.getFilePause() == 1:
+            job.setTime(job.colorEta(), 1)
+            job.setTime(job.calculateColorChangeTotal(), 0)
+            job.setTime(datetime.min, 3)
+            job.setFilePause(0)
+            if printer.getStatus() == "complete":
+                return self.finish("cancelled")
+            printer.setStatus("printing")
+
+        if "M600" in command:
+            job.setTime(datetime.now(), 3)
+            printer.setStatus("colorchange")
+            job.setFilePause(1)
+
+        if "M569" in command and job.getExtruded() == 0:
+            job.setExtruded(1)
+
+        if printer.prevMes == "M602":
+            printer.prevMes = ""
+
+        # software pausing
+        if printer.getStatus() == "paused" and self.state == SENDING:
+            self.drainThen(self.pause)
+
+        # software color change
+        if (printer.getStatus() == "colorchange" and job.getFilePause() == 0 and printer.colorbuff == 1
+                and self.state == SENDING):
+            self.drainThen(self.colorChange)
+
+        # Increment the sent lines and calculate the progress
+        self.sent_lines += 1
+        job.setSentLines(self.sent_lines)
+        job.setProgress((self.sent_lines / self.total_lines) * 100)
+
+        now = time.monotonic()
+        if now - self.last_rate_update >= 5:
+            printer.setSendRate(self.sent_lines / (now - self.send_start))
+            self.last_rate_update = now
+
+        if printer.getStatus() == "complete":
+            return self.finish("cancelled")
+        if printer.getStatus() == "error":
+            return self.finish("error")
+
+    def pause(self):
+        self.sendSync("M601", self.paused)  # pause command for prusa
+
+    def paused(self):
+        self.job.setTime(datetime.now(), 3)
+        self.state = PAUSED
+
+    def resumed(self):
+        self.state = RESUMING
+        self.resume_at = time.monotonic() + 2
+
+    def colorChange(self):
+        self.job.setTime(datetime.now(), 3)
+        print("SENDING COLORCHANGE")
+        self.sendSync("M600", self.colorChanged)  # color change command
+
+    def colorChanged(self):
+        self.job.setTime(self.job.colorEta(), 1)
+        self.job.setTime(self.job.calculateColorChangeTotal(), 0)
+        self.job.setTime(datetime.min, 3)
+        self.job.setFilePause(1)
+        self.printer.setColorChangeBuffer(0)
+
+    def complete(self):
+        if self.printer.getStatus() == "error":
+            return self.finish("error")
+        self.finish("complete")
+
+    def finish(self, verdict):
+        if self.state == DONE:
+            return
+        self.state = DONE
+        self.verdict = verdict
+
+        elapsed = time.monotonic() - self.send_start
+        if elapsed > 0:
+            self.printer.setSendRate(self.sent_lines / elapsed)
+        mode = 'streaming' if self.printer.isStreaming() else 'one at a time'
+        self.logger.info(f"Sent {self.sent_lines} commands in {elapsed:.1f}s ({self.printer.sendRate:.1f} commands/s, {mode})")
+
+        # the log is closed and compressed by whoever runs the session, off the reactor thread
+        self.commands.close()
+        if self.onDone:
+            self.onDone(self, verdict)
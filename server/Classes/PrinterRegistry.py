@@ -0,0 +1,142 @@
+import heapq
+from threading import RLock
+
+
+class PrinterRegistry:
+    # The printer threads of PrinterStatusService (PrinterThread or PrinterTask, each with its
+    # .printer), in display order and indexed by printer id, hwid and device. Request threads, printer
+    # threads and the reactor all read it while resets and reorders change it, so every change and
+    # every lookup that spans indexes holds the lock; iteration goes over a snapshot.
+    #
+    # smallestQueue() answers from a heap of (queue size, display position, printer id). The queues
+    # report their new size as jobs come and go (Queue.watch) and a fresh entry is pushed; entries that
+    # no longer match the printer's size or position are dropped when they reach the top. The printer
+    # is woken up too, so a job added to an idle printer starts right away.
+    def __init__(self):
+        self.__lock = RLock()
+        self.__threads = []  # display order
+        self.__by_id = {}
+        self.__by_hwid = {}
+        self.__by_device = {}
+        self.__positions = {}  # printer id -> index in __threads
+        self.__sizes = {}  # printer id -> queue size
+        self.__heap = []
+
+    def __iter__(self):
+        return iter(self.threads())
+
+    def __len__(self):
+        return len(self.__threads)
+
+    def threads(self):
+        with self.__lock:
+            return list(self.__threads)
+
+    def add(self, thread):
+        printer = thread.printer
+        with self.__lock:
+            old = self.__by_id.get(printer.id)
+            # before the size is read in __index, so no change in between goes unseen
+            printer.getQueue().watch(lambda size: self.__resized(printer, size))
+            if old is not None:
+                # a reset thread takes the place of the one it replaces
+                self.__unindex(old)
+                self.__threads[self.__threads.index(old)] = thread
+            else:
+                self.__threads.append(thread)
+            self.__index(thread)
+            self.__reposition()
+
+    def remove(self, printer_id):
+        with self.__lock:
+            thread = self.__by_id.pop(printer_id, None)
+            if thread is None:
+                return None
+            self.__threads.remove(thread)
+            self.__unindex(thread)
+            self.__sizes.pop(printer_id, None)
+            self.__reposition()
+            return thread
+
+    def get(self, printer_id):
+        return self.__by_id.get(printer_id)
+
+    def getPrinter(self, printer_id):
+        thread = self.__by_id.get(printer_id)
+        return thread.printer if thread else None
+
+    def byHwid(self, hwid):
+        return self.__by_hwid.get(hwid)
+
+    def byDevice(self, device):
+        return self.__by_device.get(device)
+
+    # Moves a printer to another port, in its thread and in the index
+    def setDevice(self, printer_id, device):
+        with self.__lock:
+            thread = self.__by_id.get(printer_id)
+            if thread is None:
+                return None
+            if self.__by_device.get(thread.printer.device) is thread:
+                del self.__by_device[thread.printer.device]
+            thread.printer.setDevice(device)
+            self.__by_device[device] = thread
+            return thread
+
+    # printer_ids in the order they are displayed; printers left out are dropped, like before
+    def reorder(self, printer_ids):
+        with self.__lock:
+            threads = [self.__by_id[printer_id] for printer_id in dict.fromkeys(printer_ids) if printer_id in self.__by_id]
+            kept = set(map(id, threads))
+            for thread in self.__threads:
+                if id(thread) not in kept:
+                    self.__unindex(thread)
+                    self.__by_id.pop(thread.printer.id, None)
+                    self.__sizes.pop(thread.printer.id, None)
+            self.__threads = threads
+            self.__reposition()
+
+    # The ids of the jobs in every printer's queue, printing ones included
+    def queuedJobIds(self):
+        return {job.id for thread in self.threads() for job in thread.printer.getQueue().getQueue()}
+
+    # The id of the printer with the fewest queued jobs, the first displayed of those on a tie
+    def smallestQueue(self):
+        with self.__lock:
+            heap = self.__heap
+            while heap:
+                size, position, printer_id = heap[0]
+                if self.__sizes.get(printer_id) == size and self.__positions.get(printer_id) == position:
+                    return printer_id
+                heapq.heappop(heap)
+            return None
+
+    def __index(self, thread):
+        printer = thread.printer
+        self.__by_id[printer.id] = thread
+        self.__by_hwid[printer.hwid] = thread
+        self.__by_device[printer.device] = thread
+        self.__sizes[printer.id] = printer.getQueue().getSize()
+
+    def __unindex(self, thread):
+        printer = thread.printer
+        if self.__by_hwid.get(printer.hwid) is thread:
+            del self.__by_hwid[printer.hwid]
+        if self.__by_device.get(printer.device) is thread:
+            del self.__by_device[printer.device]
+
+    # positions change on add, remove and reorder: the heap is rebuilt
+    def __reposition(self):
+        self.__positions = {thread.printer.id: position for position, thread in enumerate(self.__threads)}
+        self.__heap = [(self.__sizes[printer_id], position, printer_id) for printer_id, position in self.__positions.items()]
+        heapq.heapify(self.__heap)
+
+    def __resized(self, printer, size):
+        with self.__lock:
+            if printer.id not in self.__positions:
+                return
+            self.__sizes[printer.id] = size
+            heapq.heappush(self.__heap, (size, self.__positions[printer.id], printer.id))
+            if len(self.__heap) > 4 * len(self.__positions) + 64:
+                self.__reposition()  # drop the stale entries
+        printer.wake()  # a job may be waiting for it now
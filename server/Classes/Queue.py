@@ -1,14 +1,43 @@
-from collections import deque
+import uuid
+from threading import RLock
 from flask import jsonify, current_app
 
 
+class QueueNode:
+    __slots__ = ("job", "prev", "next")
+
+    def __init__(self, job=None):
+        self.job = job
+        self.prev = self.next = self
+
+
 class Queue:
     # Only adding ID to the queue
+    #
+    # Every change is broadcast as a "queue_update" op (insert, remove, move, reorder) with a sequence
+    # number instead of the whole queue. A client that misses a number asks for a "snapshot" with
+    # "queue_resync". The lock keeps the ops in the same order as the sequence numbers. Every op and
+    # snapshot also carries the queue's epoch, a random id: a queue made by a reset or a restart counts
+    # from 0 again, and the new epoch tells the clients to resync instead of skipping its first ops.
+    #
+    # The jobs are a doubly linked list of QueueNodes around a sentinel (__root: next is the first job,
+    # prev the last) with a job id -> node index, so finding, removing and moving a job does not walk
+    # the queue. Positions are only needed for the "to" of a bump. They are kept as id -> position +
+    # __base, which stays true through adds and removes at either end and through bumps; a change
+    # anywhere else marks them stale, and the next bump counts them again.
     def __init__(self):
-        self.__queue = deque()  # use Python double-ended queue
-
-    def __iter__(self):  # iterate over queue
-        return iter(self.__queue)
+        self.__root = QueueNode()
+        self.__nodes = {}  # job id -> node
+        self.__positions = {}  # job id -> index + __base
+        self.__base = 0
+        self.__stale = False  # the positions have to be counted again
+        self.__seq = 0
+        self.__epoch = uuid.uuid4().hex
+        self.__lock = RLock()
+        self.__watcher = None
+
+    def __iter__(self):  # iterate over a copy, the queue can change meanwhile
+        return iter(self.getQueue())
     
     # def setToInQueue(self): 
     #     for job in self.__queue: 
@@ -19,154 +48,206 @@ class Queue:
         print("Adding job to back of queue ", job.id)
         print("Adding job to back of queue ", printerid)
 
-        if self.__queue.count(job) > 0:
-            raise Exception("Job ID already in queue.")
-        self.__queue.append(
-            job
-        )  # appending on the right is the "front" because popping takes out from right d
-        current_app.socketio.emit(
-            "queue_update", {"queue": self.convertQueueToJson(), "printerid": printerid}
-        )
+        with self.__lock:
+            if job.id in self.__nodes:
+                raise Exception("Job ID already in queue.")
+            self.__link(QueueNode(job), self.__root.prev)
+            self.__publish(printerid, "insert", index=len(self.__nodes) - 1, job=self.convertJobToJson(job))
 
     def addToFront(self, job, printerid):
-        if self.__queue.count(job) > 0:
-            raise Exception("Job ID already in queue.")
-        # If the queue has at least one job and the first job is printing,
-        # insert at the second position because we don't want to interrupt it.
-        if len(self.__queue) >= 1 and self.__queue[0].status == "printing":
-            self.__queue.insert(1, job)
-        # If the queue is empty or the first job is not printing,
-        # add the job to the front
-        else:
-            self.__queue.appendleft(job)
-        current_app.socketio.emit(
-            "queue_update", {"queue": self.convertQueueToJson(), "printerid": printerid}
-        )
-
-    def bump(self, up, jobid):  # up = boolean. if up = true bump up, else bump down
-        index = next(
-            (
-                index
-                for index, queued_job in enumerate(self.__queue)
-                if queued_job.id == jobid
-            ),
-            -1,
-        )
-        if index == -1:
-            print("Job not found in queue.")
-            return
-        job_to_move = self.__queue[index]
-        self.__queue.remove(job_to_move)
-        if up == True and index > 0:
-            self.__queue.insert(index - 1, job_to_move)
-        elif not up and index < len(self.__queue):
-            self.__queue.insert(index + 1, job_to_move)
+        with self.__lock:
+            if job.id in self.__nodes:
+                raise Exception("Job ID already in queue.")
+            index = self.__frontIndex()
+            self.__link(QueueNode(job), self.__root if index == 0 else self.__root.next)
+            self.__publish(printerid, "insert", index=index, job=self.convertJobToJson(job))
+
+    def bump(self, up, jobid, printerid=None):  # up = boolean. if up = true bump up, else bump down
+        with self.__lock:
+            node = self.__nodes.get(jobid)
+            if node is None:
+                print("Job not found in queue.")
+                return
+            other = node.prev if up == True else node.next
+            if other is self.__root:
+                return
+            positions = self.__countPositions()
+            target = positions[other.job.id] - self.__base
+            # the two neighbours swap jobs, nothing else moves
+            node.job, other.job = other.job, node.job
+            self.__nodes[node.job.id], self.__nodes[other.job.id] = node, other
+            positions[node.job.id], positions[other.job.id] = positions[other.job.id], positions[node.job.id]
+            self.__publish(printerid, "move", jobid=jobid, to=target)
         
-    def reorder(self, arr): 
-        # arr is an array of job ids in the order they should be in the queue
-        new_queue = deque()
-        for jobid in arr: 
-            for job in self.__queue: 
-                if job.getJobId() == jobid: 
-                    new_queue.append(job)
-                    break
-        self.__queue = new_queue
+    def reorder(self, arr, printerid=None): 
+        # arr is an array of job ids in the order they should be in the queue; jobs left out are dropped
+        with self.__lock:
+            nodes = [self.__nodes[jobid] for jobid in dict.fromkeys(arr) if jobid in self.__nodes]
+            self.__root.prev = self.__root.next = self.__root
+            self.__nodes = {}
+            self.__positions, self.__base, self.__stale = {}, 0, False
+            for node in nodes:
+                self.__link(node, self.__root.prev)
+            self.__publish(printerid, "reorder", order=[node.job.id for node in nodes])
     
     def deleteJob(self, jobid, printerid):
-        deletedjob = None
-        for job in self.__queue:
-            if job.getJobId() == jobid:
-                deletedjob = job
-                self.__queue.remove(job)
-                current_app.socketio.emit(
-                    "queue_update",
-                    {"queue": self.convertQueueToJson(), "printerid": printerid},
-                )
-                return deletedjob
-        return "Job not found in queue."
+        with self.__lock:
+            node = self.__nodes.get(jobid)
+            if node is None:
+                return "Job not found in queue."
+            self.__unlink(node)
+            self.__publish(printerid, "remove", jobid=jobid)
+            return node.job
+
+    # The whole queue with the sequence number it is at, for resyncing clients
+    def snapshot(self, printerid):
+        with self.__lock:
+            return {"printerid": printerid, "epoch": self.__epoch, "seq": self.__seq, "op": "snapshot",
+                    "queue": self.convertQueueToJson()}
+
+    def getSeq(self):
+        return self.__seq
+
+    # callback(size) is called after every change that adds or removes jobs (PrinterRegistry keeps
+    # its queue sizes with it)
+    def watch(self, callback):
+        self.__watcher = callback
+
+    def __publish(self, printerid, op, **change):
+        self.__seq += 1
+        change.update({"printerid": printerid, "epoch": self.__epoch, "seq": self.__seq, "op": op})
+        if op != "move" and self.__watcher:
+            self.__watcher(len(self.__nodes))
+        current_app.emitter.emit("queue_update", change)
+
+    # puts node after `after` (the root for the front)
+    def __link(self, node, after):
+        if not self.__stale:
+            if after is self.__root.prev:
+                self.__positions[node.job.id] = self.__base + len(self.__nodes)
+            elif after is self.__root:
+                self.__base -= 1
+                self.__positions[node.job.id] = self.__base
+            else:
+                self.__stale = True
+        node.prev, node.next = after, after.next
+        after.next.prev = node
+        after.next = node
+        self.__nodes[node.job.id] = node
+
+    def __unlink(self, node):
+        if not self.__stale:
+            if node is self.__root.next:
+                self.__base += 1
+                del self.__positions[node.job.id]
+            elif node is self.__root.prev:
+                del self.__positions[node.job.id]
+            else:
+                self.__stale = True
+        node.prev.next, node.next.prev = node.next, node.prev
+        del self.__nodes[node.job.id]
+
+    def __countPositions(self):
+        if self.__stale:
+            self.__base, self.__stale = 0, False
+            positions, node, index = {}, self.__root.next, 0
+            while node is not self.__root:
+                positions[node.job.id] = index
+                node, index = node.next, index + 1
+            self.__positions = positions
+        return self.__positions
+
+    def __jobs(self):
+        node = self.__root.next
+        while node is not self.__root:
+            yield node.job
+            node = node.next
+
+    # If the queue has at least one job and the first job is printing,
+    # insert at the second position because we don't want to interrupt it.
+    # If the queue is empty or the first job is not printing, add the job to the front
+    def __frontIndex(self):
+        first = self.__root.next
+        if first is not self.__root and first.job.status == "printing":
+            return 1
+        return 0
 
     def convertQueueToJson(self):
-        queue = []
-        # job_info = {}
-        for job in self.__queue:
-            job_info = {
-                "id": job.id,
-                "name": job.name,
-                "status": job.status,
-                "date": job.date.strftime('%a, %d %b %Y %H:%M:%S'),
-                "printerid": job.printer_id, 
-                "errorid": job.error_id,
-                "file_name_original": job.file_name_original, 
-                "progress": job.progress,
-                "sent_lines": job.sent_lines,
-                "favorite": job.favorite,
-                "released": job.released,
-                "file_pause": job.filePause, 
-                "comments": job.comments, 
-                "extruded": job.extruded,
-                "td_id": job.td_id, 
-                "time_started": job.time_started, 
-                "printer_name": job.printer_name,
-                "max_layer_height": job.max_layer_height,
-                "current_layer_height": job.current_layer_height,
-                "filament": job.filament,
-            }
-            queue.append(job_info)
-        return queue
+        return [self.convertJobToJson(job) for job in self.__jobs()]
+
+    def convertJobToJson(self, job):
+        return {
+            "id": job.id,
+            "name": job.name,
+            "status": job.status,
+            "date": job.date.strftime('%a, %d %b %Y %H:%M:%S'),
+            "printerid": job.printer_id, 
+            "errorid": job.error_id,
+            "file_name_original": job.file_name_original, 
+            "file_hash": job.file_hash,
+            "progress": job.progress,
+            "sent_lines": job.sent_lines,
+            "favorite": job.favorite,
+            "released": job.released,
+            "file_pause": job.filePause, 
+            "comments": job.comments, 
+            "extruded": job.extruded,
+            "td_id": job.td_id, 
+            "time_started": job.time_started, 
+            "printer_name": job.printer_name,
+            "max_layer_height": job.max_layer_height,
+            "current_layer_height": job.current_layer_height,
+            "filament": job.filament,
+        }
 
     def bumpExtreme(self, front, jobid, printerid):  # bump to back/front of queue
-        index = next(
-            (
-                index
-                for index, queued_job in enumerate(self.__queue)
-                if queued_job.id == jobid
-            ),
-            -1,
-        )
-        if index == -1:
-            print("Job not found in queue.")
-            return
-        job_to_move = self.__queue[index]
-        self.__queue.remove(job_to_move)
-        if front == True:
-            # If the queue has at least one job and the first job is printing,
-            # insert at the second position because we don't want to interrupt it.
-            if len(self.__queue) >= 1 and self.__queue[0].status == "printing":
-                self.__queue.insert(1, job_to_move)
-            # If the queue is empty or the first job is not printing,
-            # add the job to the front
+        with self.__lock:
+            node = self.__nodes.get(jobid)
+            if node is None:
+                print("Job not found in queue.")
+                return
+            if front == True:
+                # the printing job stays first, unless it is the one being moved
+                if node is self.__root.next:
+                    return
+                target = self.__frontIndex()
+                after = self.__root if target == 0 else self.__root.next
             else:
-                self.__queue.insert(0, job_to_move)
-        else:
-            self.addToBack(job_to_move, printerid)
+                target = len(self.__nodes) - 1
+                after = self.__root.prev
+            if after is node or after.next is node:
+                return  # already there
+            self.__unlink(node)
+            self.__link(node, after)
+            self.__publish(printerid, "move", jobid=jobid, to=target)
 
     def getJob(self, job_to_find):
-        for job in self.__queue:
-            if job.getJobId() == job_to_find.getJobId():
-                return job
-        return None  # Return None if job is not found in the queue
+        return self.getJobById(job_to_find.getJobId())  # None if job is not found in the queue
 
     def getJobById(self, job_to_find):
-        for job in self.__queue:
-            if job.getJobId() == job_to_find:
-                return job
-        return None  # Return None if job is not found in the queue
+        node = self.__nodes.get(job_to_find)
+        return node.job if node else None  # Return None if job is not found in the queue
 
     def jobExists(self, jobid):
-        for job in self.__queue:
-            if job.id == jobid:
-                return True
-        return False
+        return jobid in self.__nodes
 
     def getQueue(self):
-        return self.__queue
+        with self.__lock:
+            return list(self.__jobs())
 
     def getNext(self):
-        return self.__queue[0]
+        first = self.__root.next
+        if first is self.__root:
+            raise IndexError("the queue is empty")
+        return first.job
 
     def getSize(self):
-        return len(self.__queue)
-
-    def removeJob(self):
-        self.__queue.pop()
-        # current_app.socketio.emit('job_removed', {'queue': list(self.__queue)}, broadcast=True)
+        return len(self.__nodes)
+
+    def removeJob(self, printerid=None):
+        with self.__lock:
+            node = self.__root.prev
+            if node is self.__root:
+                raise IndexError("the queue is empty")
+            self.__unlink(node)
+            self.__publish(printerid, "remove", jobid=node.job.id)
@@ -0,0 +1,30 @@
+import time
+from threading import Event, Thread
+
+
+class RetentionService(Thread):
+    # Applies the job retention policy in the background: `apply` (Job.applyRetention in an app
+    # context, see app.py) runs `delay` seconds after startup, then every `interval` seconds. It works
+    # in short batches, so the printer threads keep writing to the database while it runs.
+    def __init__(self, apply, interval, delay=300):
+        super().__init__(daemon=True)
+        self.apply = apply
+        self.interval = interval
+        self.delay = delay
+        self.last_report = None  # what the last run released, and when
+        self.__wake = Event()
+
+    def run(self):
+        wait = self.delay
+        while True:
+            self.__wake.wait(wait)
+            self.__wake.clear()
+            wait = self.interval
+            try:
+                self.last_report = dict(self.apply(), time=time.time())
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+
+    # Runs the policy now instead of at the next interval
+    def runNow(self):
+        self.__wake.set()
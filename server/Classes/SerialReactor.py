@@ -0,0 +1,158 @@
+import heapq
+import itertools
+import os
+import selectors
+import time
+from collections import deque
+from threading import Lock, Thread
+
+
+class SerialReactor(Thread):
+    # One thread that waits on every open printer port at once (epoll/kqueue through selectors)
+    # instead of one thread per printer blocking in readline(). Complete response lines are handed
+    # to the handler registered for the port, and timers replace the per-printer sleep loops.
+    #
+    # A handler needs onLine(line), onTimeout() (called after `timeout` seconds without a line)
+    # and fail(exception). Handlers and timer callbacks always run on the reactor thread; other
+    # threads hand work over with callSoon.
+    def __init__(self, app):
+        super().__init__(daemon=True)
+        self.app = app
+        self.__selector = selectors.DefaultSelector()
+        self.__wakeup_read, self.__wakeup_write = os.pipe()
+        os.set_blocking(self.__wakeup_read, False)
+        os.set_blocking(self.__wakeup_write, False)
+        self.__selector.register(self.__wakeup_read, selectors.EVENT_READ, None)
+        self.__calls = deque()
+        self.__calls_lock = Lock()
+        self.__timers = []  # heap of [deadline, sequence, callback, args]
+        self.__sequence = itertools.count()
+        self.__ports = {}  # fd -> Port
+
+    # serial ports can only be multiplexed where they are real file descriptors (not on Windows)
+    @classmethod
+    def isSupported(cls):
+        return os.name == "posix"
+
+    def callSoon(self, callback, *args):
+        with self.__calls_lock:
+            self.__calls.append((callback, args))
+        try:
+            os.write(self.__wakeup_write, b"\0")
+        except BlockingIOError:
+            pass  # a wakeup is already pending
+
+    # Runs callback after delay seconds. Only call this from the reactor thread.
+    # Returns the timer so it can be cancelled.
+    def callLater(self, delay, callback, *args):
+        timer = [time.monotonic() + delay, next(self.__sequence), callback, args]
+        heapq.heappush(self.__timers, timer)
+        return timer
+
+    def cancel(self, timer):
+        timer[2] = None
+
+    # Only call register/unregister from the reactor thread (use callSoon)
+    def register(self, ser, handler, timeout):
+        fd = ser.fileno()
+        port = Port(ser, fd, handler, timeout)
+        self.__ports[fd] = port
+        self.__selector.register(fd, selectors.EVENT_READ, port)
+        port.deadline = time.monotonic() + timeout
+        port.watchdog = self.callLater(timeout, self.__timeout, port)
+        return port
+
+    def unregister(self, port):
+        if self.__ports.get(port.fd) is not port:
+            return
+        del self.__ports[port.fd]
+        self.cancel(port.watchdog)
+        try:
+            self.__selector.unregister(port.fd)
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def run(self):
+        with self.app.app_context():
+            while True:
+                timeout = None
+                if self.__timers:
+                    timeout = max(0, self.__timers[0][0] - time.monotonic())
+                for key, _ in self.__selector.select(timeout):
+                    if key.data is None:
+                        self.__drainWakeup()
+                    else:
+                        self.__read(key.data)
+                self.__runCalls()
+                self.__runTimers()
+
+    def __drainWakeup(self):
+        try:
+            while os.read(self.__wakeup_read, 512):
+                pass
+        except BlockingIOError:
+            pass
+
+    def __runCalls(self):
+        with self.__calls_lock:
+            calls, self.__calls = self.__calls, deque()
+        for callback, args in calls:
+            self.__call(callback, *args)
+
+    def __runTimers(self):
+        now = time.monotonic()
+        while self.__timers and self.__timers[0][0] <= now:
+            _, _, callback, args = heapq.heappop(self.__timers)
+            if callback is not None:
+                self.__call(callback, *args)
+
+    def __call(self, callback, *args):
+        try:
+            callback(*args)
+        except Exception as e:
+            print(f"Unexpected error in serial reactor: {e}")
+
+    def __read(self, port):
+        try:
+            data = os.read(port.fd, 4096)
+            if not data:
+                raise OSError("Printer port closed")
+        except BlockingIOError:
+            return
+        except OSError as e:
+            self.unregister(port)
+            self.__call(port.handler.fail, e)
+            return
+
+        port.buffer += data
+        *lines, port.buffer = port.buffer.split(b"\n")
+        for line in lines:
+            line = line.decode("utf-8", errors="replace").strip()
+            if line == "":
+                continue
+            port.deadline = time.monotonic() + port.timeout  # the watchdog catches up when it fires
+            self.__call(port.handler.onLine, line)
+            if self.__ports.get(port.fd) is not port:
+                return  # the handler finished and unregistered
+
+    # One timer per port, not one per line: lines only move port.deadline, and the timer that fires
+    # before it is set again for the deadline
+    def __timeout(self, port):
+        now = time.monotonic()
+        if port.deadline > now:
+            port.watchdog = self.callLater(port.deadline - now, self.__timeout, port)
+            return
+        port.deadline = now + port.timeout
+        port.watchdog = self.callLater(port.timeout, self.__timeout, port)
+        port.handler.onTimeout()
+
+
+class Port:
+    def __init__(self, ser, fd, handler, timeout):
+        self.ser = ser
+        self.fd = fd
+        self.handler = handler
+        self.timeout = timeout
+        self.buffer = b""
+        self.watchdog = None
+        self.deadline = 0  # the watchdog calls onTimeout if no line came by then
@@ -0,0 +1,48 @@
+from threading import Lock, RLock
+
+
+class SocketEmitter:
+    # Sits in front of socketio.emit for the events that fire on every G-code line (progress, sent
+    # lines, layer height, temperatures, send rate). coalesce() only keeps the latest payload for each
+    # (event, key) and a background task emits whatever changed `rate` times a second, so a fleet of
+    # printers streaming thousands of lines per second costs the browser a few events per job.
+    #
+    # emit() is for state transitions (status, errors). It is sent right away, after flushing the
+    # pending values so the client never sees a stale progress arrive after the status that ended a job.
+    def __init__(self, socketio, rate):
+        self.socketio = socketio
+        self.interval = 1 / rate if rate else 0
+        self.__pending = {}  # (event, key) -> payload, in first-changed order
+        self.__lock = Lock()
+        # held while sending, from taking the pending values to emitting them, so a state transition
+        # can't overtake values the background task has taken but not emitted yet
+        self.__sending = RLock()
+        self.__task = None
+
+    def coalesce(self, event, key, data):
+        if not self.interval:
+            return self.socketio.emit(event, data)
+        with self.__lock:
+            self.__pending[(event, key)] = data
+            if self.__task is None:
+                self.__task = self.socketio.start_background_task(self.__run)
+
+    def emit(self, event, data):
+        with self.__sending:
+            self.flush()
+            self.socketio.emit(event, data)
+
+    def flush(self):
+        with self.__sending:
+            with self.__lock:
+                pending, self.__pending = self.__pending, {}
+            for (event, _), data in pending.items():
+                self.socketio.emit(event, data)
+
+    def __run(self):
+        while True:
+            self.socketio.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Unexpected error: {e}")
@@ -0,0 +1,163 @@
+import base64
+import re
+import struct
+import zlib
+
+import numpy as np
+
+# Slicers (PrusaSlicer, OrcaSlicer, Cura with a plugin...) embed previews of the print as base64 blocks:
+#   ; thumbnail begin 300x300 12345
+#   ; iVBORw0KGgoAAAANSUhEUgAA...
+#   ; thumbnail end
+# "thumbnail" is followed by _PNG, _JPG or _QOI when the slicer is set to another format than PNG.
+BEGIN = re.compile(r";\s*thumbnail(?:_(PNG|JPG|QOI))?\s+begin\s+(\d+)x(\d+)", re.IGNORECASE)
+END = re.compile(r";\s*thumbnail(?:_(?:PNG|JPG|QOI))?\s+end", re.IGNORECASE)
+MIMETYPES = {"png": "image/png", "jpg": "image/jpeg"}
+
+
+class ThumbnailExtractor:
+    # Collects the embedded thumbnails of a G-code file while it is read for something else (see
+    # Job.ingestFile): scan() passes the lines through unchanged.
+    def __init__(self):
+        self.thumbnails = []  # (width, height, format, image bytes)
+        self.__block = None
+
+    def scan(self, lines):
+        for line in lines:
+            if self.__block is not None or line.startswith(";"):
+                self.feed(line)
+            yield line
+
+    def feed(self, line):
+        if self.__block is None:
+            match = BEGIN.match(line)
+            if match:
+                self.__block = ((match.group(1) or "PNG").lower(), int(match.group(2)), int(match.group(3)), [])
+            return
+        if END.match(line):
+            fmt, width, height, data = self.__block
+            self.__block = None
+            try:
+                image = base64.b64decode("".join(data))
+                if fmt == "qoi":
+                    image, fmt = qoiToPng(image), "png"  # browsers do not show QOI
+                self.thumbnails.append((width, height, fmt, image))
+            except Exception as e:
+                print(f"Unexpected error: {e}")
+            return
+        self.__block[3].append(line.lstrip("; \t").strip())
+
+
+# Stores thumbnails next to a file in the blob store, one sidecar per image and their list in
+# .thumbnails.json ([width, height, format, rendered]). rendered is True for the ones drawn from the
+# toolpath when the file has none.
+def saveThumbnails(store, digest, thumbnails, rendered=False):
+    listing = []
+    for width, height, fmt, image in thumbnails:
+        f = store.sidecarWriter()
+        f.write(image)
+        store.commitSidecar(f, digest, f"thumbnail-{width}x{height}", fmt)
+        listing.append([width, height, fmt, rendered])
+    store.writeSidecar(digest, "thumbnails", listing)
+    return listing
+
+
+# The smallest thumbnail at least `width` wide, else the largest one
+def pickThumbnail(listing, width):
+    if not listing:
+        return None
+    listing = sorted(listing, key=lambda t: t[0] * t[1])
+    for thumbnail in listing:
+        if thumbnail[0] >= width:
+            return thumbnail
+    return listing[-1]
+
+
+def encodePng(rgba):
+    height, width, _ = rgba.shape
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+    rows = np.concatenate((np.zeros((height, 1), dtype=np.uint8), rgba.reshape(height, -1)), axis=1)  # filter 0 on every row
+    return (b"\x89PNG\r\n\x1a\n"
+            + chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows.tobytes(), 9))
+            + chunk(b"IEND", b""))
+
+
+# Decodes a QOI image (https://qoiformat.org/qoi-specification.pdf) and encodes it as PNG
+def qoiToPng(data):
+    magic, width, height, channels, _ = struct.unpack(">4sIIBB", data[:14])
+    if magic != b"qoif":
+        raise ValueError("not a QOI image")
+    pixels = np.zeros((width * height, 4), dtype=np.uint8)
+    seen = [(0, 0, 0, 0)] * 64
+    r, g, b, a = 0, 0, 0, 255
+    i = 14
+    p = 0
+    while p < width * height:
+        op = data[i]
+        i += 1
+        run = 1
+        if op == 0xfe:
+            r, g, b = data[i], data[i + 1], data[i + 2]
+            i += 3
+        elif op == 0xff:
+            r, g, b, a = data[i], data[i + 1], data[i + 2], data[i + 3]
+            i += 4
+        elif op >> 6 == 0:
+            r, g, b, a = seen[op]
+        elif op >> 6 == 1:
+            r = (r + ((op >> 4) & 3) - 2) & 0xff
+            g = (g + ((op >> 2) & 3) - 2) & 0xff
+            b = (b + (op & 3) - 2) & 0xff
+        elif op >> 6 == 2:
+            dg = (op & 0x3f) - 32
+            dr_dg, db_dg = data[i] >> 4, data[i] & 0x0f
+            i += 1
+            r = (r + dg + dr_dg - 8) & 0xff
+            g = (g + dg) & 0xff
+            b = (b + dg + db_dg - 8) & 0xff
+        else:
+            run = (op & 0x3f) + 1
+        seen[(r * 3 + g * 5 + b * 7 + a * 11) % 64] = (r, g, b, a)
+        pixels[p:p + run] = (r, g, b, a)
+        p += run
+    return encodePng(pixels.reshape(height, width, 4))
+
+
+# Draws extrusion segments (Float32 vertex pairs) in an isometric view, coloured by height, as a PNG
+# of size x size pixels with a transparent background
+def renderPng(vertices, size=300, color=(0x75, 0x61, 0xa9)):
+    image = np.zeros((size, size, 4), dtype=np.uint8)
+    if not len(vertices):
+        return encodePng(image)
+    segments = vertices.reshape(-1, 2, 3).astype(np.float64)
+    x, y, z = segments[..., 0], segments[..., 1], segments[..., 2]
+    u = (x - y) * 0.7071
+    v = z * 0.8165 - (x + y) * 0.4082  # up on the screen
+
+    margin = 8
+    low_u, low_v = u.min(), v.min()
+    scale = (size - 2 * margin) / max(u.max() - low_u, v.max() - low_v, 1e-6)
+    columns = (u - low_u) * scale + margin
+    rows = size - 1 - ((v - low_v) * scale + margin)
+
+    # back to front: the segments nearest to the viewer (low x + y, high z) are drawn last
+    order = np.argsort((z.mean(axis=1) * 10 - (x + y).mean(axis=1)), kind="stable")
+    columns, rows, z = columns[order], rows[order], z[order]
+
+    # a sample every pixel along each segment
+    lengths = np.ceil(np.hypot(columns[:, 1] - columns[:, 0], rows[:, 1] - rows[:, 0])).astype(np.int64) + 1
+    segment = np.repeat(np.arange(len(lengths)), lengths)
+    t = (np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)) / np.repeat(np.maximum(lengths - 1, 1), lengths)
+    px = np.clip(np.round(columns[segment, 0] + (columns[segment, 1] - columns[segment, 0]) * t), 0, size - 1).astype(np.int64)
+    py = np.clip(np.round(rows[segment, 0] + (rows[segment, 1] - rows[segment, 0]) * t), 0, size - 1).astype(np.int64)
+
+    # darker at the bottom of the print, full colour at the top
+    height = z.mean(axis=1)
+    shade = 0.45 + 0.55 * (height - height.min()) / max(height.max() - height.min(), 1e-6)
+    pixels = np.concatenate((np.outer(shade, color), np.full((len(shade), 1), 255)), axis=1).astype(np.uint8)
+    image[py, px] = pixels[segment]  # later samples overwrite earlier ones, in drawing order
+    return encodePng(image)
@@ -0,0 +1,315 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+
+from Classes.BlobStore import BlobStore
+from Classes.GcodeScanner import readLines, stripComment
+from Classes.Thumbnails import ThumbnailExtractor, renderPng, saveThumbnails
+
+
+# Merges the segments (n x 2 x 3) of a layer down to a resolution of `cell` mm: vertices are snapped
+# to a grid of that size (Z to a micron), segments that end where they start are dropped and runs of
+# connected segments going in exactly the same direction on the grid become one segment. Curves made
+# of many tiny moves turn into a few grid steps, straight runs into a single segment.
+def decimate(segments, cell):
+    if not len(segments):
+        return segments
+    scale = np.array([cell, cell, 0.001])
+    grid = np.round(segments / scale).astype(np.int64)
+    grid = grid[np.any(grid[:, 0] != grid[:, 1], axis=1)]
+    if len(grid) > 1:
+        direction = grid[:, 1] - grid[:, 0]
+        connected = np.all(grid[:-1, 1] == grid[1:, 0], axis=1)
+        collinear = np.all(np.cross(direction[:-1], direction[1:]) == 0, axis=1) & (np.einsum("ij,ij->i", direction[:-1], direction[1:]) > 0)
+        starts = np.flatnonzero(np.concatenate(([True], ~(connected & collinear))))
+        ends = np.concatenate((starts[1:] - 1, [len(grid) - 1]))
+        grid = np.stack((grid[starts, 0], grid[ends, 1]), axis=1)
+        # perimeters printed over and over land on the same grid segments, which are drawn once
+        # (in either direction), so each segment is put start < end before dropping duplicates
+        difference = grid[:, 0] - grid[:, 1]
+        swap = difference[np.arange(len(grid)), np.argmax(difference != 0, axis=1)] > 0
+        grid = np.unique(np.where(swap[:, None, None], grid[:, ::-1], grid), axis=0)
+    return (grid * scale).astype(np.float32)
+
+
+class ToolpathBuilder:
+    # Turns G-code into the line segments the 3D viewers draw: for each layer, the extrusion moves and
+    # the travel moves as Float32 vertex pairs (x, y, z per vertex). Layers are split on ;LAYER_CHANGE
+    # like GcodeIndex, so layer n here is layer n of /getgcode (the start G-code belongs to layer 0).
+    #
+    # Level 0 has every move. Each of the following levels is decimated to one of CELLS (mm), so a
+    # viewer showing the whole print in a small canvas loads a fraction of the vertices.
+    CELLS = [0.1, 0.4, 1.6]
+
+    def __init__(self, outs):
+        self.outs = outs  # one binary stream per level the vertex buffers are written to, layer after layer
+        self.levels = [{"cell": cell, "layers": [], "size": 0} for cell in [None] + self.CELLS[:len(outs) - 1]]
+        self.bounds = None  # [[min x, y, z], [max x, y, z]] of the extrusion
+        self.position = [0.0, 0.0, 0.0]
+        self.e = 0.0
+        self.absolute = True
+        self.absolute_e = True
+        self.__layer_seen = False
+        self.__layer_change = False
+        self.__z = None
+        self.__moves = []  # (start x, y, z, end x, y, z) of each move in the current layer
+        self.__extruding = []  # whether each of them extruded
+
+    def feed(self, line):
+        if line.startswith(";LAYER_CHANGE"):
+            if self.__layer_seen:
+                self.endLayer()
+            self.__layer_seen = True
+            self.__layer_change = True
+            return
+        if self.__layer_change:
+            # the ";Z:" comment right after ";LAYER_CHANGE" holds the layer height
+            self.__layer_change = False
+            if line.startswith(";Z:"):
+                try:
+                    self.__z = float(line[3:].strip())
+                except ValueError:
+                    pass
+                return
+
+        command = stripComment(line)
+        if not command:
+            return
+        words = command.split()
+        code = words[0].upper()
+        if code in ("G0", "G1", "G2", "G3"):
+            self.move(self.params(words))  # arcs are drawn as a straight line to their end point
+        elif code == "G90":
+            self.absolute = self.absolute_e = True
+        elif code == "G91":
+            self.absolute = self.absolute_e = False
+        elif code == "M82":
+            self.absolute_e = True
+        elif code == "M83":
+            self.absolute_e = False
+        elif code == "G92":
+            params = self.params(words)
+            for i, axis in enumerate("XYZ"):
+                if axis in params:
+                    self.position[i] = params[axis]
+            if "E" in params:
+                self.e = params["E"]
+        elif code == "G28":
+            params = self.params(words)
+            start = tuple(self.position)
+            for i, axis in enumerate("XYZ"):
+                if axis in params or not params:
+                    self.position[i] = 0.0
+            self.__moves.append(start + tuple(self.position))
+            self.__extruding.append(False)
+
+    def params(self, words):
+        params = {}
+        for word in words[1:]:
+            try:
+                params[word[0].upper()] = float(word[1:])
+            except (ValueError, IndexError):
+                pass
+        return params
+
+    def move(self, params):
+        start = tuple(self.position)
+        for i, axis in enumerate("XYZ"):
+            if axis in params:
+                self.position[i] = params[axis] if self.absolute else self.position[i] + params[axis]
+        extruded = 0.0
+        if "E" in params:
+            extruded = params["E"] - self.e if self.absolute_e else params["E"]
+            self.e = params["E"] if self.absolute_e else self.e + params["E"]
+        self.__moves.append(start + tuple(self.position))
+        self.__extruding.append(extruded > 0)
+
+    def endLayer(self):
+        segments = np.array(self.__moves, dtype=np.float32).reshape(-1, 2, 3)
+        extruding = np.array(self.__extruding, dtype=bool)
+        # moves that go nowhere (extruder only, repeated positions) are dropped
+        moved = np.any(segments[:, 0] != segments[:, 1], axis=1)
+        extrusion = segments[moved & extruding].reshape(-1, 3)
+        travel = segments[moved & ~extruding].reshape(-1, 3)
+
+        if len(extrusion):
+            low, high = extrusion.min(axis=0), extrusion.max(axis=0)
+            if self.bounds is None:
+                self.bounds = [low.tolist(), high.tolist()]
+            else:
+                self.bounds = [np.minimum(self.bounds[0], low).tolist(), np.maximum(self.bounds[1], high).tolist()]
+        z = self.__z
+        if z is None and len(extrusion):
+            z = float(extrusion[0, 2])
+
+        extrusion, travel = extrusion.reshape(-1, 2, 3), travel.reshape(-1, 2, 3)
+        for level, out in zip(self.levels, self.outs):
+            buffers = (extrusion, travel) if level["cell"] is None else (decimate(extrusion, level["cell"]), decimate(travel, level["cell"]))
+            # [layer height, byte offset, extrusion vertices, travel vertices]
+            level["layers"].append([z, level["size"], len(buffers[0]) * 2, len(buffers[1]) * 2])
+            for buffer in buffers:
+                out.write(buffer.tobytes())
+                level["size"] += buffer.nbytes
+        self.__z = None
+        self.__moves = []
+        self.__extruding = []
+
+    def close(self):
+        self.endLayer()
+        return {"levels": self.levels, "bounds": self.bounds}
+
+
+# sidecar holding the vertex buffers of a level
+def levelName(level):
+    return "toolpath" if level == 0 else f"toolpath-{level}"
+
+
+# Runs in a ToolpathCache worker process: builds the toolpath of a stored file and stores it as
+# sidecars, the vertex buffers of each level (.toolpath.bin, .toolpath-<level>.bin) and the layer
+# tables of all of them (.toolpath.json, written last).
+def buildToolpath(root, digest):
+    store = BlobStore(root)
+    outs = [store.sidecarWriter() for _ in range(len(ToolpathBuilder.CELLS) + 1)]
+    try:
+        builder = ToolpathBuilder(outs)
+        with store.open(digest) as src:
+            for line in readLines(src):
+                builder.feed(line)
+        index = builder.close()
+    except Exception:
+        for out in outs:
+            out.close()
+            os.remove(out.name)
+        raise
+    for level, out in enumerate(outs):
+        store.commitSidecar(out, digest, levelName(level), "bin")
+    store.writeSidecar(digest, "toolpath", index)
+    if store.readSidecar(digest, "thumbnails") == []:
+        renderThumbnail(store, digest, index)  # the slicer did not embed any
+    return index
+
+
+# Draws a thumbnail from the coarsest level of the toolpath, for files without an embedded one
+def renderThumbnail(store, digest, index, size=300):
+    level = len(index["levels"]) - 1
+    buffer = np.fromfile(store.sidecarPath(digest, levelName(level), "bin"), dtype=np.float32).reshape(-1, 3)
+    extrusion = []
+    read = 0
+    for _, _, extruded, travelled in index["levels"][level]["layers"]:
+        extrusion.append(buffer[read:read + extruded])
+        read += extruded + travelled
+    vertices = np.concatenate(extrusion) if extrusion else buffer[:0]
+    return saveThumbnails(store, digest, [(size, size, "png", renderPng(vertices, size))], rendered=True)
+
+
+# Runs in a ToolpathCache worker process, for files stored before thumbnails were extracted at upload
+# and files whose fallback was not drawn. Builds the toolpath first if it has to draw one.
+def makeThumbnails(root, digest):
+    store = BlobStore(root)
+    listing = store.readSidecar(digest, "thumbnails")
+    if listing:
+        return listing
+    extractor = ThumbnailExtractor()
+    with store.open(digest) as src:
+        for _ in extractor.scan(readLines(src)):
+            pass
+    if extractor.thumbnails:
+        return saveThumbnails(store, digest, extractor.thumbnails)
+    index = store.readSidecar(digest, "toolpath") or buildToolpath(root, digest)
+    return renderThumbnail(store, digest, index)
+
+
+class ToolpathCache:
+    # Toolpaths are built once per stored file, in a pool of workers so parsing a large file
+    # never holds up the server, and kept next to the file in the blob store. A viewer opening a job
+    # again only reads the cached buffers.
+    def __init__(self, store, workers):
+        self.store = store
+        # Forked: the workers share the server's imports instead of importing app.py again (spawn,
+        # forkserver). A fork pool starts all its workers on the first submit, which is done here, so
+        # the cache has to be created before the process starts any other thread (see app.py).
+        # Windows can't fork, there the builds run in threads of the server process instead.
+        if "fork" in multiprocessing.get_all_start_methods():
+            self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("fork"))
+            self.pool.submit(os.getpid)
+        else:
+            self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="toolpath")
+        self.__building = {}  # hash -> future of the build in progress
+        self.__drawing = {}  # hash -> future of the thumbnails being made
+        self.__lock = Lock()
+
+    def isCached(self, digest):
+        return os.path.isfile(self.store.sidecarPath(digest, "toolpath"))
+
+    # Starts building the toolpath of a stored file unless it is cached or already being built.
+    # Returns the future of the build, or None if it is cached.
+    def build(self, digest):
+        if self.isCached(digest):
+            return None
+        with self.__lock:
+            future = self.__building.get(digest)
+            started = future is None
+            if started:
+                future = self.pool.submit(buildToolpath, self.store.root, digest)
+                self.__building[digest] = future
+        if started:
+            future.add_done_callback(lambda done: self.__done(digest, done))
+        return future
+
+    def __done(self, digest, future):
+        # a failed build is kept, asking for the toolpath again gets its error instead of another try
+        if future.cancelled() or future.exception() is None:
+            with self.__lock:
+                self.__building.pop(digest, None)
+
+    # The thumbnail list of a stored file (see saveThumbnails), or None while it is being made. Never
+    # waits: the fallback of a file uploaded without thumbnails is drawn when its toolpath is built,
+    # and files stored before thumbnails were extracted at upload are done in a worker process.
+    def thumbnails(self, digest):
+        listing = self.store.readSidecar(digest, "thumbnails")
+        if listing:
+            return listing
+        if listing == [] and not self.isCached(digest):
+            self.build(digest)  # see buildToolpath
+            return None
+        with self.__lock:
+            if digest in self.__drawing:
+                return None
+            future = self.pool.submit(makeThumbnails, self.store.root, digest)
+            self.__drawing[digest] = future
+        future.add_done_callback(lambda _: self.__drawn(digest))
+        return None
+
+    def __drawn(self, digest):
+        with self.__lock:
+            self.__drawing.pop(digest, None)
+
+    # The layer table, or None while the toolpath is being built. Never waits, raises the error of a
+    # build that failed.
+    def index(self, digest):
+        future = self.build(digest)
+        if future is None:
+            return self.store.readSidecar(digest, "toolpath")
+        return future.result() if future.done() else None
+
+    # Yields the vertex buffers of layers first to last - 1 at a level of detail: for each layer its
+    # extrusion vertices, then its travel vertices, as the layer table of the level describes them
+    def read(self, digest, index, first, last, level=0, chunk_size=1 << 16):
+        level = max(0, min(level, len(index["levels"]) - 1))
+        layers, size = index["levels"][level]["layers"], index["levels"][level]["size"]
+        first = max(0, min(first, len(layers)))
+        last = max(first, min(last, len(layers)))
+        start = layers[first][1] if first < len(layers) else size
+        end = layers[last][1] if last < len(layers) else size
+        with open(self.store.sidecarPath(digest, levelName(level), "bin"), "rb") as f:
+            f.seek(start)
+            remaining = end - start
+            while remaining > 0:
+                chunk = f.read(min(chunk_size, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                yield chunk
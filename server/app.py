@@ -10,11 +10,17 @@ from flask_migrate import Migrate
 from dotenv import load_dotenv, set_key
 from controllers.ports import getRegisteredPrinters
 import shutil
-from flask_socketio import SocketIO
+from flask_socketio import SocketIO, emit
 from datetime import datetime, timedelta
 from sqlalchemy import text
 import json
 from models.config import Config
+from Classes.SocketEmitter import SocketEmitter
+from Classes.BlobStore import BlobStore
+from Classes.Toolpath import ToolpathCache
+from Classes.Retention import RetentionService
+from Classes.DatabaseWriter import DatabaseWriter
+from Classes.Bus import Bus, RepairPorts, RestoreQueue, UpdateJobStatus, JobStatusReported, JobReleased
 import discord
 import threading
 from discord.ext import commands
@@ -27,6 +33,15 @@ os.environ["SSL_CERT_FILE"] = certifi.where()
 app = Flask(__name__, static_folder='../client/dist')
 app.config.from_object(__name__) # update application instantly 
 
+basedir = os.path.abspath(os.path.dirname(__file__))
+# uploaded G-code lives on disk, addressed by hash, not in the database
+app.blob_store = BlobStore(os.path.join(basedir, Config.get('blob_store')))
+# the geometry the 3D viewers draw, built in worker processes when a file is uploaded. Created before
+# anything below starts a thread (the printer service, the database writer): the workers are forked
+# (threads on Windows), and a forked child only gets the thread that forked it, with the locks the
+# others held left locked.
+app.toolpaths = ToolpathCache(app.blob_store, Config['toolpath_workers'])
+
 # moved this before importing the blueprints so that it can be accessed by the PrinterStatusService
 printer_status_service = PrinterStatusService(app)
 
@@ -40,12 +55,15 @@ else:
 
 socketio = SocketIO(app, cors_allowed_origins="*", engineio_logger=False, socketio_logger=False, async_mode=async_mode) # make it eventlet on production!
 app.socketio = socketio  # Add the SocketIO object to the app object
+# per-line events (progress, temperatures...) are coalesced and sent a few times a second
+app.emitter = SocketEmitter(socketio, Config['emit_rate'])
 
 # IMPORTING BLUEPRINTS 
 from controllers.ports import ports_bp
 from controllers.jobs import jobs_bp
 from controllers.statusService import status_bp, getStatus 
 from controllers.issues import issue_bp
+from models.jobs import Job
 
 CORS(app)
 
@@ -70,14 +88,37 @@ def serve_assets(filename):
 
 # start database connection
 load_dotenv()
-basedir = os.path.abspath(os.path.dirname(__file__))
 database_file = os.path.join(basedir, Config.get('database_uri'))
 databaseuri = 'sqlite:///' + database_file
 app.config['SQLALCHEMY_DATABASE_URI'] = databaseuri
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 db.init_app(app)
 
-migrate = Migrate(app, db)
+# the job search index and job counters (see Job.createSearchIndex, Job.createJobCounts) are not
+# models, migrations leave their tables alone
+def include_object(object, name, type_, reflected, compare_to):
+    return not (type_ == "table" and reflected and compare_to is None and (name.startswith("job_search") or name == "job_count"))
+
+migrate = Migrate(app, db, include_object=include_object)
+
+# the writes nothing waits on (job statuses from the printers, see Job.queueStatus), batched into
+# one transaction on a single thread
+def write_batch(statements):
+    with app.app_context():
+        with db.engine.begin() as conn:
+            for statement in statements:
+                conn.execute(statement)
+
+app.db_writer = DatabaseWriter(write_batch, Config['db_write_batch_size'], Config['db_write_interval'])
+app.db_writer.start()
+
+# what the printer threads ask of the server, called directly instead of over HTTP (see Classes/Bus.py)
+app.bus = Bus()
+app.bus.handle(RepairPorts, lambda command: printer_status_service.repairPorts())
+app.bus.handle(RestoreQueue, lambda command: printer_status_service.queueRestore(command.printer_id, command.status))
+app.bus.handle(UpdateJobStatus, lambda command: Job.update_job_status(command.job_id, command.status))
+app.bus.subscribe(JobStatusReported, lambda event: Job.queueStatus(event.job_id, event.status))
+app.bus.subscribe(JobReleased, lambda event: printer_status_service.wake(event.printer_id))
 
 # # Register the display_bp Blueprint
 app.register_blueprint(ports_bp)
@@ -89,6 +130,13 @@ app.register_blueprint(issue_bp)
 def handle_ping():
     app.socketio.emit('pong')
 
+# a client that missed a queue_update gets the whole queue back, only to itself
+@app.socketio.on('queue_resync')
+def handle_queue_resync(data):
+    printer = printer_status_service.printers.getPrinter(data.get('printerid'))
+    if printer is not None:
+        emit('queue_update', printer.getQueue().snapshot(printer.id))
+
 # Set up the bot with the necessary intents
 intents = discord.Intents.default()
 intents.messages = True  # Enable messages
@@ -279,25 +327,52 @@ with app.app_context():
         
         # Create in-memory uploads folder 
         uploads_folder = os.path.join('../uploads')
-        tempcsv = os.path.join('../tempcsv')
 
         if os.path.exists(uploads_folder):
             # Remove the uploads folder and all its contents
             shutil.rmtree(uploads_folder)
-            shutil.rmtree(tempcsv)
 
             # Recreate it as an empty directory
             os.makedirs(uploads_folder)
-            os.makedirs(tempcsv)
 
             print("Uploads folder recreated as an empty directory.")
         else:
             # Create the uploads folder if it doesn't exist
             os.makedirs(uploads_folder)
-            os.makedirs(tempcsv)
             print("Uploads folder created successfully.")  
+
+        # exports are streamed (see Job.downloadCSV), older versions wrote them to this folder
+        shutil.rmtree(os.path.join('../tempcsv'), ignore_errors=True)
     except Exception as e:
         print(f"Unexpected error: {e}")
+
+    try:
+        # move files stored in the database by older versions to the blob store
+        Job.moveBlobsToStore()
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+
+    try:
+        # full-text index for the job history search
+        Job.createSearchIndex()
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+
+    try:
+        # counters for the job history totals
+        Job.createJobCounts()
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+
+# releases the files of old jobs in the background (see Job.applyRetention)
+def apply_retention():
+    with app.app_context():
+        return Job.applyRetention(Config['retention_max_age_days'], Config['retention_max_store_mb'] * 1000000,
+                                  Config['retention_batch_size'])
+
+app.retention = RetentionService(apply_retention, Config['retention_interval'])
+if Config['retention_enabled']:
+    app.retention.start()
             
 
 if __name__ == "__main__":
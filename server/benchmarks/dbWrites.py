@@ -0,0 +1,183 @@
+# Runs request and print traffic against the database at the same time: printer threads report job
+# statuses while client threads load history pages (Job.get_job_history) and save comments
+# (Job.setComment). "before" is a rollback-journal database with the SQLite defaults and a commit per
+# status (Job.update_job_status), as the server used to run; "after" is the current setup, the
+# connection pragmas of models/db.py and the statuses written behind (Job.queueStatus, DatabaseWriter).
+#
+# Latencies are how long a thread waited for its call to return. Errors are calls that came back with
+# a database error, mostly "database is locked" after the busy timeout ran out.
+#
+# usage (from the server folder): python benchmarks/dbWrites.py --printers 20 --clients 8 --seconds 10
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER)
+
+
+def fillDatabase(path, count, printers):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany("INSERT INTO printer (id, device, description, hwid, name, date) VALUES (?, ?, ?, ?, ?, ?)",
+                     [(i, f"/dev/ttyACM{i}", "virtual", f"hw{i}", f"printer-{i}", datetime.now()) for i in range(1, printers + 1)])
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+    conn.executemany(
+        "INSERT INTO job (id, name, status, date, printer_id, printer_name, td_id, error_id, file_name_original, favorite) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        ((i, f"job {i}", "complete", start + timedelta(minutes=i * 2 + rng.random()), i % printers + 1,
+          f"printer-{i % printers + 1}", rng.randint(1000, 9999), 0, f"part_{i}.gcode", False) for i in range(1, count + 1)))
+    conn.commit()
+    conn.close()
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0
+
+
+def runTraffic(bench, db, Job, args, queued):
+    stop = threading.Event()
+    results = {"status": [], "history": [], "comment": [], "errors": 0}
+    lock = threading.Lock()
+
+    def record(kind, start, ok):
+        with lock:
+            results[kind].append(time.perf_counter() - start)
+            if not ok:
+                results["errors"] += 1
+
+    def printer(index):
+        # each printer runs its own jobs through the statuses of a print
+        rng = random.Random(index)
+        jobs = list(range(index + 1, args.jobs + 1, args.printers))
+        statuses = ["printing", "paused", "printing", "complete"]
+        with bench.app_context():
+            while not stop.is_set():
+                job_id, status = rng.choice(jobs), rng.choice(statuses)
+                start = time.perf_counter()
+                res = Job.queueStatus(job_id, status) if queued else Job.update_job_status(job_id, status)
+                record("status", start, isinstance(res, dict) and res.get("success"))
+                db.session.remove()
+                time.sleep(rng.expovariate(args.status_rate))
+
+    def client(index):
+        rng = random.Random(1000 + index)
+        with bench.app_context():
+            while not stop.is_set():
+                start = time.perf_counter()
+                if rng.random() < args.comment_share:
+                    res = Job.setComment(rng.randint(1, args.jobs), f"checked by client {index}")
+                    record("comment", start, res is not None)
+                else:
+                    printerIds = [rng.randint(1, args.printers)] if rng.random() < 0.5 else None
+                    res = Job.get_job_history(rng.randint(1, 20), 10, printerIds=printerIds, searchJob="", startDate="",
+                                              endDate="", countOnly=0)
+                    record("history", start, len(res) == 3)
+                db.session.remove()
+                time.sleep(rng.expovariate(args.request_rate))
+
+    threads = [threading.Thread(target=printer, args=(i,)) for i in range(args.printers)]
+    threads += [threading.Thread(target=client, args=(i,)) for i in range(args.clients)]
+    with contextlib.redirect_stdout(io.StringIO()):  # the models print their errors
+        for thread in threads:
+            thread.start()
+        time.sleep(args.seconds)
+        stop.set()
+        for thread in threads:
+            thread.join()
+        bench.db_writer.flush()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=50000)
+    parser.add_argument("--printers", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--status-rate", type=float, default=10, help="status reports per second per printer")
+    parser.add_argument("--request-rate", type=float, default=20, help="requests per second per client")
+    parser.add_argument("--comment-share", type=float, default=0.2, help="share of the requests that write")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    serverdir = os.path.join(workdir, "server")
+    os.makedirs(serverdir)
+    os.symlink(os.path.join(SERVER, "config"), os.path.join(serverdir, "config"))
+    os.chdir(serverdir)
+
+    from flask import Flask
+    from flask_socketio import SocketIO
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+    import app  # the models need the app to import
+    from models.config import Config
+    from models.db import db, setPragmas
+    from models.jobs import Job
+    from Classes.DatabaseWriter import DatabaseWriter
+    from Classes.SocketEmitter import SocketEmitter
+
+    def setup(phase):
+        path = os.path.join(workdir, f"{phase}.db")
+        bench = Flask(phase)
+        bench.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + path
+        # a connection per thread, so threads wait on the database and not on the pool
+        bench.config["SQLALCHEMY_ENGINE_OPTIONS"] = {"pool_size": args.printers + args.clients + 2}
+        db.init_app(bench)
+        bench.emitter = SocketEmitter(SocketIO(bench, async_mode="threading"), Config["emit_rate"])
+
+        def write_batch(statements):
+            with bench.app_context():
+                with db.engine.begin() as conn:
+                    for statement in statements:
+                        conn.execute(statement)
+
+        # only started for "after"; before, update_job_status finds it stopped and commits right away
+        bench.db_writer = DatabaseWriter(write_batch, Config["db_write_batch_size"], Config["db_write_interval"])
+        with bench.app_context():
+            db.create_all()
+            db.session.remove()
+            fillDatabase(path, args.jobs, args.printers)
+            Job.createSearchIndex()
+            Job.createJobCounts()
+            db.session.remove()
+        return bench
+
+    try:
+        event.remove(Engine, "connect", setPragmas)
+        before = setup("before")
+        before_results = runTraffic(before, db, Job, args, queued=False)
+
+        event.listen(Engine, "connect", setPragmas)
+        after = setup("after")
+        after.db_writer.start()
+        after_results = runTraffic(after, db, Job, args, queued=True)
+
+        print(f"{args.jobs} jobs, {args.printers} printers reporting {args.status_rate:g} statuses/s each, "
+              f"{args.clients} clients at {args.request_rate:g} requests/s each, {args.seconds:g}s\n")
+        print(f"  {'call':16} {'':6} {'calls':>7} {'p50':>9} {'p99':>9} {'max':>9}")
+        for kind, label in (("status", "status report"), ("history", "history page"), ("comment", "save comment")):
+            for phase, results in (("before", before_results), ("after", after_results)):
+                times = results[kind]
+                print(f"  {label if phase == 'before' else '':16} {phase:6} {len(times):7} {percentile(times, 0.5):7.1f}ms "
+                      f"{percentile(times, 0.99):7.1f}ms {max(times, default=0) * 1000:7.1f}ms")
+        print(f"\n  database errors: before {before_results['errors']}, after {after_results['errors']}")
+        print(f"  statuses written behind: {after.db_writer.written} in {after.db_writer.batches} commits")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
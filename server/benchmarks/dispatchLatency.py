@@ -0,0 +1,152 @@
+# Measures the dead time a printer thread adds to a print: from a job being queued on a ready printer
+# to printNextInQueue starting it ("start"), and from the job being released (Job.setReleased) to
+# beginPrint returning ("release"). "before" is the polling the printer threads used to do (copied
+# below: update_thread checking every 2 seconds then waiting 2 more, beginPrint checking every
+# second); "after" is the current update_thread and beginPrint, woken up by the queue and the release.
+#
+# Nothing is sent to a printer: printNextInQueue is replaced by a stand-in that takes the job off the
+# queue, waits in beginPrint and reports back. The job is released a random time after it started.
+#
+# usage (from the server folder): python benchmarks/dispatchLatency.py --rounds 10
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER)
+
+
+def pollingThread(printer, app):
+    # update_thread as it was
+    with app.app_context():
+        while True:
+            time.sleep(2)
+            status = printer.getStatus()
+            queueSize = printer.getQueue().getSize()
+            printer.responseCount = 0
+            if (status == "ready" and queueSize > 0):
+                time.sleep(2)
+                if status != "offline":
+                    printer.printNextInQueue()
+
+
+def pollingBegin(printer, job):
+    # beginPrint as it was
+    while True:
+        time.sleep(1)
+        if job.getReleased() == 1:
+            return True
+        if printer.getStatus() == "complete":
+            return False
+
+
+def run(app, service, Printer, Job, printer_id, rounds, polling):
+    from models.PrinterStatusService import PrinterTask
+
+    class QueuedJob:
+        # what Queue.convertJobToJson reads off a Job, and its release
+        def __init__(self, id):
+            self.id = id
+            self.name = f"job {id}"
+            self.status = "inqueue"
+            self.date = datetime(2024, 1, 1)
+            self.printer_id = printer_id
+            self.error_id = 0
+            self.file_name_original = f"part_{id}.gcode"
+            self.file_hash = None
+            self.progress = self.sent_lines = self.released = self.filePause = self.extruded = 0
+            self.favorite = False
+            self.comments = ""
+            self.td_id = id
+            self.time_started = 0
+            self.printer_name = "printer-1"
+            self.max_layer_height = self.current_layer_height = 0
+            self.filament = ""
+
+        getReleased = Job.getReleased
+        setReleased = Job.setReleased
+
+    printer = Printer("virtual", "virtual", f"hw{printer_id}", f"printer-{printer_id}", status="ready", id=printer_id)
+    printer.busy = True  # keeps the SerialReactor's dispatch, if it runs, off this printer
+    service.printers.add(PrinterTask(printer))
+    started, begun = threading.Event(), threading.Event()
+    times = {"start": [], "release": []}
+    marks = {}
+
+    def printNextInQueue():
+        marks["started"] = time.perf_counter()
+        job = printer.getQueue().getNext()
+        printer.getQueue().deleteJob(job.id, printer.id)
+        printer.setStatus("printing")
+        started.set()
+        pollingBegin(printer, job) if polling else printer.beginPrint(job)
+        marks["begun"] = time.perf_counter()
+        printer.setStatus("ready")
+        begun.set()
+
+    printer.printNextInQueue = printNextInQueue
+    target = pollingThread if polling else service.update_thread
+    threading.Thread(target=target, args=(printer, app), daemon=True).start()
+
+    rng = random.Random(0)
+    for index in range(rounds):
+        started.clear()
+        begun.clear()
+        time.sleep(rng.uniform(0, 2))  # a job comes in at any point of the polling cycle
+        job = QueuedJob(index + 1)
+        queued = time.perf_counter()
+        printer.getQueue().addToBack(job, printer.id)
+        started.wait()
+        times["start"].append(marks["started"] - queued)
+        time.sleep(rng.uniform(0, 1))  # the user checks the bed
+        released = time.perf_counter()
+        job.setReleased(1)
+        begun.wait()
+        times["release"].append(marks["begun"] - released)
+
+    printer.terminated = 1
+    service.printers.remove(printer_id)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=10)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    serverdir = os.path.join(workdir, "server")
+    os.makedirs(serverdir)
+    os.symlink(os.path.join(SERVER, "config"), os.path.join(serverdir, "config"))
+    os.chdir(serverdir)
+
+    import app as server  # the models need the app to import
+    from models.jobs import Job
+    from models.printers import Printer
+
+    try:
+        with server.app.app_context(), contextlib.redirect_stdout(io.StringIO()):  # the printers print their statuses
+            before = run(server.app, server.printer_status_service, Printer, Job, 9001, args.rounds, polling=True)
+            after = run(server.app, server.printer_status_service, Printer, Job, 9002, args.rounds, polling=False)
+
+        print(f"{args.rounds} jobs started and released on one printer thread\n")
+        print(f"  {'wait':8} {'':6} {'median':>10} {'max':>10}")
+        for kind in ("start", "release"):
+            for phase, times in (("before", before), ("after", after)):
+                print(f"  {kind if phase == 'before' else '':8} {phase:6} {statistics.median(times[kind]) * 1000:8.1f}ms "
+                      f"{max(times[kind]) * 1000:8.1f}ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
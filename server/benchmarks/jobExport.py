@@ -0,0 +1,109 @@
+# Times the job export (Job.downloadCSV) and measures the Python memory it peaks at: "before" reads every
+# row with .all() and writes a CSV file to send, as the export used to; "csv" and "ndjson" stream the
+# current response body to nowhere. Times are with tracemalloc on, which slows everything down.
+#
+# usage (from the server folder): python benchmarks/jobExport.py --jobs 500000
+import argparse
+import csv
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER)
+
+
+def fillDatabase(path, count, issues):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany("INSERT INTO issue (id, issue) VALUES (?, ?)", [(i, f"issue {i}") for i in range(1, issues + 1)])
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+
+    def rows():
+        for i in range(1, count + 1):
+            status = rng.choice(["complete"] * 8 + ["error", "cancelled"])
+            yield (i, f"job {i}", status, start + timedelta(minutes=i * 2 + rng.random()), f"printer-{i % 20}",
+                   rng.randint(1000, 9999), rng.randint(1, issues) if status == "error" else 0, f"part_{i}.gcode", False,
+                   "nozzle clogged halfway, reprinted" if status == "error" else None)
+
+    conn.executemany(
+        "INSERT INTO job (id, name, status, date, printer_name, td_id, error_id, file_name_original, favorite, comments) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+
+
+def measure(run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = run()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=500000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    serverdir = os.path.join(workdir, "server")
+    os.makedirs(serverdir)
+    os.symlink(os.path.join(SERVER, "config"), os.path.join(serverdir, "config"))
+    os.chdir(serverdir)
+
+    from flask import Flask
+    import app  # the models need the app to import
+    from models.db import db
+    from models.jobs import Job
+    from models.issues import Issue
+
+    bench = Flask(__name__)
+    bench.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    db.init_app(bench)
+
+    def before():
+        jobs = db.session.query(Job, Issue).outerjoin(Issue, Job.error_id == Issue.id).all()
+        path = os.path.join(workdir, "jobs.csv")
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(Job.EXPORT_COLUMNS)
+            for job, issue in jobs:
+                writer.writerow([job.td_id, job.printer_name, job.name, job.file_name_original, job.status, job.date,
+                                 issue.issue if issue else "", job.comments])
+        with open(path, "rb") as file:  # send_file
+            return sum(len(chunk) for chunk in iter(lambda: file.read(1 << 16), b""))
+
+    def streamed(format):
+        def run():
+            with bench.test_request_context():
+                return sum(len(chunk.encode()) for chunk in Job.downloadCSV(1, format=format).response)
+        return run
+
+    try:
+        with bench.app_context():
+            db.create_all()
+            db.session.remove()
+            fillDatabase(os.path.join(workdir, "bench.db"), args.jobs, 10)
+            print(f"{args.jobs} jobs\n")
+            print(f"  {'export':8} {'time':>8} {'peak memory':>12} {'size':>9}")
+            for label, run in (("before", before), ("csv", streamed("csv")), ("ndjson", streamed("ndjson"))):
+                db.session.remove()
+                elapsed, peak, size = measure(run)
+                print(f"  {label:8} {elapsed:7.1f}s {peak / 1e6:10.1f}MB {size / 1e6:7.1f}MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# Times the job history queries (Job.get_job_history) on a synthetic database, first without the
+# history indexes, counters and with ilike search, then with the indexes, the job_count counters and
+# the job_search full-text index.
+#
+# The database is built with plain sqlite3 in a temporary folder; the real database is not touched.
+#
+# usage (from the server folder): python benchmarks/jobHistory.py --jobs 1000000
+import argparse
+import contextlib
+import io
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER)
+
+WORDS = ["benchy", "calibration", "cube", "bracket", "gear", "hinge", "mount", "clip", "vase", "spool",
+         "holder", "knob", "case", "lid", "adapter", "plate", "tower", "frame", "hook", "bolt"]
+STATUSES = ["complete"] * 80 + ["error"] * 10 + ["cancelled"] * 9 + ["inqueue"]
+
+
+def fillDatabase(path, count, printers, issues):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany("INSERT INTO printer (id, device, description, hwid, name, date) VALUES (?, ?, ?, ?, ?, ?)",
+                     [(i, f"/dev/ttyACM{i}", "virtual", f"hw{i}", f"printer-{i}", datetime.now()) for i in range(1, printers + 1)])
+    conn.executemany("INSERT INTO issue (id, issue) VALUES (?, ?)", [(i, f"issue {i}") for i in range(1, issues + 1)])
+
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+
+    def rows():
+        for i in range(1, count + 1):
+            words = rng.sample(WORDS, 2)
+            status = rng.choice(STATUSES)
+            yield (
+                i, f"{words[0]} {words[1]} {i}", status, start + timedelta(minutes=i * 2 + rng.random()),
+                rng.randint(1, printers), f"printer-{i % printers}", rng.randint(1000, 9999),
+                rng.randint(1, issues) if status == "error" else 0, f"{words[0]}_{words[1]}_{i % 5000}.gcode",
+                rng.random() < 0.01,
+            )
+
+    conn.executemany(
+        "INSERT INTO job (id, name, status, date, printer_id, printer_name, td_id, error_id, file_name_original, favorite) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+
+
+def timeQuery(run, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+
+def runQueries(Job, repeat, jobs):
+    middle = jobs // 20  # the page half way through the history
+    queries = [
+        ("newest first, page 1", dict()),
+        ("oldest first, page 1", dict(oldestFirst=True)),
+        ("one printer", dict(printerIds=[3])),
+        ("errors (fromError)", dict(fromError=1)),
+        ("one issue", dict(issueIds=[2])),
+        ("favorites", dict(favoriteOnly=True)),
+        ("ticket id", dict(searchTicketId="4242")),
+        ("search 'benchy'", dict(searchJob="benchy")),
+        ("search file '_4242.'", dict(searchJob="_4242.", searchCriteria="searchByFileName")),
+        ("search 'gear hook 77'", dict(searchJob="gear hook 77")),
+        (f"page {middle}, offset", dict(page=middle)),
+        (f"page {middle}, cursor", dict(cursor=f"page {middle}")),
+        (f"errors page {middle // 10}, offset", dict(fromError=1, page=middle // 10)),
+        (f"errors page {middle // 10}, cursor", dict(fromError=1, cursor=f"page {middle // 10}")),
+    ]
+    results = []
+    for label, args in queries:
+        params = dict(page=1, pageSize=10, printerIds=None, oldestFirst=False, searchJob="", searchCriteria="",
+                      searchTicketId="", favoriteOnly=False, issueIds=None, startDate="", endDate="", fromError=0, countOnly=0)
+        params.update(args)
+        with contextlib.redirect_stdout(io.StringIO()):  # get_job_history prints its filters
+            if params.get("cursor"):
+                # the cursor the previous pages would have handed over, found the slow way
+                page = int(params["cursor"].split()[1])
+                params["cursor"] = Job.get_job_history(**dict(params, page=page - 1, cursor=None))[2]
+            jobs, total = Job.get_job_history(**params)[:2]
+            if total is None:
+                total = len(jobs)  # not counted past the first page
+            results.append((label, total, timeQuery(lambda: Job.get_job_history(**params), repeat)))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=1000000)
+    parser.add_argument("--printers", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    serverdir = os.path.join(workdir, "server")
+    os.makedirs(serverdir)
+    os.symlink(os.path.join(SERVER, "config"), os.path.join(serverdir, "config"))
+    os.chdir(serverdir)
+
+    from flask import Flask
+    import app  # the models need the app to import
+    from models.db import db
+    from models.jobs import Job
+
+    # a separate app bound to the scratch database
+    bench = Flask(__name__)
+    bench.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    db.init_app(bench)
+
+    try:
+        with bench.app_context():
+            db.create_all()
+            indexes = [index for index in Job.__table__.indexes if index.name.startswith("ix_job_") and len(index.columns) > 0
+                       and index.name not in ("ix_job_file_hash", "ix_job_compiled_hash")]
+            for index in indexes:
+                index.drop(db.engine)
+            db.session.remove()
+
+            start = time.perf_counter()
+            fillDatabase(os.path.join(workdir, "bench.db"), args.jobs, args.printers, 10)
+            print(f"{args.jobs} jobs written in {time.perf_counter() - start:.1f}s\n")
+
+            Job.search_index = False
+            Job.job_counts = False
+            before = runQueries(Job, args.repeat, args.jobs)
+
+            start = time.perf_counter()
+            for index in indexes:
+                index.create(db.engine)
+            print(f"history indexes built in {time.perf_counter() - start:.1f}s")
+            start = time.perf_counter()
+            Job.createSearchIndex()
+            print(f"search index built in {time.perf_counter() - start:.1f}s")
+            start = time.perf_counter()
+            Job.createJobCounts()
+            print(f"job counters built in {time.perf_counter() - start:.1f}s\n")
+            after = runQueries(Job, args.repeat, args.jobs)
+
+            print(f"  {'query':28} {'matches':>9} {'before':>10} {'after':>10}")
+            for (label, total, slow), (_, total_after, fast) in zip(before, after):
+                mark = "" if total == total_after else f"  (after: {total_after} matches)"
+                print(f"  {label:28} {total:9} {slow:8.1f}ms {fast:8.1f}ms{mark}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
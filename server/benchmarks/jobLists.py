@@ -0,0 +1,174 @@
+# Measures the database time, statements and bytes read per request of the job lists: a history page,
+# the favorites and the CSV export. "before" loads whole Job rows and their printer and issue one query
+# at a time, as these lists used to; "after" is the current code (Job.get_job_history,
+# Job.getFavoriteJobs, Job.downloadCSV).
+#
+# Jobs carry compile metadata like real uploads, and every --blob-every-th job still has its file in
+# the row, as in a database from before the blob store that has not been started yet.
+#
+# Bytes read come from /proc/self/io (Linux), with the SQLite page cache emptied before each request.
+# SQLite walks the overflow pages of a large value to get to the columns stored after it, so files
+# still in the rows are read from disk either way; what changes is what is decoded and kept.
+#
+# usage (from the server folder): python benchmarks/jobLists.py --jobs 20000
+import argparse
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER)
+
+
+def fillDatabase(path, count, printers, issues, blob_every, blob_kb):
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.executemany("INSERT INTO printer (id, device, description, hwid, name, date) VALUES (?, ?, ?, ?, ?, ?)",
+                     [(i, f"/dev/ttyACM{i}", "virtual", f"hw{i}", f"printer-{i}", datetime.now()) for i in range(1, printers + 1)])
+    conn.executemany("INSERT INTO issue (id, issue) VALUES (?, ?)", [(i, f"issue {i}") for i in range(1, issues + 1)])
+
+    rng = random.Random(0)
+    start = datetime(2020, 1, 1)
+    # what compileFile stores for a print of a few hundred layers
+    meta = json.dumps({"total_lines": 250000, "max_layer_height": 60.0, "total_time": 14400,
+                       "layers": [[i * 500, round(0.2 + i * 0.2, 2)] for i in range(300)]})
+    blob = os.urandom(blob_kb * 1024)
+
+    def rows():
+        for i in range(1, count + 1):
+            status = rng.choice(["complete"] * 8 + ["error", "cancelled"])
+            yield (
+                i, f"job {i}", status, start + timedelta(minutes=i * 2 + rng.random()), rng.randint(1, printers),
+                f"printer-{i % printers}", rng.randint(1000, 9999), rng.randint(1, issues) if status == "error" else 0,
+                f"part_{i}.gcode", rng.random() < 0.01, meta, blob if i % blob_every == 0 else None,
+            )
+
+    conn.executemany(
+        "INSERT INTO job (id, name, status, date, printer_id, printer_name, td_id, error_id, file_name_original, favorite, gcode_meta, file) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+
+
+def readBytes():
+    with open("/proc/self/io") as f:
+        for line in f:
+            if line.startswith("rchar:"):
+                return int(line.split()[1])
+    return 0
+
+
+def measure(db, run, repeat):
+    from sqlalchemy import event
+
+    statements = []
+    listener = lambda *args: statements.append(1)
+    event.listen(db.engine, "before_cursor_execute", listener)
+    times, reads = [], []
+    try:
+        for _ in range(repeat):
+            db.session.remove()
+            db.engine.dispose()  # a new connection, so an empty SQLite page cache
+            db.session.execute(db.text("SELECT 1"))
+            statements.clear()
+            read = readBytes()
+            start = time.perf_counter()
+            run()
+            times.append(time.perf_counter() - start)
+            reads.append(readBytes() - read)
+    finally:
+        event.remove(db.engine, "before_cursor_execute", listener)
+    return statistics.median(times) * 1000, len(statements), statistics.median(reads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--jobs", type=int, default=20000)
+    parser.add_argument("--printers", type=int, default=20)
+    parser.add_argument("--blob-every", type=int, default=100)
+    parser.add_argument("--blob-kb", type=int, default=512)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    serverdir = os.path.join(workdir, "server")
+    os.makedirs(serverdir)
+    os.symlink(os.path.join(SERVER, "config"), os.path.join(serverdir, "config"))
+    os.chdir(serverdir)
+
+    from flask import Flask
+    import app  # the models need the app to import
+    from models.db import db
+    from models.jobs import Job
+    from models.issues import Issue
+    from sqlalchemy.orm import undefer
+
+    bench = Flask(__name__)
+    bench.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///" + os.path.join(workdir, "bench.db")
+    db.init_app(bench)
+
+    def listJobs(jobs):
+        return [{"id": job.id, "name": job.name, "status": job.status, "date": job.date, "file_hash": job.file_hash,
+                 "printer": job.printer.name if job.printer else "None", "error": job.error.issue if job.error else "None"}
+                for job in jobs]
+
+    # the lists as they were, whole rows with the files in them
+    def historyBefore():
+        pagination = Job.query.options(undefer(Job.file), undefer(Job.compiled)).order_by(Job.date.desc()).paginate(
+            page=1, per_page=10, error_out=False)
+        return listJobs(pagination.items), pagination.total
+
+    def favoritesBefore():
+        return listJobs(Job.query.options(undefer(Job.file), undefer(Job.compiled)).filter_by(favorite=True).all())
+
+    def csvBefore():
+        out = io.StringIO()
+        writer = csv.writer(out)
+        for job, issue in db.session.query(Job, Issue).options(undefer(Job.file), undefer(Job.compiled)).outerjoin(Issue, Job.error_id == Issue.id):
+            writer.writerow([job.td_id, job.printer_name, job.name, job.file_name_original, job.status, job.date,
+                             issue.issue if issue else "", job.comments])
+
+    def historyAfter():
+        return Job.get_job_history(1, 10, searchJob="", startDate="", endDate="", countOnly=0)
+
+    def csvAfter():
+        with bench.test_request_context():
+            for _ in Job.downloadCSV(1).response:
+                pass
+
+    requests = [
+        ("history page (10 jobs)", historyBefore, historyAfter),
+        ("favorites", favoritesBefore, Job.getFavoriteJobs),
+        ("CSV export", csvBefore, csvAfter),
+    ]
+
+    try:
+        with bench.app_context():
+            db.create_all()
+            db.session.remove()
+            start = time.perf_counter()
+            fillDatabase(os.path.join(workdir, "bench.db"), args.jobs, args.printers, 10, args.blob_every, args.blob_kb)
+            size = os.path.getsize(os.path.join(workdir, "bench.db")) / 1e6
+            print(f"{args.jobs} jobs ({size:.0f} MB) written in {time.perf_counter() - start:.1f}s\n")
+
+            print(f"  {'request':24} {'':6} {'time':>10} {'statements':>11} {'read':>10}")
+            for label, before, after in requests:
+                for phase, run in (("before", before), ("after", after)):
+                    elapsed, statements, read = measure(db, run, args.repeat)
+                    print(f"  {label if phase == 'before' else '':24} {phase:6} {elapsed:8.1f}ms {statements:11} {read / 1e6:8.2f}MB")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# Times the printer queue operations (Classes/Queue) on queues of --size jobs. "before" is the
+# deque the queue used to be, with its linear searches (DequeQueue below, same operations and
+# queue_update ops); "after" is the current Queue. Events go to a no-op emitter, so only the queue
+# is measured. Each operation is timed on a job in the middle of the queue.
+#
+# usage (from the server folder): python benchmarks/queueOps.py --size 10000
+import argparse
+import contextlib
+import gc
+import io
+import os
+import statistics
+import sys
+import time
+from collections import deque
+from datetime import datetime
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER)
+
+from flask import Flask, current_app
+from Classes.Queue import Queue
+
+
+class QueuedJob:
+    # what Queue.convertJobToJson reads off a Job
+    def __init__(self, id):
+        self.id = id
+        self.name = f"job {id}"
+        self.status = "inqueue"
+        self.date = datetime(2024, 1, 1)
+        self.printer_id = 1
+        self.error_id = 0
+        self.file_name_original = f"part_{id}.gcode"
+        self.file_hash = None
+        self.progress = self.sent_lines = self.released = self.filePause = self.extruded = 0
+        self.favorite = False
+        self.comments = ""
+        self.td_id = id
+        self.time_started = 0
+        self.printer_name = "printer-1"
+        self.max_layer_height = self.current_layer_height = 0
+        self.filament = ""
+
+    def getJobId(self):
+        return self.id
+
+
+class Emitter:
+    def emit(self, event, data):
+        pass
+
+
+class DequeQueue(Queue):
+    # the queue as it was: a deque searched front to back
+    def __init__(self):
+        super().__init__()
+        self.jobs = deque()
+
+    def publish(self, printerid, op, **change):
+        current_app.emitter.emit("queue_update", dict(change, printerid=printerid, op=op))
+
+    def indexOf(self, jobid):
+        return next((index for index, job in enumerate(self.jobs) if job.id == jobid), -1)
+
+    def addToBack(self, job, printerid):
+        if self.jobs.count(job) > 0:
+            raise Exception("Job ID already in queue.")
+        self.jobs.append(job)
+        self.publish(printerid, "insert", index=len(self.jobs) - 1, job=self.convertJobToJson(job))
+
+    def bump(self, up, jobid, printerid=None):
+        index = self.indexOf(jobid)
+        target = index - 1 if up else index + 1
+        if index != -1 and 0 <= target < len(self.jobs):
+            job = self.jobs[index]
+            del self.jobs[index]
+            self.jobs.insert(target, job)
+            self.publish(printerid, "move", jobid=jobid, to=target)
+
+    def bumpExtreme(self, front, jobid, printerid):
+        index = self.indexOf(jobid)
+        target = 0 if front else len(self.jobs) - 1
+        if index != -1 and target != index:
+            job = self.jobs[index]
+            del self.jobs[index]
+            self.jobs.insert(target, job)
+            self.publish(printerid, "move", jobid=jobid, to=target)
+
+    def reorder(self, arr, printerid=None):
+        new_queue = deque()
+        for jobid in arr:
+            for job in self.jobs:
+                if job.getJobId() == jobid:
+                    new_queue.append(job)
+                    break
+        self.jobs = new_queue
+        self.publish(printerid, "reorder", order=[job.id for job in self.jobs])
+
+    def deleteJob(self, jobid, printerid):
+        index = self.indexOf(jobid)
+        if index == -1:
+            return "Job not found in queue."
+        job = self.jobs[index]
+        del self.jobs[index]
+        self.publish(printerid, "remove", index=index, jobid=jobid)
+        return job
+
+    def getJobById(self, job_to_find):
+        return next((job for job in self.jobs if job.getJobId() == job_to_find), None)
+
+    def jobExists(self, jobid):
+        return any(job.id == jobid for job in self.jobs)
+
+    def getSize(self):
+        return len(self.jobs)
+
+
+def fill(cls, size):
+    queue = cls()
+    jobs = [QueuedJob(i) for i in range(1, size + 1)]
+    if cls is DequeQueue:
+        queue.jobs.extend(jobs)  # addToBack one at a time is quadratic here
+    else:
+        for job in jobs:
+            queue.addToBack(job, 1)
+    return queue, jobs
+
+
+def timeOp(make, op, repeat, size):
+    # op(queue, jobid) on a fresh queue each round, on the job in the middle
+    times = []
+    for _ in range(repeat):
+        queue, jobs = make(size)
+        middle = jobs[size // 2].id
+        gc.disable()  # the queues of the previous rounds are cycles, collected between rounds instead
+        start = time.perf_counter()
+        op(queue, middle)
+        times.append(time.perf_counter() - start)
+        gc.enable()
+    return statistics.median(times) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=7)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    app.emitter = Emitter()
+    size = args.size
+
+    ops = [
+        ("add to back", lambda q, jobid: q.addToBack(QueuedJob(size + 1), 1)),
+        ("find by id", lambda q, jobid: q.getJobById(jobid)),
+        ("job exists", lambda q, jobid: q.jobExists(jobid)),
+        ("delete", lambda q, jobid: q.deleteJob(jobid, 1)),
+        ("bump up", lambda q, jobid: q.bump(True, jobid, 1)),
+        ("10 bumps down", lambda q, jobid: [q.bump(False, jobid, 1) for _ in range(10)]),
+        ("bump to back", lambda q, jobid: q.bumpExtreme(False, jobid, 1)),
+        ("reorder (reversed)", lambda q, jobid: q.reorder(list(range(size, 0, -1)), 1)),
+    ]
+
+    with app.app_context(), contextlib.redirect_stdout(io.StringIO()):  # addToBack prints
+        results = []
+        for label, op in ops:
+            before = timeOp(lambda n: fill(DequeQueue, n), op, args.repeat, size)
+            after = timeOp(lambda n: fill(Queue, n), op, args.repeat, size)
+            results.append((label, before, after))
+        fills = [timeOp(lambda n: (cls(), [QueuedJob(i) for i in range(1, n + 1)]),
+                        lambda q, jobid: [q.addToBack(QueuedJob(i), 1) for i in range(1, size + 1)], 1, size)
+                 for cls in (DequeQueue, Queue)]
+
+    print(f"queue of {size} jobs\n")
+    print(f"  {'operation':20} {'before':>12} {'after':>12}")
+    for label, before, after in results:
+        print(f"  {label:20} {before:10.1f}us {after:10.1f}us")
+    print(f"  {f'fill {size}':20} {fills[0] / 1000:10.1f}ms {fills[1] / 1000:10.1f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+# Prints the same file on a fleet of virtual printers, once with every printer on its own thread
+# (blocking readline) and once with all of them on one SerialReactor, and compares the throughput.
+#
+# The printers are pseudo-terminals served by a child process that answers every line with "ok"
+# after an optional latency, so the real pyserial / PrintSession code paths are exercised without hardware.
+#
+# usage (from the server folder): python benchmarks/reactorFleet.py --printers 1 8 32 --lines 5000 --latency 1
+import argparse
+import os
+import selectors
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tty
+import heapq
+from datetime import datetime
+from multiprocessing import Pipe, Process
+
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER)
+
+import serial
+from Classes.BlobStore import BlobStore
+from Classes.SerialReactor import SerialReactor
+
+
+def runFleet(count, latency, conn):
+    masters = []
+    names = []
+    for _ in range(count):
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        os.set_blocking(master, False)
+        masters.append((master, slave))
+        names.append(os.ttyname(slave))
+    conn.send(names)
+
+    selector = selectors.DefaultSelector()
+    buffers = {}
+    for master, _ in masters:
+        selector.register(master, selectors.EVENT_READ)
+        buffers[master] = b""
+    replies = []  # heap of (due, master)
+    while True:
+        timeout = max(0, replies[0][0] - time.monotonic()) if replies else None
+        for key, _ in selector.select(timeout):
+            try:
+                data = os.read(key.fd, 4096)
+            except (BlockingIOError, OSError):
+                continue
+            buffers[key.fd] += data
+            *lines, buffers[key.fd] = buffers[key.fd].split(b"\n")
+            for _ in lines:
+                heapq.heappush(replies, (time.monotonic() + latency, key.fd))
+        now = time.monotonic()
+        while replies and replies[0][0] <= now:
+            _, fd = heapq.heappop(replies)
+            os.write(fd, b"ok\n")
+
+
+def makeGcode(lines):
+    gcode = [";FLAVOR:Marlin", ";TIME:600"]
+    for i in range(lines):
+        if i % 100 == 0:
+            gcode.append(";LAYER_CHANGE")
+            gcode.append(f";Z:{0.2 * (i // 100 + 1):.1f}")
+        gcode.append(f"G1 X{i % 200}.5 Y{(i * 7) % 200}.25 E{i * 0.01:.3f}")
+    return ("\n".join(gcode) + "\n").encode("utf-8")
+
+
+def makePrinter(i, device, streaming):
+    printer = Printer(device, "virtual", f"virtual-{i}", f"virtual-{i}", status="printing", id=i, streaming=streaming)
+    printer.ser = serial.Serial(device, 115200, timeout=5)
+    return printer
+
+
+def makeJob(i, compiled_hash, gcode_meta):
+    job = Job(None, f"bench-{i}", i, "printing", "bench.gcode", 0, 0, f"virtual-{i}", compiled_hash, gcode_meta)
+    job.id = i
+    job.date = datetime.now()
+    return job
+
+
+def openSession(printer, job, onDone=None):
+    session = printer.openSession(job, onDone)
+    # keep the console quiet, the file handlers still log everything
+    for handler in list(session.logger.handlers):
+        if not hasattr(handler, "baseFilename"):
+            handler.close()
+            session.logger.removeHandler(handler)
+    return session
+
+
+def runThreads(app, printers, jobs):
+    sessions = [openSession(p, j) for p, j in zip(printers, jobs)]
+    finished = {}
+
+    def run(session):
+        with app.app_context():
+            session.runBlocking()
+            finished[session] = time.monotonic()
+
+    threads = [threading.Thread(target=run, args=(s,)) for s in sessions]
+    start = time.monotonic()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sessions, start, finished
+
+
+def runReactor(app, printers, jobs):
+    reactor = SerialReactor(app)
+    reactor.start()
+    finished = {}
+    done = threading.Event()
+    ports = {}
+
+    def onDone(session, verdict):
+        finished[session] = time.monotonic()
+        reactor.unregister(ports.pop(session))
+        if len(finished) == len(sessions):
+            done.set()
+
+    sessions = [openSession(p, j, onDone) for p, j in zip(printers, jobs)]
+
+    def startAll():
+        for session in sessions:
+            ser = session.printer.ser
+            ports[session] = reactor.register(ser, session, ser.timeout)
+        for session in sessions:
+            session.start()
+
+    start = time.monotonic()
+    reactor.callSoon(startAll)
+    done.wait()
+    return sessions, start, finished
+
+
+def report(mode, sessions, start, finished):
+    durations = [finished[s] - start for s in sessions]
+    commands = sum(s.sent_lines for s in sessions)
+    verdicts = {s.verdict for s in sessions}
+    wall = max(durations)
+    print(f"  {mode:8} {commands / wall:10.0f} commands/s  wall {wall:6.2f}s  "
+          f"per printer {min(durations):6.2f}s - {max(durations):6.2f}s  verdicts {sorted(map(str, verdicts))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--printers", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--lines", type=int, default=5000)
+    parser.add_argument("--latency", type=float, default=1.0, help="milliseconds before each ok")
+    parser.add_argument("--no-streaming", action="store_true", help="send one command at a time")
+    args = parser.parse_args()
+
+    # job logs (and the uploads folder the app resets on import) go next to a scratch server folder
+    workdir = tempfile.mkdtemp()
+    serverdir = os.path.join(workdir, "server")
+    os.makedirs(serverdir)
+    os.symlink(os.path.join(SERVER, "config"), os.path.join(serverdir, "config"))
+    os.chdir(serverdir)
+
+    # the models need the app (and its socketio) to import. Nothing is written to the database.
+    global Job, Printer
+    from app import app
+    from models.jobs import Job
+    from models.printers import Printer
+
+    app.blob_store = BlobStore(os.path.join(workdir, "blobs"))
+    with app.app_context():
+        compiled_hash, gcode_meta = Job.compileFile(app.blob_store.put(makeGcode(args.lines)))
+
+    try:
+        with app.app_context():
+            for count in args.printers:
+                print(f"{count} printers, {gcode_meta['total_lines']} commands each, {args.latency}ms per ok")
+                for mode, run in (("threads", runThreads), ("reactor", runReactor)):
+                    parent, child = Pipe()
+                    fleet = Process(target=runFleet, args=(count, args.latency / 1000, child), daemon=True)
+                    fleet.start()
+                    devices = parent.recv()
+                    printers = [makePrinter(i, d, not args.no_streaming) for i, d in enumerate(devices)]
+                    jobs = [makeJob(i, compiled_hash, gcode_meta) for i in range(count)]
+                    sessions, start, finished = run(app, printers, jobs)
+                    report(mode, sessions, start, finished)
+                    for session in sessions:
+                        session.printer.closeJobLogger(session.logger, session.logFile)
+                    for printer in printers:
+                        printer.ser.close()
+                    fleet.terminate()
+                    fleet.join()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,18 @@
 import base64
-from io import BytesIO
 import io
-import shutil
 import tempfile
 from flask import Blueprint, Response, jsonify, request, make_response, send_file
 from models.jobs import Job
-from models.printers import Printer
+from Classes.GcodeIndex import gzipStream, layerBytes, readByteRange, readLineRange
+from Classes.Thumbnails import MIMETYPES, pickThumbnail
+from Classes.Bus import RepairPorts, UpdateJobStatus
 from app import printer_status_service
 import json 
 from werkzeug.utils import secure_filename
 import os 
 import gzip
+import re
 from flask import current_app
-import serial
-import serial.tools.list_ports
 
 # get data for jobs 
 jobs_bp = Blueprint("jobs", __name__)
@@ -43,11 +42,14 @@ def getJobs():
     fromError = request.args.get('fromError', default=0, type=int)
     
     countOnly = request.args.get('countOnly', default=0, type=int)
+
+    # keyset pagination: "" for the first page, then the cursor returned with the previous page
+    cursor = request.args.get('cursor', default=None, type=str)
     
     print(fromError)
 
     try:
-        res = Job.get_job_history(page, pageSize, printerIds, oldestFirst, searchJob, searchCriteria, searchTicketId, favoriteOnly, issueIds, startdate, enddate, fromError, countOnly)
+        res = Job.get_job_history(page, pageSize, printerIds, oldestFirst, searchJob, searchCriteria, searchTicketId, favoriteOnly, issueIds, startdate, enddate, fromError, countOnly, cursor)
         return jsonify(res)
     except Exception as e:
         print(f"Unexpected error: {e}")
@@ -305,9 +307,9 @@ def bumpjob():
         printerobject = findPrinterObject(printer_id)
         
         if choice == 1: 
-            printerobject.queue.bump(True, job_id)
+            printerobject.queue.bump(True, job_id, printer_id)
         elif choice == 2: 
-            printerobject.queue.bump(False, job_id)
+            printerobject.queue.bump(False, job_id, printer_id)
         elif choice == 3: 
             printerobject.queue.bumpExtreme(True, job_id, printer_id)
         elif choice == 4: 
@@ -328,7 +330,7 @@ def moveJob():
         arr = data['arr']
         
         printerobject = findPrinterObject(printer_id)
-        printerobject.queue.reorder(arr)
+        printerobject.queue.reorder(arr, printer_id)
         return jsonify({"success": True, "message": "Queue updated successfully."}), 200
     except Exception as e:
         print(f"Unexpected error: {e}")
@@ -341,16 +343,9 @@ def updateJobStatus():
         job_id = data['jobid']
         newstatus = data['status']
         
-        res = Job.update_job_status(job_id, newstatus)
-        
-        job = Job.findJob(job_id) 
-        printerid = job.getPrinterId() 
-        printerobject = findPrinterObject(printerid)
-        queue = printerobject.getQueue()
-        
-        # queue.deleteJob(job_id, printerid)
-        
-        return jsonify(res), 200
+        # written right away, unlike the statuses the printer threads report (Printer.sendStatusToJob),
+        # so an unknown job (404) or a database error (500) reaches the caller
+        return current_app.bus.send(UpdateJobStatus(job_id, newstatus))
     except Exception as e:
         print(f"Unexpected error: {e}")
         return jsonify({"error": "Unexpected error occurred"}), 500
@@ -433,7 +428,144 @@ def getFile():
     except Exception as e:
         print(f"Unexpected error: {e}")
         return jsonify({"error": "Unexpected error occurred"}), 500
-    
+
+@jobs_bp.route('/getgcodeindex', methods=["GET"])
+def getGcodeIndex():
+    try:
+        job_id = request.args.get('jobid', default=-1, type=int)
+        job = Job.findJob(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        index = job.getFileIndex()
+        return jsonify({"lines": index["lines"], "size": index["size"], "layers": index["layers"], "file_name": job.getFileNameOriginal()}), 200
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return jsonify({"error": "Unexpected error occurred"}), 500
+
+# Part of the uploaded file as plain text: lines, layers or bytes start to end - 1 (unit=lines|layers|bytes).
+# Only that part is decompressed, and it is streamed (gzip-encoded if the client accepts it).
+@jobs_bp.route('/getgcode', methods=["GET"])
+def getGcode():
+    try:
+        job_id = request.args.get('jobid', default=-1, type=int)
+        unit = request.args.get('unit', default='layers')
+        start = request.args.get('start', default=0, type=int)
+        job = Job.findJob(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        index = job.getFileIndex()
+        store = current_app.blob_store
+
+        if unit == 'lines':
+            end = request.args.get('end', default=index["lines"], type=int)
+            body = readLineRange(store, job.file_hash, index, start, end)
+        elif unit == 'layers':
+            end = request.args.get('end', default=max(len(index["layers"]), 1), type=int)
+            first, last = layerBytes(index, start, end)
+            body = readByteRange(store, job.file_hash, index, first, last)
+        elif unit == 'bytes':
+            end = request.args.get('end', default=index["size"], type=int)
+            body = readByteRange(store, job.file_hash, index, start, end)
+        else:
+            return jsonify({"error": "unit must be lines, layers or bytes"}), 400
+
+        headers = {
+            "X-Total-Lines": str(index["lines"]),
+            "X-Total-Layers": str(len(index["layers"])),
+            "X-Total-Bytes": str(index["size"]),
+            "Access-Control-Expose-Headers": "X-Total-Lines, X-Total-Layers, X-Total-Bytes",
+            "Vary": "Accept-Encoding",
+        }
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            body = gzipStream(body)
+            headers["Content-Encoding"] = "gzip"
+        return Response(body, mimetype='text/plain', headers=headers)
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return jsonify({"error": "Unexpected error occurred"}), 500
+
+# Answer for something made in the background (thumbnails, toolpaths): nothing to show yet, and
+# nothing the browser should keep. The client asks again after Retry-After seconds.
+def notReady(message):
+    response = jsonify({"message": message})
+    response.status_code = 202
+    response.headers["Retry-After"] = "5"
+    response.headers["Access-Control-Expose-Headers"] = "Retry-After"
+    response.cache_control.no_store = True
+    return response
+
+# Thumbnails are addressed by the hash of the file they show, so they never change and browsers
+# can keep them for good
+@jobs_bp.route('/thumbnail/<file_hash>', methods=["GET"])
+def getThumbnail(file_hash):
+    try:
+        if not re.fullmatch(r"[0-9a-f]{64}", file_hash) or not current_app.blob_store.exists(file_hash):
+            return jsonify({"error": "File not found"}), 404
+        width = request.args.get('width', default=0, type=int)
+        listing = current_app.toolpaths.thumbnails(file_hash)
+        if listing is None:
+            return notReady("Thumbnail is being made")
+        thumbnail = pickThumbnail(listing, width)
+        if thumbnail is None:
+            return jsonify({"error": "No thumbnail"}), 404
+        width, height, fmt, rendered = thumbnail
+        path = current_app.blob_store.sidecarPath(file_hash, f"thumbnail-{width}x{height}", fmt)
+        response = send_file(path, mimetype=MIMETYPES[fmt], max_age=31536000, conditional=True)
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        response.headers["X-Thumbnail-Rendered"] = "1" if rendered else "0"
+        return response
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return jsonify({"error": "Unexpected error occurred"}), 500
+
+@jobs_bp.route('/gettoolpathindex', methods=["GET"])
+def getToolpathIndex():
+    try:
+        job_id = request.args.get('jobid', default=-1, type=int)
+        job = Job.findJob(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        index = current_app.toolpaths.index(job.file_hash)
+        if index is None:
+            return notReady("Toolpath is being built")
+        # the layer table of every level of detail, from all the moves (level 0) to the coarsest
+        levels = [{"cell": level["cell"], "layers": level["layers"]} for level in index["levels"]]
+        return jsonify({"levels": levels, "bounds": index["bounds"]}), 200
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return jsonify({"error": "Unexpected error occurred"}), 500
+
+# Vertex buffers of layers start to end - 1 at a level of detail, as Float32 (x, y, z) pairs: for each
+# layer its extrusion segments, then its travel segments. The vertex counts of each layer are in /gettoolpathindex.
+@jobs_bp.route('/gettoolpath', methods=["GET"])
+def getToolpath():
+    try:
+        job_id = request.args.get('jobid', default=-1, type=int)
+        job = Job.findJob(job_id)
+        if job is None:
+            return jsonify({"error": "Job not found"}), 404
+        index = current_app.toolpaths.index(job.file_hash)
+        if index is None:
+            return notReady("Toolpath is being built")
+        level = request.args.get('level', default=0, type=int)
+        layers = index["levels"][0]["layers"]
+        start = request.args.get('start', default=0, type=int)
+        end = request.args.get('end', default=len(layers), type=int)
+
+        headers = {
+            "X-Total-Layers": str(len(layers)),
+            "Access-Control-Expose-Headers": "X-Total-Layers, ETag",
+            "Cache-Control": "no-cache",
+        }
+        # the toolpath of a file never changes, a viewer that has it already gets a 304
+        response = Response(current_app.toolpaths.read(job.file_hash, index, start, end, level), mimetype='application/octet-stream', headers=headers)
+        response.set_etag(f"{job.file_hash}-{level}-{start}-{end}")
+        return response.make_conditional(request)
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return jsonify({"error": "Unexpected error occurred"}), 500
+
 @jobs_bp.route('/nullifyjobs', methods=["POST"])
 def nullifyJobs():
     try: 
@@ -541,15 +673,34 @@ def downloadCSV():
         data = request.get_json()
         alljobsselected = data.get('allJobs')
         jobids = data.get('jobIds')
+        # csv or ndjson
+        format = data.get('format', 'csv')
+        if format not in ('csv', 'ndjson'):
+            return jsonify({"error": "Unknown export format"}), 400
+
+        # the job history filters (see /getjobs), instead of listing the job IDs
+        filters = data.get('filters')
+        if filters is not None:
+            filters = {
+                'printerIds': filters.get('printerIds'),
+                'oldestFirst': bool(filters.get('oldestFirst', False)),
+                'searchJob': filters.get('searchJob', ''),
+                'searchCriteria': filters.get('searchCriteria', ''),
+                'searchTicketId': filters.get('searchTicketId', ''),
+                'favoriteOnly': bool(filters.get('favoriteOnly', False)),
+                'issueIds': filters.get('issueIds'),
+                'startDate': filters.get('startdate', ''),
+                'endDate': filters.get('enddate', ''),
+                'fromError': filters.get('fromError', 0),
+            }
 
         if alljobsselected == 1:
-            # Call the model method to get the CSV content
-            res = Job.downloadCSV(1)
+            # Call the model method to stream the export
+            res = Job.downloadCSV(1, format=format)
         else:
-            # Call the model method to get the CSV content
-            res = Job.downloadCSV(0, jobids)
+            # Call the model method to stream the export
+            res = Job.downloadCSV(0, jobids, filters, format)
 
-        print(res)
         return res 
 
     except Exception as e:
@@ -557,40 +708,10 @@ def downloadCSV():
         return jsonify({"error": "Unexpected error occurred"}), 500
     
 
-@jobs_bp.route('/removeCSV', methods=["GET", "POST"])
-def removeCSV():
-    try:
-        # Create in-memory uploads folder 
-        csv_folder = os.path.join('../tempcsv')
-        if os.path.exists(csv_folder):
-            shutil.rmtree(csv_folder)
-            os.makedirs(csv_folder)
-            print("TempCSV folder recreated as an empty directory.")
-        else:
-            # Create the uploads folder if it doesn't exist
-            os.makedirs(csv_folder)
-            print("TempCSV folder created successfully.")  
-        
-        return jsonify({"success": True, "message": "CSV file removed successfully."}), 200
-
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        return jsonify({"error": "Unexpected error occurred"}), 500
-
 @jobs_bp.route("/repairports", methods=["POST", "GET"])
 def repair_ports(): 
     try:
-        ports = serial.tools.list_ports.comports()    
-        for port in ports: 
-            hwid = port.hwid # get hwid 
-            hwid_without_location = hwid.split(' LOCATION=')[0]
-            printer = Printer.getPrinterByHwid(hwid_without_location)
-            if printer is not None: 
-                if(printer.getDevice()!=port.device):
-                    printer.editPort(printer.getId(), port.device)
-                    printerthread = findPrinterObject(printer.getId())
-                    printerthread.setDevice(port.device)
-        return {"success": True, "message": "Printer port(s) successfully updated."}
+        return current_app.bus.send(RepairPorts())
     except Exception as e:
         print(f"Unexpected error: {e}")
         return jsonify({"error": "Unexpected error occurred"}), 500
@@ -647,21 +768,16 @@ def getLogFile():
             fileName,
             job.date.strftime('%m-%d-%Y_%H-%M-%S'),
             "color",
-            "INFO.log"
+            "INFO.log.gz"
         )
 
         # Ensure the log file exists
         if not os.path.isfile(logFile):
             return jsonify({"error": f"Log file not found at path: {logFile}"}), 404
 
-        # Compress the file in memory
+        # The log is written gzip-compressed, send it as it is
         with open(logFile, "rb") as f_in:
-            buffer = BytesIO()
-            with gzip.GzipFile(fileobj=buffer, mode="wb") as gz:
-                gz.write(f_in.read())
-
-            # Get the compressed data as bytes
-            compressed_data = buffer.getvalue()
+            compressed_data = f_in.read()
 
         # Encode the compressed data in base64
         encoded_data = base64.b64encode(compressed_data).decode('utf-8')
@@ -669,7 +785,7 @@ def getLogFile():
         # Return the compressed file in JSON
         return jsonify({
             "success": True,
-            "filename": os.path.basename(logFile) + ".gz",
+            "filename": os.path.basename(logFile),
             "file": encoded_data
         })
 
@@ -680,13 +796,16 @@ def getLogFile():
 
 
 def findPrinterObject(printer_id): 
-    threads = printer_status_service.getThreadArray()
-    return list(filter(lambda thread: thread.printer.id == printer_id, threads))[0].printer  
+    printer = printer_status_service.printers.getPrinter(printer_id)
+    if printer is None:
+        raise LookupError(f"Printer {printer_id} has no thread")
+    return printer
 
 def getSmallestQueue():
-    threads = printer_status_service.getThreadArray()
-    smallest_queue_thread = min(threads, key=lambda thread: thread.printer.queue.getSize())
-    return smallest_queue_thread.printer.id
+    printer_id = printer_status_service.printers.smallestQueue()
+    if printer_id is None:
+        raise LookupError("No printers to queue the job on")
+    return printer_id
     
 def rerunjob(printerpk, jobpk, position):
     job = Job.findJob(jobpk) # retrieve Job to rerun 
@@ -696,7 +815,7 @@ def rerunjob(printerpk, jobpk, position):
     favorite = job.getFileFavorite() # get favorite status
     td_id = job.getTdId()
     # Insert new job into DB and return new PK 
-    res = Job.jobHistoryInsert(name=job.getName(), printer_id=printerpk, status=status, file=job.getFile(), file_name_original=file_name_original, favorite=favorite, td_id=td_id) # insert into DB 
+    res = Job.jobHistoryInsert(name=job.getName(), printer_id=printerpk, status=status, file=None, file_name_original=file_name_original, favorite=favorite, td_id=td_id, file_hash=job.file_hash, compiled_hash=job.getCompiledHash(), gcode_meta=job.getGcodeMeta()) # insert into DB, sharing the stored file and its compiled stream 
     
     id = res['id']
     file_name_pk = file_name_original + f"_{id}" # append id to file name to make it unique
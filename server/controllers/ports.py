@@ -85,6 +85,20 @@ def edit_name():
         print(f"Unexpected error: {e}")
         return jsonify({"error": "Unexpected error occurred"}), 500
     
+@ports_bp.route("/editstreaming", methods=["POST"])
+def edit_streaming(): 
+    try: 
+        from app import printer_status_service
+        data = request.get_json() 
+        printerid = data['printerid']
+        streaming = data['streaming'] # true = pipelined sending, false = one command at a time, null = config default
+        res = Printer.editStreaming(printerid, streaming)
+        printer_status_service.editStreaming(printerid, streaming)
+        return res 
+    except Exception as e:
+        print(f"Unexpected error: {e}")
+        return jsonify({"error": "Unexpected error occurred"}), 500
+    
 @ports_bp.route("/diagnose", methods=["POST"])
 def diagnose_printer():
     try:
@@ -1,6 +1,7 @@
 from flask import Blueprint, jsonify
 from app import printer_status_service  # import the instance from app.py
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, current_app
+from Classes.Bus import RestoreQueue
 from models.jobs import Job 
 import os
 
@@ -41,7 +42,7 @@ def queueRestore():
         data = request.get_json() # get json data 
         id = data['printerid']
         status = data['status']
-        res = printer_status_service.queueRestore(id, status)
+        res = current_app.bus.send(RestoreQueue(id, status))
         return res 
     except Exception as e:
         print(f"Unexpected error: {e}")
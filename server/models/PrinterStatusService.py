@@ -1,10 +1,12 @@
-from threading import Thread
+from concurrent.futures import ThreadPoolExecutor
+from threading import RLock, Thread
 from models.printers import Printer
 import serial
 import serial.tools.list_ports
-import time
-import requests
 from Classes.Queue import Queue
+from Classes.PrinterRegistry import PrinterRegistry
+from Classes.SerialReactor import SerialReactor
+from models.config import Config
 from flask import jsonify 
 
 class PrinterThread(Thread):
@@ -12,13 +14,33 @@ class PrinterThread(Thread):
         super().__init__(*args, **kwargs)
         self.printer = printer
 
+# Stands in for a PrinterThread when the printer is driven by the shared SerialReactor
+class PrinterTask:
+    def __init__(self, printer):
+        self.printer = printer
+
 class PrinterStatusService:
     # in order to access the app context, we need to pass the app to the PrinterStatusService, mainly for the websockets
     def __init__(self, app):
         self.app = app
-        self.printer_threads = []  # array of printer threads
+        self.printers = PrinterRegistry()  # the printer threads, by id, hwid and device, in display order
+        self.__reset_lock = RLock()  # one reset, restore or delete at a time, so no thread is left running twice
+        # When the reactor is available, one thread multiplexes the serial ports of every printer and runs
+        # each print as a PrintSession state machine. Blocking steps (connecting, HTTP, database, ending
+        # sequences) run on a small worker pool. Otherwise every printer gets its own PrinterThread.
+        self.reactor = None
+        self.workers = None
+        self.sessions = {}  # PrintSession -> reactor port
+        if Config['reactor_enabled'] and SerialReactor.isSupported():
+            self.reactor = SerialReactor(app)
+            self.workers = ThreadPoolExecutor(max_workers=Config['reactor_workers'], thread_name_prefix="printer-worker")
+            self.reactor.start()
+            self.reactor.callSoon(self.dispatch)
 
     def start_printer_thread(self, printer):
+        if self.reactor:
+            printer.onChange = self.wakeReactor
+            return PrinterTask(printer)
         # also pass the app to the printer thread
         thread = PrinterThread(printer, target=self.update_thread, args=(printer, self.app)) 
         thread.daemon = True #lets you kill the thread when the main program exits, allows for the server to be shut down
@@ -35,11 +57,12 @@ class PrinterStatusService:
                 hwid=printer_info["hwid"],
                 name=printer_info["name"],
                 status='configuring',
+                streaming=printer_info.get("streaming"),
             )
             printer_thread = self.start_printer_thread(
                 printer
             )  # creating a thread for each printer object
-            self.printer_threads.append(printer_thread)
+            self.printers.add(printer_thread)
 
         # creating separate thread to loop through all of the printer threads to ping them for print status
         self.ping_thread = Thread(target=self.pingForStatus)
@@ -54,6 +77,7 @@ class PrinterStatusService:
                 description=printer_info["description"],
                 hwid=printer_info["hwid"],
                 name=printer_info["name"],
+                streaming=printer_info.get("streaming"),
             )
             for job in queue: 
                 if(job.status!='inqueue'):
@@ -64,38 +88,139 @@ class PrinterStatusService:
             printer_thread = self.start_printer_thread(
                 printer
             )  # creating a thread for each printer object
-            self.printer_threads.append(printer_thread)
+            self.printers.add(printer_thread)
 
     # passing app here to access the app context
     def update_thread(self, printer, app):
         with app.app_context():
             while True:
-                time.sleep(2)
+                # setStatus and the queue wake the printer up; the timeout keeps the old 2 second check
+                # in case a wake-up is missed
+                printer.waitFor(lambda: printer.getStatus() == "ready" and printer.getQueue().getSize() > 0, 2)
                 status = printer.getStatus()  # get printer status
 
                 queueSize = printer.getQueue().getSize() # get size of queue 
                 printer.responseCount = 0 
                 if (status == "ready" and queueSize > 0):
-                    time.sleep(2) # wait for 2 seconds to allow the printer to process the queue
-                    if status != "offline": 
-                        printer.printNextInQueue()
+                    printer.printNextInQueue()
+
+    # Wakes a printer up by id (Job.setReleased, through the bus)
+    def wake(self, printer_id):
+        printer = self.printers.getPrinter(printer_id)
+        if printer is not None:
+            printer.wake()
+
+    # Printer.onChange in reactor mode: has the reactor look at the printer now instead of at the
+    # next dispatch. Several wake-ups before it runs are handled once.
+    def wakeReactor(self, printer):
+        if not printer.dispatchQueued:
+            printer.dispatchQueued = True
+            self.reactor.callSoon(self.dispatchPrinter, printer)
+
+    # Reactor mode: runs on the reactor thread once a second in place of every printer's update_thread.
+    # Printers that change in between are dispatched right away (wakeReactor).
+    def dispatch(self):
+        self.reactor.callLater(1, self.dispatch)
+        for session in list(self.sessions):
+            session.tick()
+
+        for thread in self.printers:
+            self.dispatchPrinter(thread.printer, tick=False)
+
+    # reactor thread
+    def dispatchPrinter(self, printer, tick=True):
+        printer.dispatchQueued = False  # before anything is read, so a change from now on queues another
+        if printer.terminated == 1:
+            return
+        if tick and printer.session is not None:
+            printer.session.tick()  # a paused print resumes or ends on the status change
+        job = printer.pendingJob
+        if job is not None:
+            if job.getReleased() == 1:
+                printer.pendingJob = None
+                self.submit(self.launchJob, printer, job)
+            elif printer.getStatus() == "complete":
+                printer.pendingJob = None
+                self.submit(self.finishJob, printer, job, None, "misprint")
+        elif not printer.busy and printer.getStatus() == "ready" and printer.getQueue().getSize() > 0:
+            printer.busy = True
+            printer.responseCount = 0
+            self.submit(self.startJob, printer)
+
+    # runs fn(*args) on the worker pool, inside the app context
+    def submit(self, fn, *args):
+        def run():
+            with self.app.app_context():
+                try:
+                    fn(*args)
+                except Exception as e:
+                    print(f"Unexpected error: {e}")
+        self.workers.submit(run)
+
+    # worker: marks the next job as printing. dispatch waits for it to be released.
+    def startJob(self, printer):
+        job = printer.getQueue().getNext()  # get next job
+        try:
+            printer.setStatus("printing")  # set printer status to printing
+            printer.sendStatusToJob(job, job.id, "printing")
+            printer.pendingJob = job
+            printer.wake()  # in case it was released already
+        except Exception as e:
+            printer.failJob(job, e)
+            printer.busy = False
+
+    # worker: connects and hands the session to the reactor
+    def launchJob(self, printer, job):
+        try:
+            session = printer.openSession(job, self.sessionDone) if printer.prepareJob(job) else None
+            if session is None:
+                printer.busy = False
+                return
+            self.reactor.callSoon(self.startSession, session)
+        except Exception as e:
+            printer.failJob(job, e)
+            printer.busy = False
+
+    # reactor thread
+    def startSession(self, session):
+        printer = session.printer
+        try:
+            ser = printer.getSer()
+            self.sessions[session] = self.reactor.register(ser, session, ser.timeout)
+        except Exception as e:
+            self.sessions[session] = None
+            session.fail(e)
+            return
+        printer.session = session
+        session.start()
+
+    # reactor thread, called by PrintSession.finish
+    def sessionDone(self, session, verdict):
+        port = self.sessions.pop(session, None)
+        if port is not None:
+            self.reactor.unregister(port)
+        session.printer.session = None
+        self.submit(self.finishJob, session.printer, session.job, session, verdict)
+
+    # worker: closes the log and handles the verdict, like printNextInQueue does after parseGcode
+    def finishJob(self, printer, job, session, verdict):
+        try:
+            if session:
+                printer.closeJobLogger(session.logger, session.logFile)
+            printer.handleVerdict(verdict, job)
+        finally:
+            printer.busy = False
+            printer.wake()  # the next job can start if the printer is ready
 
     def resetThread(self, printer_id):
         try: 
-            for thread in self.printer_threads:
-                if thread.printer.id == printer_id:    
+            with self.__reset_lock:
+                thread = self.printers.get(printer_id)
+                if thread is not None:
                     printer = thread.printer
                     printer.terminated = 1 
-                    thread_data = {
-                        "id": printer.id, 
-                        "device": printer.device,
-                        "description": printer.description,
-                        "hwid": printer.hwid,
-                        "name": printer.name, 
-                    }
-                    self.printer_threads.remove(thread)
-                    self.create_printer_threads([thread_data])
-                    break
+                    # the new thread takes the old one's place in the registry
+                    self.create_printer_threads([self.threadData(printer)])
             return jsonify({"success": True, "message": "Printer thread reset successfully"})
         except Exception as e:
             print(f"Unexpected error: {e}")
@@ -104,51 +229,66 @@ class PrinterStatusService:
     
     def queueRestore(self, printer_id, status):
         try: 
-            for thread in self.printer_threads:
-                if thread.printer.id == printer_id:    
+            with self.__reset_lock:
+                thread = self.printers.get(printer_id)
+                if thread is not None:
                     printer = thread.printer
                     printer.terminated = 1 
-                    thread_data = {
-                        "id": printer.id, 
-                        "device": printer.device,
-                        "description": printer.description,
-                        "hwid": printer.hwid,
-                        "name": printer.name, 
-                    }
-                    self.printer_threads.remove(thread)
-                    self.queue_restore([thread_data], status, printer.getQueue())
-                    break
+                    self.queue_restore([self.threadData(printer)], status, printer.getQueue())
             return jsonify({"success": True, "message": "Printer thread reset successfully"})
         except Exception as e:
             print(f"Unexpected error: {e}")
             return jsonify({"success": False, "error": "Unexpected error occurred"}), 500
+
+    # what create_printer_threads needs to start a printer again
+    def threadData(self, printer):
+        return {
+            "id": printer.id, 
+            "device": printer.device,
+            "description": printer.description,
+            "hwid": printer.hwid,
+            "name": printer.name, 
+            "streaming": printer.streaming,
+        }
         
+    # Points registered printers whose port moved at their new device, in the database and in their thread
+    def repairPorts(self):
+        try:
+            for port in serial.tools.list_ports.comports():
+                hwid_without_location = port.hwid.split(' LOCATION=')[0]
+                printer = Printer.getPrinterByHwid(hwid_without_location)
+                if printer is not None and printer.getDevice() != port.device:
+                    printer.editPort(printer.getId(), port.device)
+                    self.printers.setDevice(printer.getId(), port.device)
+            return {"success": True, "message": "Printer port(s) successfully updated."}
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            return jsonify({"error": "Unexpected error occurred"}), 500
+
     def deleteThread(self, printer_id):
         try: 
-            for thread in self.printer_threads:
-                if thread.printer.id == printer_id:    
-                    printer = thread.printer
-                    thread_data = {
-                        "id": printer.id, 
-                        "device": printer.device,
-                        "description": printer.description,
-                        "hwid": printer.hwid,
-                        "name": printer.name
-                    }
-                    self.printer_threads.remove(thread)
-                    break
+            with self.__reset_lock:
+                self.printers.remove(printer_id)
             return jsonify({"success": True, "message": "Printer thread reset successfully"})
         except Exception as e:
             print(f"Unexpected error: {e}")
             return jsonify({"success": False, "error": "Unexpected error occurred"}), 500
         
+    def editStreaming(self, printer_id, streaming):
+        try: 
+            printer = self.printers.getPrinter(printer_id)
+            if printer is not None:
+                printer.streaming = streaming
+            return jsonify({"success": True, "message": "Printer streaming mode updated successfully"})
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            return jsonify({"success": False, "error": "Unexpected error occurred"}), 500
+        
     def editName(self, printer_id, name):
         try: 
-            for thread in self.printer_threads:
-                if thread.printer.id == printer_id:    
-                    printer = thread.printer
-                    printer.name = name
-                    break
+            printer = self.printers.getPrinter(printer_id)
+            if printer is not None:
+                printer.name = name
             return jsonify({"success": True, "message": "Printer name updated successfully"})
         except Exception as e:
             print(f"Unexpected error: {e}")
@@ -158,7 +298,7 @@ class PrinterStatusService:
     # this method will be called by the UI to get the printers that have a threads information
     def retrieve_printer_info(self):
         printer_info_list = []
-        for thread in self.printer_threads:
+        for thread in self.printers:
             printer = (
                 thread.printer
             )  # get the printer object associated with the thread
@@ -171,42 +311,24 @@ class PrinterStatusService:
                 "id": printer.id,
                 "error": printer.error, 
                 "canPause": printer.canPause,
-                "queue": [], # empty queue to store job objects 
+                "streaming": printer.isStreaming(),
+                "sendRate": printer.sendRate,
                 "colorChangeBuffer": printer.colorbuff
                 # "colorChangeBuffer": printer.colorChangeBuffer
             }
-            queue = printer.getQueue()
-            for job in queue: 
-                job_info = {
-                    "id": job.id,
-                    "name": job.name,
-                    "status": job.status,
-                    "date": job.date.strftime('%a, %d %b %Y %H:%M:%S'),
-                    "printerid": job.printer_id, 
-                    "errorid": job.error_id,
-                    "file_name_original": job.file_name_original, 
-                    "progress": job.progress,
-                    "sent_lines": job.sent_lines,
-                    "favorite": job.favorite,
-                    "released": job.released,
-                    "file_pause": job.filePause, 
-                    "comments": job.comments, 
-                    "extruded": job.extruded,
-                    "td_id": job.td_id,
-                    "time_started": job.time_started,
-                    "printer_name": job.printer_name,
-                    "max_layer_height": job.max_layer_height,
-                    "current_layer_height": job.current_layer_height,
-                    "filament": job.filament,
-                }
-                printer_info['queue'].append(job_info)
+            # the queue and the epoch and sequence number it is at, so queue_update ops can be applied on top
+            snapshot = printer.getQueue().snapshot(printer.id)
+            printer_info["queue"] = snapshot["queue"]
+            printer_info["queue_seq"] = snapshot["seq"]
+            printer_info["queue_epoch"] = snapshot["epoch"]
             
             printer_info_list.append(printer_info)
             
         return printer_info_list
 
+    # a snapshot of the printer threads in display order
     def getThreadArray(self):
-        return self.printer_threads
+        return self.printers.threads()
     
     def pingForStatus(self):
         """_summary_ pseudo code
@@ -217,17 +339,7 @@ class PrinterStatusService:
         """
         pass
 
-    def getThreadArray(self):
-        return self.printer_threads
-    
     def movePrinterList(self, printer_ids):
         # printer_ids is a list of printer ids in the order they should be displayed
-        new_thread_list = []
-        for id in printer_ids:
-            for thread in self.printer_threads:
-                if thread.printer.id == id:
-                    new_thread_list.append(thread)
-                    break
-        self.printer_threads = new_thread_list
+        self.printers.reorder(printer_ids)
         return jsonify({"success": True, "message": "Printer list reordered successfully"})
-
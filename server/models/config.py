@@ -14,8 +14,43 @@ config = load_config('./config/config.json')
 environment = config.get('environment', 'development')
 ip = config.get('ip', '127.0.0.1')
 database_uri = config.get('databaseURI', 'hvamc') + ".db"
+blob_store = config.get('blobStore', 'blobs')
 port = os.environ.get('FLASK_RUN_PORT', 8000)
 
+streaming_config = config.get('streaming', {})
+streaming_enabled = streaming_config.get('enabled', True)
+streaming_window = streaming_config.get('window_size', 4)
+streaming_rx_buffer = streaming_config.get('rx_buffer_size', 128)
+
+logging_config = config.get('logging', {})
+log_queue_size = logging_config.get('queue_size', 10000)
+log_batch_size = logging_config.get('batch_size', 256)
+log_flush_interval = logging_config.get('flush_interval', 2)
+
+socketio_config = config.get('socketio', {})
+emit_rate = socketio_config.get('emit_rate', 5)
+
+reactor_config = config.get('reactor', {})
+reactor_enabled = reactor_config.get('enabled', True)
+reactor_workers = reactor_config.get('workers', 4)
+
+toolpath_config = config.get('toolpath', {})
+toolpath_workers = toolpath_config.get('workers', 2)
+
+retention_config = config.get('retention', {})
+retention_enabled = retention_config.get('enabled', True)
+retention_max_age_days = retention_config.get('max_age_days', 182)
+retention_max_store_mb = retention_config.get('max_store_mb', 0)
+retention_interval = retention_config.get('interval_hours', 24) * 3600
+retention_batch_size = retention_config.get('batch_size', 500)
+
+database_config = config.get('database', {})
+db_busy_timeout = database_config.get('busy_timeout_ms', 10000)
+db_synchronous = database_config.get('synchronous', 'NORMAL')
+db_cache_mb = database_config.get('cache_mb', 32)
+db_write_interval = database_config.get('write_interval', 0.5)
+db_write_batch_size = database_config.get('write_batch_size', 500)
+
 discord_config = config.get('discord', {})
 discord_enabled = discord_config.get('enabled', False)
 discord_token = discord_config.get('token', None)
@@ -28,7 +63,28 @@ Config = {
     'environment': environment,
     'ip': ip,
     'database_uri': database_uri,
+    'blob_store': blob_store,
     'port': port,
+    'streaming_enabled': streaming_enabled,
+    'streaming_window': streaming_window,
+    'streaming_rx_buffer': streaming_rx_buffer,
+    'log_queue_size': log_queue_size,
+    'log_batch_size': log_batch_size,
+    'log_flush_interval': log_flush_interval,
+    'emit_rate': emit_rate,
+    'reactor_enabled': reactor_enabled,
+    'reactor_workers': reactor_workers,
+    'toolpath_workers': toolpath_workers,
+    'retention_enabled': retention_enabled,
+    'retention_max_age_days': retention_max_age_days,
+    'retention_max_store_mb': retention_max_store_mb,
+    'retention_interval': retention_interval,
+    'retention_batch_size': retention_batch_size,
+    'db_busy_timeout': db_busy_timeout,
+    'db_synchronous': db_synchronous,
+    'db_cache_mb': db_cache_mb,
+    'db_write_interval': db_write_interval,
+    'db_write_batch_size': db_write_batch_size,
     'discord_enabled': discord_enabled,
     'discord_token': discord_token,
     'command_prefix': discord_prefix,
@@ -1,3 +1,24 @@
+import sqlite3
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from models.config import Config
 
 db = SQLAlchemy()
+
+# Set on every new SQLite connection. WAL lets the request threads read while a printer thread
+# writes, and with synchronous=NORMAL a commit appends to the WAL without waiting on an fsync
+# (the database can lose the last commits on a power cut, it does not get corrupted). A writer
+# that finds the database locked waits up to busy_timeout instead of failing.
+def setPragmas(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode = WAL")
+    cursor.execute(f"PRAGMA busy_timeout = {int(Config['db_busy_timeout'])}")
+    cursor.execute(f"PRAGMA synchronous = {Config['db_synchronous']}")
+    cursor.execute(f"PRAGMA cache_size = {-int(Config['db_cache_mb'] * 1024)}")  # negative: in KiB
+    cursor.execute("PRAGMA temp_store = MEMORY")
+    cursor.close()
+
+event.listen(Engine, "connect", setPragmas)
@@ -2,32 +2,58 @@ import asyncio
 import base64
 from operator import or_
 import os
-import re
 from models.db import db
 from models.printers import Printer 
 
 from models.issues import Issue  # assuming the Issue model is defined in the issue.py file in the models directory
 from datetime import datetime, timezone, timedelta
 from sqlalchemy import Column, String, LargeBinary, DateTime, ForeignKey
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred, load_only, joinedload
 from flask import jsonify, current_app
 from sqlalchemy.exc import SQLAlchemyError
 from datetime import datetime
 from tzlocal import get_localzone
 from io import BytesIO
+import io
 from werkzeug.datastructures import FileStorage
 import time
 import gzip
 import csv
-from flask import send_file
-
+import json
+from flask import Response, stream_with_context
+from sqlalchemy import text, tuple_, func, update, select
+
+from models.config import Config
+from Classes.GcodeIndex import GcodeIndex
+from Classes.GcodeScanner import compileGcode, parseTimeEstimate, readLines
+from Classes.Thumbnails import ThumbnailExtractor, saveThumbnails
+from Classes.Bus import JobReleased
 from app import printer_status_service
 # model for job history table
 
 
 class Job(db.Model):
+    # the filters and sort orders of the job history (get_job_history)
+    __table_args__ = (
+        db.Index('ix_job_date', 'date'),
+        db.Index('ix_job_printer_id_date', 'printer_id', 'date'),
+        db.Index('ix_job_status_date', 'status', 'date'),
+        db.Index('ix_job_error_id_date', 'error_id', 'date'),
+        db.Index('ix_job_favorite_date', 'favorite', 'date'),
+        db.Index('ix_job_td_id', 'td_id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
-    file = db.Column(db.LargeBinary(16777215), nullable=True)
+    # SHA-256 of the uploaded G-code in the blob store (current_app.blob_store)
+    file_hash = db.Column(db.String(64), nullable=True, index=True)
+    # upload compiled for printing (see compileFile): blob of the command stream without comments,
+    # and its metadata {total_lines, max_layer_height, total_time, layers: [[command index, z], ...]}
+    compiled_hash = db.Column(db.String(64), nullable=True, index=True)
+    gcode_meta = db.Column(db.JSON, nullable=True)
+    # files used to be stored in the row. moveBlobsToStore empties these on startup. Deferred so
+    # loading a job never reads them unless they are asked for.
+    file = deferred(db.Column(db.LargeBinary(16777215), nullable=True))
+    compiled = deferred(db.Column(db.LargeBinary(16777215), nullable=True))
     name = db.Column(db.String(50), nullable=False)
     status = db.Column(db.String(50), nullable=False)
     date = db.Column(db.DateTime, default=lambda: datetime.now(
@@ -63,11 +89,16 @@ class Job(db.Model):
     extruded = 0
     #total, eta, timestart, pause time 
     job_time = [0, datetime.min, datetime.min, datetime.min]
+    search_index = False  # whether the job_search full-text index is there (see createSearchIndex)
+    job_counts = False  # whether the job_count counters are there (see createJobCounts)
+    EXPORT_COLUMNS = ['td_id', 'printer', 'name', 'file_name_original', 'status', 'date', 'issue', 'comments']  # downloadCSV
 
 
     
-    def __init__(self, file, name, printer_id, status, file_name_original, favorite, td_id, printer_name):
-        self.file = file 
+    def __init__(self, file_hash, name, printer_id, status, file_name_original, favorite, td_id, printer_name, compiled_hash=None, gcode_meta=None):
+        self.file_hash = file_hash 
+        self.compiled_hash = compiled_hash
+        self.gcode_meta = gcode_meta
         self.name = name 
         self.printer_id = printer_id 
         self.status = status 
@@ -110,67 +141,41 @@ class Job(db.Model):
         startDate=None,
         endDate=None,
         fromError = None, 
-        countOnly = None 
+        countOnly = None,
+        cursor = None
     ):
+        # Returns [jobs, total, next cursor] (or the total alone with countOnly).
+        # With a cursor the page starts after the job it points to instead of at (page - 1) * pageSize,
+        # so deep pages cost the same as the first one: "" for the first page, then the next cursor of
+        # the previous page. Totals are only counted on the first page of a cursor walk (None after).
         try:
-            query = cls.query
-            
-            print("fromError: ", fromError)
-            if(fromError==1):
-                print("here")
-                query = cls.query.filter_by(status="error")
-            
-            if printerIds:
-                query = query.filter(cls.printer_id.in_(printerIds))
-
-            if issueIds:
-                query = query.filter(cls.error_id.in_(issueIds))
-                
-            if searchJob:
-                searchJob = f"%{searchJob}%"
-                query = query.filter(
-                    or_(
-                        cls.name.ilike(searchJob),
-                        cls.file_name_original.ilike(searchJob),
-                    )
-                )
-
-            if "searchByJobName" in searchCriteria:
-                searchByJobName = f"%{searchJob}%"
-                query = query.filter(cls.name.ilike(searchByJobName))
-            elif "searchByFileName" in searchCriteria:
-                searchByFileName = f"%{searchJob}%"
-                query = query.filter(cls.file_name_original.ilike(searchByFileName))
-                
-            if searchTicketId:
-                searchTicketId = int(searchTicketId)
-                query = query.filter(cls.td_id == searchTicketId)
-
-            if favoriteOnly:
-                query = query.filter(cls.favorite == True)
+            filters = dict(printerIds=printerIds, searchJob=searchJob, searchCriteria=searchCriteria, searchTicketId=searchTicketId,
+                           favoriteOnly=favoriteOnly, issueIds=issueIds, startDate=startDate, endDate=endDate, fromError=fromError)
+            if(countOnly != 0):
+                return cls.countJobs(**filters)
 
+            query = cls.historyQuery(**filters).options(*cls.listOptions())
             if oldestFirst:
-                query = query.order_by(cls.date.asc())
+                query = query.order_by(cls.date.asc(), cls.id.asc())
             else:
-                query = query.order_by(cls.date.desc())  # Change this line
-
-            
-            if startDate!='' or endDate!='':
-                if(endDate==''):
-                    cls.date.between(
-                        datetime.fromisoformat(startDate),
-                        datetime.fromisoformat(startDate),
-                    )
-                    
-                query = query.filter(
-                    cls.date.between(
-                        datetime.fromisoformat(startDate),
-                        datetime.fromisoformat(endDate),
-                    )
-                )
-
-            pagination = query.paginate(page=page, per_page=pageSize, error_out=False)
-            jobs = pagination.items
+                query = query.order_by(cls.date.desc(), cls.id.desc())
+
+            if cursor:
+                date, _, jobid = cursor.rpartition("_")
+                after = (datetime.fromisoformat(date), int(jobid))
+                if oldestFirst:
+                    query = query.filter(tuple_(cls.date, cls.id) > after)
+                else:
+                    query = query.filter(tuple_(cls.date, cls.id) < after)
+            elif cursor is None:
+                query = query.offset((max(page, 1) - 1) * pageSize)
+
+            # one more than a page tells whether there is a next one
+            jobs = query.limit(pageSize + 1).all()
+            next_cursor = None
+            if len(jobs) > pageSize:
+                jobs = jobs[:pageSize]
+                next_cursor = f"{jobs[-1].date.isoformat()}_{jobs[-1].id}"
 
             jobs_data = [
                 {
@@ -181,6 +186,7 @@ class Job(db.Model):
                     "printerid": job.printer_id,
                     "errorid": job.error_id,
                     "file_name_original": job.file_name_original,
+                    "file_hash": job.file_hash,
                     "comments": job.comments,
                     "td_id": job.td_id,
                     "printer": job.printer.name if job.printer else "None",
@@ -189,42 +195,187 @@ class Job(db.Model):
                 }
                 for job in jobs
             ]
-            if(countOnly == 0): 
-                return jobs_data, pagination.total
-            else: 
-                return pagination.total
+            total = None if cursor else cls.countJobs(**filters)
+            return jobs_data, total, next_cursor
             
         except SQLAlchemyError as e:
             print(f"Database error: {e}")
             return jsonify({"error": "Failed to retrieve jobs. Database error"}), 500
 
     @classmethod
-    def jobHistoryInsert(cls, name, printer_id, status, file, file_name_original, favorite, td_id): 
+    def listOptions(cls):
+        # What the job lists (history, favorites) load: the columns they show, not the compile metadata
+        # or the files, and the printer and issue names joined in the same query rather than one query
+        # per job.
+        return [
+            load_only(cls.id, cls.name, cls.status, cls.date, cls.printer_id, cls.error_id, cls.file_name_original,
+                      cls.file_hash, cls.comments, cls.td_id, cls.printer_name, cls.favorite),
+            joinedload(cls.printer).load_only(Printer.name),
+            joinedload(cls.error).load_only(Issue.issue),
+        ]
+
+    @classmethod
+    def historyQuery(cls, printerIds=None, searchJob="", searchCriteria="", searchTicketId=None, favoriteOnly=False,
+                     issueIds=None, startDate=None, endDate=None, fromError=None):
+        # the jobs get_job_history filters on, unordered
+        query = cls.query
+        if(fromError==1):
+            query = query.filter(cls.status == "error")
+
+        if printerIds:
+            query = query.filter(cls.printer_id.in_(printerIds))
+
+        if issueIds:
+            query = query.filter(cls.error_id.in_(issueIds))
+            
+        if searchJob:
+            query = query.filter(cls.searchFilter(searchJob, searchCriteria))
+            
+        if searchTicketId:
+            query = query.filter(cls.td_id == int(searchTicketId))
+
+        if favoriteOnly:
+            query = query.filter(cls.favorite == True)
+
+        if startDate or endDate:
+            # a single day when only one end of the range is set. An end given without a time is
+            # that whole day, up to the start of the next one.
+            start = datetime.fromisoformat(startDate or endDate)
+            query = query.filter(cls.date >= start)
+            if not (startDate and endDate):
+                query = query.filter(cls.date < start + timedelta(days=1))
+            elif "T" in endDate or " " in endDate.strip():
+                query = query.filter(cls.date <= datetime.fromisoformat(endDate))
+            else:
+                query = query.filter(cls.date < datetime.fromisoformat(endDate) + timedelta(days=1))
+        return query
+
+    @classmethod
+    def countJobs(cls, printerIds=None, searchJob="", searchCriteria="", searchTicketId=None, favoriteOnly=False,
+                  issueIds=None, startDate=None, endDate=None, fromError=None):
+        # Number of jobs get_job_history would list. The printer, issue, error and favorite filters are
+        # answered from the job_count counters (see createJobCounts), the others need a COUNT.
+        if cls.job_counts and not (searchJob or searchTicketId or startDate or endDate):
+            conditions, params = ["1"], {}
+            if fromError == 1:
+                conditions.append("status = 'error'")
+            if favoriteOnly:
+                conditions.append("favorite = 1")
+            for column, ids in (("printer_id", printerIds), ("error_id", issueIds)):
+                if ids:
+                    names = [f"{column}{i}" for i in range(len(ids))]
+                    conditions.append(f"{column} IN ({', '.join(':' + name for name in names)})")
+                    params.update(zip(names, ids))
+            total = db.session.execute(text(f"SELECT SUM(jobs) FROM job_count WHERE {' AND '.join(conditions)}"), params).scalar()
+            return total or 0
+        query = cls.historyQuery(printerIds, searchJob, searchCriteria, searchTicketId, favoriteOnly, issueIds, startDate, endDate, fromError)
+        return query.with_entities(func.count(cls.id)).scalar()
+
+    @classmethod
+    def searchFilter(cls, searchJob, searchCriteria=""):
+        # Jobs whose name and/or file name contain searchJob, looked up in the job_search index.
+        # The trigram index needs at least 3 characters, shorter searches scan the table.
+        if "searchByJobName" in searchCriteria:
+            columns, fields = [cls.name], "name"
+        elif "searchByFileName" in searchCriteria:
+            columns, fields = [cls.file_name_original], "file_name_original"
+        else:
+            columns, fields = [cls.name, cls.file_name_original], "{name file_name_original}"
+
+        if cls.search_index and len(searchJob) >= 3:
+            phrase = searchJob.replace('"', '""')
+            return text("job.id IN (SELECT rowid FROM job_search WHERE job_search MATCH :search)").bindparams(
+                search=f'{fields} : "{phrase}"')
+        conditions = [column.ilike(f"%{searchJob}%") for column in columns]
+        return conditions[0] if len(conditions) == 1 else or_(*conditions)
+
+    @classmethod
+    def createSearchIndex(cls):
+        # FTS5 index over the job and file names, kept in sync with the job table by triggers. The
+        # trigram tokenizer matches any part of a name, like the ilike '%...%' searches it replaces.
+        # The table is not part of the models, so it is created here (and ignored by migrations, see app.py).
+        statements = [
+            "CREATE VIRTUAL TABLE IF NOT EXISTS job_search USING fts5(name, file_name_original, content='job', content_rowid='id', tokenize='trigram')",
+            """CREATE TRIGGER IF NOT EXISTS job_search_insert AFTER INSERT ON job BEGIN
+                INSERT INTO job_search(rowid, name, file_name_original) VALUES (new.id, new.name, new.file_name_original);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS job_search_delete AFTER DELETE ON job BEGIN
+                INSERT INTO job_search(job_search, rowid, name, file_name_original) VALUES ('delete', old.id, old.name, old.file_name_original);
+            END""",
+            """CREATE TRIGGER IF NOT EXISTS job_search_update AFTER UPDATE OF name, file_name_original ON job BEGIN
+                INSERT INTO job_search(job_search, rowid, name, file_name_original) VALUES ('delete', old.id, old.name, old.file_name_original);
+                INSERT INTO job_search(rowid, name, file_name_original) VALUES (new.id, new.name, new.file_name_original);
+            END""",
+        ]
+        with db.engine.begin() as conn:
+            # the triggers are created last, an index without them may have missed some jobs
+            created = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'job_search_update'")).first() is None
+            for statement in statements:
+                conn.execute(text(statement))
+            if created:
+                # index the jobs that are already there (rebuild reads them all again)
+                conn.execute(text("INSERT INTO job_search(job_search) VALUES ('rebuild')"))
+        cls.search_index = True
+
+    @classmethod
+    def createJobCounts(cls):
+        # Number of jobs per printer, status, issue and favorite, kept up to date by triggers so the job
+        # history totals (countJobs) add up a few rows instead of counting the whole table. Like
+        # job_search, the table is not a model and migrations leave it alone.
+        key = "printer_id, status, error_id, favorite"
+        new = "coalesce(new.printer_id, 0), coalesce(new.status, ''), coalesce(new.error_id, 0), coalesce(new.favorite, 0)"
+        old = "printer_id = coalesce(old.printer_id, 0) AND status = coalesce(old.status, '') AND error_id = coalesce(old.error_id, 0) AND favorite = coalesce(old.favorite, 0)"
+        add = f"INSERT INTO job_count({key}, jobs) VALUES ({new}, 1) ON CONFLICT({key}) DO UPDATE SET jobs = jobs + 1;"
+        remove = f"UPDATE job_count SET jobs = jobs - 1 WHERE {old};"
+        statements = [
+            f"CREATE TABLE IF NOT EXISTS job_count (printer_id INTEGER NOT NULL, status VARCHAR(50) NOT NULL, error_id INTEGER NOT NULL, favorite BOOLEAN NOT NULL, jobs INTEGER NOT NULL, PRIMARY KEY ({key}))",
+            f"CREATE TRIGGER IF NOT EXISTS job_count_insert AFTER INSERT ON job BEGIN {add} END",
+            f"CREATE TRIGGER IF NOT EXISTS job_count_delete AFTER DELETE ON job BEGIN {remove} END",
+            f"CREATE TRIGGER IF NOT EXISTS job_count_update AFTER UPDATE OF {key} ON job BEGIN {remove} {add} END",
+        ]
+        with db.engine.begin() as conn:
+            created = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'job_count_update'")).first() is None
+            for statement in statements:
+                conn.execute(text(statement))
+            if created:
+                # count the jobs that are already there
+                conn.execute(text("DELETE FROM job_count"))
+                conn.execute(text(f"INSERT INTO job_count({key}, jobs) SELECT {new.replace('new.', '')}, count(*) FROM job GROUP BY 1, 2, 3, 4"))
+        cls.job_counts = True
+
+    @classmethod
+    def jobHistoryInsert(cls, name, printer_id, status, file, file_name_original, favorite, td_id, file_hash=None, compiled_hash=None, gcode_meta=None): 
+        # file is the upload (bytes or a file object). Reruns pass the hashes of the stored job instead.
+        # The stored files stay pinned until the row refers to them (see BlobStore).
+        store = current_app.blob_store
+        pinned = []
         try:
-            if isinstance(file, bytes):
-                file_data = file
+            if file_hash is None:
+                file_hash, compiled_hash, gcode_meta = cls.ingestFile(file)
+                pinned += [file_hash, compiled_hash]
             else:
-                file.seek(0)
-                file_data = file.read()
+                pinned += [digest for digest in (file_hash, compiled_hash) if digest]
+                if not store.pin(*pinned):
+                    raise FileNotFoundError(f"The stored file of {name} was removed")
 
-            try:
-                gzip.decompress(file_data)
-                # If it decompresses successfully, it's already compressed
-                compressed_data = file_data
-            except OSError:
-                compressed_data = gzip.compress(file_data)
+            # compile once here so every print, rerun and favorite of this upload reuses it
+            if compiled_hash is None or gcode_meta is None:
+                compiled_hash, gcode_meta = cls.compileFile(file_hash)
+                pinned.append(compiled_hash)
 
             printer = Printer.query.get(printer_id)
 
             job = cls(
-                file=compressed_data,
+                file_hash=file_hash,
                 name=name,
                 printer_id=printer_id,
                 status=status,
                 file_name_original = file_name_original,
                 favorite = favorite, 
                 td_id = td_id, 
-                printer_name = printer.name 
+                printer_name = printer.name,
+                compiled_hash = compiled_hash,
+                gcode_meta = gcode_meta
             )
 
             db.session.add(job)
@@ -237,10 +388,105 @@ class Job(db.Model):
                 jsonify({"error": "Failed to add job. Database error"}),
                 500,
             )
+        finally:
+            store.unpin(*pinned)
+
+    @classmethod
+    def ingestFile(cls, file):
+        # Reads an upload in chunks, stores it and compiles it in one pass, without ever holding the
+        # whole file in memory. Gzipped uploads are recognised by their magic bytes and decompressed
+        # as they are read. The line and layer index of the file is stored next to it (see
+        # getFileIndex), along with the thumbnails embedded by the slicer, and its toolpath is
+        # built in the background (see ToolpathCache).
+        # Returns the file hash, the compiled stream hash and its metadata. Both are pinned in the
+        # blob store, for the caller to unpin once its job refers to them.
+        stream = BytesIO(file) if isinstance(file, bytes) else file
+        stream.seek(0)
+        gzipped = stream.read(2) == b"\x1f\x8b"
+        stream.seek(0)
+        if gzipped:
+            stream = gzip.GzipFile(fileobj=stream)
+
+        store = current_app.blob_store
+        index = GcodeIndex()
+        thumbnails = ThumbnailExtractor()
+        with store.writer(pin=True) as file_blob, store.writer(pin=True) as compiled_blob:
+            gcode_meta = compileGcode(thumbnails.scan(readLines(stream, file_blob, index)), compiled_blob)
+        try:
+            if file_blob.created:
+                store.writeSidecar(file_blob.hash, "index", index.toJson(file_blob.members))
+            if store.readSidecar(file_blob.hash, "thumbnails") is None:
+                saveThumbnails(store, file_blob.hash, thumbnails.thumbnails)
+            current_app.toolpaths.build(file_blob.hash)
+        except Exception:
+            # no job will refer to them, nothing else would unpin them
+            store.unpin(file_blob.hash, compiled_blob.hash)
+            raise
+        return file_blob.hash, compiled_blob.hash, gcode_meta
+
+    @classmethod
+    def indexFile(cls, file_hash):
+        # Files stored before they were indexed are rewritten in seekable gzip members while indexing
+        store = current_app.blob_store
+        index = GcodeIndex()
+        with store.open(file_hash) as src, store.writer(replace=True) as out:
+            for _ in readLines(src, out, index):
+                pass
+        index = index.toJson(out.members)
+        store.writeSidecar(file_hash, "index", index)
+        return index
+
+    @classmethod
+    def compileFile(cls, file_hash):
+        # Strips comments and blank lines and indexes the layers of a stored G-code file.
+        # Returns the hash of the stored command stream, pinned for the caller to unpin, and its metadata.
+        store = current_app.blob_store
+        with store.writer(pin=True) as out, store.open(file_hash) as src:
+            gcode_meta = compileGcode(io.TextIOWrapper(src, encoding='utf-8', errors='replace'), out)
+        return out.hash, gcode_meta
+
+    # Removes stored files that no job refers to anymore. Returns the number of bytes freed.
+    @classmethod
+    def releaseBlobs(cls, *hashes):
+        store = current_app.blob_store
+        # under the store lock, so no upload can pin one of them between the check and the delete
+        with store.lock:
+            hashes = {digest for digest in hashes if digest and not store.isPinned(digest)}
+            if not hashes:
+                return 0
+            used = set()
+            # a connection of its own: the session may still be reading from before the last upload committed
+            with db.engine.connect() as conn:
+                for file_hash, compiled_hash in conn.execute(select(cls.file_hash, cls.compiled_hash).where(
+                        or_(cls.file_hash.in_(hashes), cls.compiled_hash.in_(hashes)))):
+                    used.update((file_hash, compiled_hash))
+            return sum(store.delete(digest) for digest in hashes - used)
+
+    @classmethod
+    def moveBlobsToStore(cls):
+        # Moves files stored in the job rows by older versions into the blob store, one row at a time
+        # so large files are never all in memory. The space this frees in the database is given back by
+        # the next retention run (see applyRetention), not here: a VACUUM would hold up startup.
+        store = current_app.blob_store
+        ids = [row.id for row in db.session.query(cls.id).filter(or_(cls.file.isnot(None), cls.compiled.isnot(None)))]
+        for job_id in ids:
+            job = cls.query.get(job_id)
+            if job.file is not None:
+                job.file_hash = store.put(gzip.decompress(job.file))
+                job.file = None
+            if job.compiled is not None:
+                job.compiled_hash = store.put(gzip.decompress(job.compiled))
+                job.compiled = None
+            db.session.commit()
+        if ids:
+            print(f"Moved the files of {len(ids)} jobs to the blob store.")
+        return len(ids)
 
     @classmethod
     def update_job_status(cls, job_id, new_status):
         try:
+            # statuses queued by queueStatus are older than this one, they go in first
+            current_app.db_writer.flush()
             # Retrieve the job from the database based on its primary key
             job = cls.query.get(job_id)
             if job:
@@ -249,7 +495,7 @@ class Job(db.Model):
                 # Commit the changes to the database
                 db.session.commit()
 
-                current_app.socketio.emit('job_status_update', {
+                current_app.emitter.emit('job_status_update', {
                                           'job_id': job_id, 'status': new_status})
 
                 return {"success": True, "message": f"Job {job_id} status updated successfully."}
@@ -262,6 +508,15 @@ class Job(db.Model):
                 500,
             )
 
+    # The statuses the printers report as a job runs. The clients hear about it right away; the row
+    # is written behind, batched with the other printers' (current_app.db_writer)
+    @classmethod
+    def queueStatus(cls, job_id, new_status):
+        current_app.db_writer.write(update(cls).where(cls.id == job_id).values(status=new_status),
+                                    key=("job_status", job_id))
+        current_app.emitter.emit('job_status_update', {'job_id': job_id, 'status': new_status})
+        return {"success": True, "message": f"Job {job_id} status updated successfully."}
+
     @classmethod
     def delete_job(cls, job_id):
         try:
@@ -269,6 +524,7 @@ class Job(db.Model):
             if job:
                 db.session.delete(job)
                 db.session.commit()
+                cls.releaseBlobs(job.file_hash, job.compiled_hash)
                 return {"success": True, "message": f"Job with ID {job_id} deleted from the database."}
             else:
                 return {"error": f"Job with ID {job_id} not found in the database."}
@@ -291,8 +547,7 @@ class Job(db.Model):
 
     @classmethod
     def findPrinterObject(self, printer_id):
-        threads = printer_status_service.getThreadArray()
-        return list(filter(lambda thread: thread.printer.id == printer_id, threads))[0].printer
+        return printer_status_service.printers.getPrinter(printer_id)
 
     @classmethod
     def removeFileFromPath(cls, file_path):
@@ -300,14 +555,6 @@ class Job(db.Model):
         if os.path.exists(file_path):    # Check if the file exists
             os.remove(file_path)         # Remove the file
 
-    @classmethod
-    def setDBstatus(cls, jobid, status):
-        cls.update_job_status(jobid, status)
-
-    @classmethod
-    def getPathForDelete(cls, file_name):
-        return os.path.join('../uploads', file_name)
-
     @classmethod
     def nullifyPrinterId(cls, printer_id):
         try:
@@ -323,26 +570,103 @@ class Job(db.Model):
     @classmethod
     def clearSpace(cls):
         try:
-            six_months_ago = datetime.now() - timedelta(days=182)  # 6 months ago
-            old_jobs = Job.query.filter(Job.date < six_months_ago).all()
-
-            # thirty_seconds_ago = datetime.now() - timedelta(seconds=30)  # 30 seconds ago
-            # old_jobs = Job.query.filter(Job.date < thirty_seconds_ago).all()
-
-            for job in old_jobs:
-                if(job.favorite==0):
-                    job.file = None  # Set file to None
-                    if "Removed after 6 months" not in job.file_name_original:
-                        job.file_name_original = f"{job.file_name_original}: Removed after 6 months"
-            db.session.commit()  # Commit the changes
-            return {"success": True, "message": "Space cleared successfully."}
+            report = cls.applyRetention(Config['retention_max_age_days'], Config['retention_max_store_mb'] * 1000000,
+                                        Config['retention_batch_size'])
+            freed = (report["blob_bytes"] + report["db_bytes"]) / 1000000
+            return {"success": True, "message": f"Space cleared successfully: released the files of {report['released']} jobs, {freed:.1f} MB freed.", **report}
         except SQLAlchemyError as e:
             print(f"Database error: {e}")
             return jsonify({"error": "Failed to clear space. Database error"}), 500
 
+    @classmethod
+    def applyRetention(cls, max_age_days, max_store_bytes=0, batch_size=500, pause=0.05):
+        # Releases the stored files of old jobs: every job older than max_age_days, then the oldest
+        # remaining ones while the blob store holds more than max_store_bytes (0 for no limit). Favorites
+        # and the jobs in a printer's queue (queued or printing) keep their files. A job whose status
+        # still says queued or printing but that is in no queue, left over from before a restart, does not.
+        #
+        # The jobs are updated batch_size at a time, each batch its own short transaction with a pause
+        # after it, so the printer threads writing to the database never wait long for the lock. The
+        # pages this frees in the database are given back to the file system at the end.
+        # Returns {"released": jobs, "blob_bytes": freed in the blob store, "db_bytes": freed in the database}.
+        report = {"released": 0, "blob_bytes": 0, "db_bytes": 0}
+        cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime("%Y-%m-%d %H:%M:%S.%f")
+        while cls.releaseBatch(report, "date < :cutoff", {"cutoff": cutoff}, batch_size, f"Removed after {max_age_days} days"):
+            time.sleep(pause)
+
+        if max_store_bytes:
+            size = current_app.blob_store.totalSize()
+            # smaller batches, to stop soon after getting under the budget
+            while size > max_store_bytes:
+                freed = report["blob_bytes"]
+                if not cls.releaseBatch(report, "1", {}, max(1, batch_size // 10), "Removed to free space"):
+                    break
+                size -= report["blob_bytes"] - freed
+                time.sleep(pause)
+
+        report["db_bytes"] = cls.enableIncrementalVacuum() or cls.reclaimSpace(pause=pause)
+        print(f"Retention released the files of {report['released']} jobs, freeing {report['blob_bytes']} bytes "
+              f"of files and {report['db_bytes']} bytes of database.")
+        return report
+
+    @classmethod
+    def releaseBatch(cls, report, condition, params, batch_size, note):
+        # Releases the files of up to batch_size of the oldest jobs matching condition. Returns how many.
+        releasable = ("favorite = 0 AND (file_hash IS NOT NULL OR compiled_hash IS NOT NULL) "
+                      "AND id NOT IN (SELECT value FROM json_each(:queued))")
+        with db.engine.begin() as conn:
+            # the queues live in memory only: asked for each batch, as jobs come and go meanwhile
+            queued = json.dumps(sorted(printer_status_service.printers.queuedJobIds()))
+            rows = conn.execute(text(f"SELECT id, file_hash, compiled_hash FROM job WHERE {releasable} AND {condition} "
+                                     "ORDER BY date, id LIMIT :limit"), dict(params, limit=batch_size, queued=queued)).all()
+            if not rows:
+                return 0
+            conn.execute(text(
+                "UPDATE job SET file_hash = NULL, compiled_hash = NULL, "
+                "file_name_original = CASE WHEN file_name_original LIKE '%: Removed %' THEN file_name_original "
+                "ELSE file_name_original || :note END "
+                f"WHERE id IN (SELECT value FROM json_each(:ids)) AND {releasable}"
+            ), {"ids": json.dumps([row.id for row in rows]), "note": f": {note}", "queued": queued})
+        report["released"] += len(rows)
+        report["blob_bytes"] += cls.releaseBlobs(*[digest for row in rows for digest in (row.file_hash, row.compiled_hash)])
+        return len(rows)
+
+    @classmethod
+    def enableIncrementalVacuum(cls):
+        # Lets reclaimSpace give free pages back without rewriting the whole database. The mode only
+        # applies to existing databases after a VACUUM, done once here, by the first retention run
+        # rather than at startup as it rewrites the whole file. Returns the number of bytes given back.
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+                return 0
+            free = conn.execute(text("PRAGMA freelist_count")).scalar() * conn.execute(text("PRAGMA page_size")).scalar()
+            conn.execute(text("PRAGMA auto_vacuum = INCREMENTAL"))
+            conn.execute(text("VACUUM"))
+            print("Database switched to incremental vacuum.")
+            return free
+
+    @classmethod
+    def reclaimSpace(cls, pages=1000, pause=0.05):
+        # Truncates the free pages off the database file, `pages` at a time so each step holds the
+        # write lock briefly. Returns the number of bytes given back.
+        with db.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+            if conn.execute(text("PRAGMA auto_vacuum")).scalar() != 2:
+                return 0
+            page_size = conn.execute(text("PRAGMA page_size")).scalar()
+            free = before = conn.execute(text("PRAGMA freelist_count")).scalar()
+            while free > 0:
+                # the pragma frees a page per step and execute() only steps once, executescript runs it through
+                conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({pages});")
+                remaining = conn.execute(text("PRAGMA freelist_count")).scalar()
+                if remaining >= free:
+                    break
+                free = remaining
+                time.sleep(pause)
+            return (before - free) * page_size
+
     @classmethod 
     def setDBstatus(cls, jobid, status):
-        cls.update_job_status(jobid, status)
+        cls.queueStatus(jobid, status)
 
     @classmethod 
     def getPathForDelete(cls, file_name):
@@ -351,7 +675,7 @@ class Job(db.Model):
     @classmethod
     def getFavoriteJobs(cls):
         try:
-            jobs = cls.query.filter_by(favorite=True).all()
+            jobs = cls.query.filter_by(favorite=True).options(*cls.listOptions()).all()
 
             jobs_data = [{
                 "id": job.id,
@@ -360,6 +684,7 @@ class Job(db.Model):
                 "date": f"{job.date.strftime('%a, %d %b %Y %H:%M:%S')} {get_localzone().tzname(job.date)}",
                 "printer": job.printer.name if job.printer else 'None',
                 "file_name_original": job.file_name_original,
+                "file_hash": job.file_hash,
                 "favorite": job.favorite
             } for job in jobs]
 
@@ -426,48 +751,66 @@ class Job(db.Model):
             return None
         
     @classmethod
-    def downloadCSV(cls, alljobs, jobids=None):
+    def downloadCSV(cls, alljobs, jobids=None, filters=None, format="csv"):
+        # Streams the jobs as CSV or NDJSON (one JSON object per line) while they are read: all of them,
+        # the ones in jobids, or the ones the job history filters select (the get_job_history arguments).
         try: 
-            if(jobids!=None): 
-                # Join Job and Issue on error_id and filter by jobids
-                jobs = db.session.query(cls, Issue).outerjoin(Issue, cls.error_id == Issue.id).filter(cls.id.in_(jobids)).all()
-            else: 
-                # Join Job and Issue on error_id
-                jobs = db.session.query(cls, Issue).outerjoin(Issue, cls.error_id == Issue.id).all()
-
-            # Specify the columns you want to include
-            column_names = ['td_id', 'printer', 'name','file_name_original', 'status', 'date', 'issue', 'comments']
-
-            date_string = datetime.now().strftime("%m%d%Y")        
-                
-            csv_file_name = f'../tempcsv/jobs_{date_string}.csv'
-            
-            # Write to CSV
-
-            with open(csv_file_name, 'w', newline='') as file:
-                writer = csv.writer(file)
-                writer.writerow(column_names)  # write headers
-                for job, issue in jobs:
-                    row = [getattr(job, 'td_id', ''), getattr(job, 'printer_name', ''), getattr(job, 'name', ''), getattr(job, 'file_name_original', ''), getattr(job, 'status', ''), getattr(job, 'date', ''), getattr(issue, 'issue', '') if issue else '', getattr(job, 'comments', '')]
-                    writer.writerow(row)  # write data rows
-            
-            csv_file_path = f'./{csv_file_name}'
-        
-            return send_file(csv_file_path, as_attachment=True)
-        
-        
+            rows = cls.exportRows(None if alljobs else jobids, None if alljobs else filters)
+            date_string = datetime.now().strftime("%m%d%Y")
+            if format == "ndjson":
+                body, mimetype = cls.ndjsonLines(rows), "application/x-ndjson"
+            else:
+                body, mimetype = cls.csvLines(rows), "text/csv"
+            return Response(stream_with_context(body), mimetype=mimetype,
+                            headers={"Content-Disposition": f"attachment; filename=jobs_{date_string}.{format}"})
         except Exception as e:
             print(f"Error downloading CSV: {e}")
             return {"status": "error", "message": f"Error downloading CSV: {e}"}
-               
-    def saveToFolder(self):
-        file_data = self.getFile()
-        decompressed_data = gzip.decompress(file_data)
-        with open(self.generatePath(), 'wb') as f:
-            f.write(decompressed_data)
 
-    def generatePath(self):
-        return os.path.join('../uploads', self.getFileNamePk())
+    @classmethod
+    def exportRows(cls, jobids=None, filters=None, batch=1000):
+        # the exported columns, with the issue name joined in, fetched from the cursor a batch at a time
+        filters = dict(filters or {})
+        oldestFirst = filters.pop("oldestFirst", False)
+        query = cls.historyQuery(**filters).with_entities(
+            cls.td_id, cls.printer_name, cls.name, cls.file_name_original, cls.status, cls.date, Issue.issue, cls.comments
+        ).outerjoin(Issue, cls.error_id == Issue.id)
+        if(jobids!=None): 
+            query = query.filter(cls.id.in_(jobids))
+        if oldestFirst:
+            query = query.order_by(cls.date.asc(), cls.id.asc())
+        else:
+            query = query.order_by(cls.date.desc(), cls.id.desc())
+        return query.yield_per(batch)
+
+    @classmethod
+    def csvLines(cls, rows, batch=1000):
+        out = io.StringIO()
+        writer = csv.writer(out)
+        writer.writerow(cls.EXPORT_COLUMNS)  # write headers
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)  # write data rows
+            if count % batch == 0:
+                yield out.getvalue()
+                out.seek(0)
+                out.truncate()
+        yield out.getvalue()
+
+    @classmethod
+    def ndjsonLines(cls, rows, batch=1000):
+        lines = []
+        for row in rows:
+            job = dict(zip(cls.EXPORT_COLUMNS, row))
+            job["date"] = str(job["date"])  # as in the CSV
+            lines.append(json.dumps(job) + "\n")
+            if len(lines) == batch:
+                yield "".join(lines)
+                lines = []
+        yield "".join(lines)
+
+    # the compiled command stream, decompressed from the blob store as it is read
+    def openCompiled(self):
+        return io.TextIOWrapper(current_app.blob_store.open(self.getCompiledHash()), encoding='utf-8')
 
     # getters
     def getName(self):
@@ -476,8 +819,20 @@ class Job(db.Model):
     def getFilePath(self):
         return self.path
 
+    # the uploaded file as gzip bytes
     def getFile(self):
-        return self.file
+        if self.file_hash is None:
+            return None
+        return current_app.blob_store.read(self.file_hash)
+
+    # where the lines and layers of the uploaded file start (see GcodeIndex)
+    def getFileIndex(self):
+        if self.file_hash is None:
+            return None
+        index = current_app.blob_store.readSidecar(self.file_hash, "index")
+        if index is None:
+            index = self.indexFile(self.file_hash)
+        return index
 
     def getStatus(self):
         return self.status
@@ -530,8 +885,8 @@ class Job(db.Model):
         if self.status == 'printing':
             self.progress = progress
             # Emit a 'progress_update' event with the new progress
-            current_app.socketio.emit(
-                'progress_update', {'job_id': self.id, 'progress': self.progress})
+            current_app.emitter.coalesce(
+                'progress_update', self.id, {'job_id': self.id, 'progress': self.progress})
 
     # added a getProgress method to get the progress of a job
     def getProgress(self):
@@ -539,43 +894,29 @@ class Job(db.Model):
     
     def setSentLines(self, sent_lines):
         self.sent_lines = sent_lines
-        current_app.socketio.emit('gcode_viewer', {'job_id': self.id, 'gcode_num': self.sent_lines})
+        current_app.emitter.coalesce('gcode_viewer', self.id, {'job_id': self.id, 'gcode_num': self.sent_lines})
         
     def getSentLines(self):
         return self.sent_lines
 
     def getTimeFromFile(self, comment_lines):
-        # job_line can look two ways:
-        # 1. ;TIME:seconds
-        # 2. ; estimated printing time (normal mode) = minutes seconds
-        # if first line contains "FLAVOR", then the second line contains the time estimate in the format of ";TIME:seconds"
-        if "FLAVOR" in comment_lines[0]:
-            time_line = comment_lines[1]
-            time_seconds = int(time_line.split(":")[1])
-        else:
-            # search for the line that contains "printing time", then the time estimate is in the format of "; estimated printing time (normal mode) = minutes seconds"
-            time_line = next(line for line in comment_lines if "time" in line)
-            time_values = re.findall(r'\d+', time_line)
-
-            # Initialize all time units to 0
-            time_days = time_hours = time_minutes = time_seconds = 0
-
-            # Assign values from right to left (seconds, minutes, hours, days)
-            time_values = time_values[::-1]
-            if len(time_values) > 0:
-                time_seconds = int(time_values[0])
-            if len(time_values) > 1:
-                time_minutes = int(time_values[1])
-            if len(time_values) > 2:
-                time_hours = int(time_values[2])
-            if len(time_values) > 3:
-                time_days = int(time_values[3])
-
-            # Calculate total time in seconds
-            time_seconds = time_days * 24 * 60 * 60 + time_hours * 60 * 60 + time_minutes * 60 + time_seconds
-        # date = datetime.fromtimestamp(time_seconds)
-        return time_seconds
+        return parseTimeEstimate(comment_lines)
     
+    # Jobs uploaded before compilation existed are compiled the first time they are printed
+    def getCompiledHash(self):
+        if self.compiled_hash is None or self.gcode_meta is None:
+            self.compiled_hash, self.gcode_meta = self.compileFile(self.file_hash)
+            try:
+                db.session.commit()
+            finally:
+                current_app.blob_store.unpin(self.compiled_hash)
+        return self.compiled_hash
+
+    def getGcodeMeta(self):
+        if self.gcode_meta is None:
+            self.getCompiledHash()
+        return self.gcode_meta
+
     def getTimeStarted(self):
         return self.time_started
 
@@ -635,7 +976,7 @@ class Job(db.Model):
     def setCurrentLayerHeight(self, current_layer_height):
         print("Current Layer Height: ", current_layer_height)
         self.current_layer_height = current_layer_height
-        current_app.socketio.emit('current_layer_height', {'job_id': self.id, 'current_layer_height': self.current_layer_height})
+        current_app.emitter.coalesce('current_layer_height', self.id, {'job_id': self.id, 'current_layer_height': self.current_layer_height})
 
     def setFilament(self, filament):
         self.filament = filament
@@ -646,12 +987,13 @@ class Job(db.Model):
     def setFileName(self, filename):
         self.file_name_pk = filename
 
-    def setFile(self, file):
-        self.file = file
+    def setFile(self, file_hash):
+        self.file_hash = file_hash
 
     def setReleased(self, released):
         self.released = released
         current_app.socketio.emit('release_job', {'job_id': self.id, 'released': released}) 
+        current_app.bus.publish(JobReleased(self.printer_id, self.id))
 
     def setTimeStarted(self, time_started):
             self.time_started = time_started
@@ -7,15 +7,20 @@ from Classes.Queue import Queue
 import serial
 import serial.tools.list_ports
 import time
+from threading import Condition
 from datetime import datetime, timezone
 from tzlocal import get_localzone
 import os
-import requests
+import sys
 from dotenv import load_dotenv
 
 from models.config import Config
+from Classes.PrintSession import PrintSession
+from Classes.Bus import RepairPorts, RestoreQueue, JobStatusReported
+from Classes.JobLogWriter import JobLogHandler, BatchedStreamHandler, GzipFileHandler, getWriter
 
 load_dotenv()
+
 # model for Printer table
 class Printer(db.Model):
     __allow_unmapped__ = True
@@ -24,6 +29,8 @@ class Printer(db.Model):
     description = db.Column(db.String(50), nullable=False)
     hwid = db.Column(db.String(150), nullable=False)
     name = db.Column(db.String(50), nullable=False)
+    # keep several commands in flight instead of waiting for each "ok". None = use the config default
+    streaming = db.Column(db.Boolean, nullable=True)
     date = db.Column(
         db.DateTime,
         default=lambda: datetime.now(timezone.utc).astimezone(),
@@ -42,13 +49,21 @@ class Printer(db.Model):
     prevMes = ""
     colorbuff = 0
     terminated = 0
-
-    def __init__(self, device, description, hwid, name, status=status, id=None):
+    sendRate = 0.0  # commands per second of the current print
+    session = None  # PrintSession of the job being sent, when driven by the SerialReactor
+    pendingJob = None  # job waiting to be released, when driven by the SerialReactor
+    busy = False  # a job is being started, printed or finished by the SerialReactor workers
+    changed = None  # Condition notified by wake(), for the threads waiting on this printer
+    onChange = None  # called by wake(), set when the SerialReactor drives the printer
+    dispatchQueued = False  # a wake-up is waiting on the reactor thread
+
+    def __init__(self, device, description, hwid, name, status=status, id=None, streaming=None):
         self.device = device
         self.description = description
         self.hwid = hwid
         self.name = name
         self.status = status
+        self.streaming = streaming
         self.date = datetime.now(get_localzone())
         self.queue = Queue()
         self.stopPrint = False
@@ -59,6 +74,13 @@ class Printer(db.Model):
         self.prevMes=""
         self.colorbuff=0
         self.terminated = 0
+        self.sendRate = 0.0
+        self.session = None
+        self.pendingJob = None
+        self.busy = False
+        self.changed = Condition()
+        self.onChange = None
+        self.dispatchQueued = False
         # self.colorChangeBuffer=0
 
         if id is not None:
@@ -143,6 +165,7 @@ class Printer(db.Model):
                     "hwid": printer.hwid,
                     "name": printer.name,
                     "status": printer.status,
+                    "streaming": printer.streaming,
                     # Include timezone abbreviation
                     "date": f"{printer.date.strftime('%a, %d %b %Y %H:%M:%S')} {get_localzone().tzname(printer.date)}",
                 }
@@ -273,6 +296,20 @@ class Printer(db.Model):
                 500,
             )
 
+    @classmethod
+    def editStreaming(cls, printerid, streaming):
+        try:
+            printer = cls.query.get(printerid)
+            printer.streaming = streaming
+            db.session.commit()
+            return {"success": True, "message": "Printer streaming mode successfully updated."}
+        except SQLAlchemyError as e:
+            print(f"Database error: {e}")
+            return (
+                jsonify({"error": "Failed to update printer streaming mode. Database error"}),
+                500,
+            )
+
     @classmethod
     def editPort(cls, printerid, printerport):
         try:
@@ -354,30 +391,9 @@ class Printer(db.Model):
                 if(self.terminated==1): 
                     return 
                 # logic here about time elapsed since last response
-                response = self.ser.readline().decode("utf-8").strip()
-                if logger: logger.debug(f"Received: {response}")
-                if response == "": 
-                    if self.prevMes == "M602":
-                        self.responseCount = 0
-                        # break
-                    else: 
-                        self.responseCount+=1 
-                        if(self.responseCount>=10):
-                            self.setError("No response from printer")
-                            raise Exception("No response from printer")
-
-                elif "error" in response.lower():
-                    self.setError(response)
+                response = self.readResponse(logger)
+                if response is None:
                     break
-                else:
-                    self.responseCount = 0
-
-                if ("T:" in response) and ("B:" in response):
-                    # Extract the temperature values using regex
-                    temp_t = re.search(r'T:(\d+.\d+)', response)
-                    temp_b = re.search(r'B:(\d+.\d+)', response)
-                    if temp_t and temp_b:
-                        self.setTemps(temp_t.group(1), temp_b.group(1))
 
                 if "ok" in response:
                     if logger: logger.info(f"Command: {message}, Received: {response}")
@@ -388,6 +404,43 @@ class Printer(db.Model):
             self.setError(e)
             return "error"
 
+    # Reads one response line. Returns None if the printer reported an error.
+    def readResponse(self, logger=None):
+        response = self.ser.readline().decode("utf-8").strip()
+        return self.handleResponse(response, logger)
+
+    # Handles one response line ("" when the read timed out): timeouts, errors and temperature reports.
+    # Returns None if the printer reported an error.
+    def handleResponse(self, response, logger=None):
+        if logger: logger.debug(f"Received: {response}")
+        if response == "": 
+            if self.prevMes == "M602":
+                self.responseCount = 0
+            else: 
+                self.responseCount+=1 
+                if(self.responseCount>=10):
+                    self.setError("No response from printer")
+                    raise Exception("No response from printer")
+
+        elif "error" in response.lower():
+            self.setError(response)
+            return None
+        else:
+            self.responseCount = 0
+
+        if ("T:" in response) and ("B:" in response):
+            # Extract the temperature values using regex
+            temp_t = re.search(r'T:(\d+.\d+)', response)
+            temp_b = re.search(r'B:(\d+.\d+)', response)
+            if temp_t and temp_b:
+                self.setTemps(temp_t.group(1), temp_b.group(1))
+        return response
+
+    def isStreaming(self):
+        if self.streaming is None:
+            return Config['streaming_enabled']
+        return self.streaming
+
     def gcodeEnding(self, message):
         try: 
             self.ser.write(f"{message}\n".encode("utf-8"))
@@ -418,228 +471,78 @@ class Printer(db.Model):
             self.setError(e)
             return "error"
 
-    def parseGcode(self, path, job):
-        from ANSI_Remover import remove_ansi_codes_with_progress, compress_with_gzip
+    # Prints the job on the calling thread: opens a PrintSession on its compiled stream (openSession)
+    # and drives it with runBlocking.
+    # Returns "complete", "cancelled", "error", or None if the printer thread was terminated.
+    def parseGcode(self, job):
+        session = None
         try:
-
-            with open(path, "r") as g:
-                # Read the file and store the lines in a list
-                if(self.terminated==1): 
-                    return
-                import sys
-                jobName = str(job.file_name_original)
-                if jobName:
-                    jobName = "-".join(jobName.split(".")[0].split("_"))
-                cwd = os.getcwd()
-                logBase = cwd.split("server")[0] + "logs"
-                logFile = os.path.join(logBase, self.name, jobName, job.date.strftime('%m-%d-%Y_%H-%M-%S'), "color")
-                os.makedirs(logFile, exist_ok=True)
-                logger = logging.getLogger(logFile)
-                logger.setLevel(logging.DEBUG)
-                console_handler = logging.StreamHandler(sys.stdout)
-                console_formatter = CustomFormatter("%(asctime)s - %(levelname)s - %(module)s.py:%(lineno)d - %(message)s")
-                console_handler.setFormatter(console_formatter)
-                console_handler.setLevel(logging.INFO)
-                logger.addHandler(console_handler)
-                info_file_handler = logging.FileHandler(os.path.join(logFile,"INFO.log"), mode="w")
-                info_file_handler.setLevel(logging.INFO)
-                debug_file_handler = logging.FileHandler(os.path.join(logFile,"DEBUG.log"), mode="w")
-                debug_file_handler.setLevel(logging.DEBUG)
-                for(file_handler) in [info_file_handler, debug_file_handler]:
-                    file_handler.setFormatter(console_formatter)
-                    logger.addHandler(file_handler)
-
-                logger.info(f"Starting {job.name} on {self.name} at {job.date.strftime('%m-%d-%Y %H:%M:%S')}")
-                lines = g.readlines()
-
-                #  Time handling
-                comment_lines = [line for line in lines if line.strip() and line.startswith(";")]
-
-                max_layer_height = 0
-                for i in reversed(range(len(comment_lines))):
-                    # Check if the line contains ";LAYER_CHANGE"
-                    if ";LAYER_CHANGE" in comment_lines[i]:
-                        # Check if the next line exists
-                        if i < len(comment_lines) - 1:
-                            # Save the next line
-                            line = comment_lines[i + 1]
-                            # Use regex to find the numerical value after ";Z:"
-                            match = re.search(r";Z:(\d+\.?\d*)", line)
-                            if match:
-                                max_layer_height = float(match.group(1))
-                                break       
-                if max_layer_height != 0:
-                    job.setMaxLayerHeight(max_layer_height)
-                
-
-                total_time = job.getTimeFromFile(comment_lines)
-                job.setTime(total_time, 0)
-                # job.setTime(total_time, 0)
-
-                # Only send the lines that are not empty and don't start with ";"
-                # so we can correctly get the progress
-                command_lines = [
-                    line for line in lines if line.strip() and not line.startswith(";")
-                ]
-                # store the total to find the percentage later on
-                total_lines = len(command_lines)
-                # set the sent lines to 0
-                sent_lines = 0
-                # previous line to check for layer height
-                prev_line = ""
-                # Replace file with the path to the file. "r" means read mode. 
-                # now instead of reading from 'g', we are reading line by line
-                for line in lines:
-                    if(self.terminated==1):
-                        if logger:
-                            for handler in logger.handlers:
-                                handler.close()
-                                logger.removeHandler(handler)
-                            compress_with_gzip(os.path.join(logFile, "DEBUG.log"))
-                            compress_with_gzip(os.path.join(logFile, "INFO.log"))
-                            # ncLogFile = logFile.replace('color', 'noColor')
-                            # os.mkdir(ncLogFile)
-                            # remove_ansi_codes_with_progress(os.path.join(logFile, "DEBUG.log"))
-                            # remove_ansi_codes_with_progress(os.path.join(logFile, "INFO.log"))
-                            # compress_with_gzip(os.path.join(ncLogFile, "DEBUG.log"))
-                            # compress_with_gzip(os.path.join(ncLogFile, "INFO.log"))
-                        return 
-                    
-                    # print("LINE: ", line, " STATUS: ", self.status, " FILE PAUSE: ", job.getFilePause())
-                    if "layer" in line.lower() and self.status== 'colorchange' and job.getFilePause()==0 and self.colorbuff==0:
-                        self.setColorChangeBuffer(1)
-
-                    # if line contains ";LAYER_CHANGE", do job.currentLayerHeight(the next line)
-                    if prev_line and ";LAYER_CHANGE" in prev_line:
-                        match = re.search(r";Z:(\d+\.?\d*)", line)
-                        if match:
-                            current_layer_height = float(match.group(1))
-                            job.setCurrentLayerHeight(current_layer_height)
-                    prev_line = line
-
-                    # remove whitespace
-                    line = line.strip()
-                    # Don't send empty lines and comments. ";" is a comment in gcode.
-                    if ";" in line:  # Remove inline comments
-                        line = line.split(";")[
-                            0
-                        ].strip()  # Remove comments starting with ";"
-
-                    if len(line) == 0 or line.startswith(";"):
-                        continue
-
-                    if("M569" in line or "M107" in line) and job.getTimeStarted()==0:
-                        job.setTimeStarted(1)
-                        job.setTime(job.calculateEta(), 1)
-                        job.setTime(datetime.now(), 2)
-                 
-                    res = self.sendGcode(line, logger)
-                    
-                    if(job.getFilePause() == 1):
-                        # self.setStatus("printing")
-                        job.setTime(job.colorEta(), 1)
-                        job.setTime(job.calculateColorChangeTotal(), 0)
-                        job.setTime(datetime.min, 3)
-                        job.setFilePause(0)
-                        if(self.getStatus()=="complete"):
-                            return "cancelled"
-                        self.setStatus("printing")
-                    
-                    if("M600" in line):
-                        job.setTime(datetime.now(), 3)
-                        # job.setTime(job.calculateTotalTime(), 0)
-                        # job.setTime(job.updateEta(), 1)
-                        self.setStatus("colorchange")
-                        # self.setColorChangeBuffer(3)
-                        # self.setColorChangeBuffer(1)
-                        job.setFilePause(1)
-
-                    if("M569" in line) and (job.getExtruded()==0):
-                        job.setExtruded(1)
-                    
-                    if self.prevMes == "M602":
-                        self.prevMes=""
-                             
-                #  software pausing        
-                    if (self.getStatus()=="paused"):
-                        # self.prevMes = "M601"
-                        self.sendGcode("M601") # pause command for prusa
-                        job.setTime(datetime.now(), 3)
-                        while(True):
-                            time.sleep(1)
-                            stat = self.getStatus()
-                            if(stat=="printing"):
-                                self.prevMes = "M602"
-
-                                self.sendGcode("M602") # resume command for prusa
-
-                                time.sleep(2)
-                                job.setTime(job.colorEta(), 1)
-                                job.setTime(job.calculateColorChangeTotal(), 0)
-                                job.setTime(datetime.min, 3)
-                                break
-                    
-                    # software color change
-                    if (self.getStatus()=="colorchange" and job.getFilePause()==0 and self.colorbuff==1):
-                        job.setTime(datetime.now(), 3)
-                        # job.setTime(job.calculateTotalTime(), 0)
-                        # job.setTime(job.updateEta(), 1)
-                        print("SENDING COLORCHANGE")
-                        self.sendGcode("M600") # color change command
-                        job.setTime(job.colorEta(), 1)
-                        job.setTime(job.calculateColorChangeTotal(), 0)
-                        job.setTime(datetime.min, 3)
-                        job.setFilePause(1)
-                        self.setColorChangeBuffer(0)
-                        # self.setStatus("printing")
-
-                    # Increment the sent lines
-                    sent_lines += 1
-                    job.setSentLines(sent_lines)
-                    # Calculate the progress
-                    progress = (sent_lines / total_lines) * 100
-
-                    # Call the setProgress method
-                    job.setProgress(progress)
-
-                    # if self.getStatus() == "complete" and job.extruded != 0:
-                    if self.getStatus() == "complete":
-                        return "cancelled"
-
-                    if self.getStatus() == "error":
-                        return "error"
-            if logger:
-                for handler in logger.handlers:
-                    handler.close()
-                    logger.removeHandler(handler)
-                compress_with_gzip(os.path.join(logFile, "DEBUG.log"))
-                compress_with_gzip(os.path.join(logFile, "INFO.log"))
-                # ncLogFile = logFile.replace('color', 'noColor')
-                # os.mkdir(ncLogFile)
-                # remove_ansi_codes_with_progress(os.path.join(logFile, "DEBUG.log"))
-                # remove_ansi_codes_with_progress(os.path.join(logFile, "INFO.log"))
-                # compress_with_gzip(os.path.join(ncLogFile, "DEBUG.log"))
-                # compress_with_gzip(os.path.join(ncLogFile, "INFO.log"))
-            return "complete"
+            session = self.openSession(job)
+            if session is None:
+                return
+            return session.runBlocking()
         except Exception as e:
-            if logger:
-                import traceback
-                logger.error(e)
-                logger.error("".join(traceback.format_exception(None, e, e.__traceback__)))
-                for handler in logger.handlers:
-                    handler.close()
-                    logger.removeHandler(handler)
-                compress_with_gzip(os.path.join(logFile, "DEBUG.log"))
-                compress_with_gzip(os.path.join(logFile, "INFO.log"))
-                # ncLogFile = logFile.replace('color', 'noColor')
-                # os.mkdir(ncLogFile)
-                # remove_ansi_codes_with_progress(os.path.join(logFile, "DEBUG.log"))
-                # remove_ansi_codes_with_progress(os.path.join(logFile, "INFO.log"))
-                # compress_with_gzip(os.path.join(ncLogFile, "DEBUG.log"))
-                # compress_with_gzip(os.path.join(ncLogFile, "INFO.log"))
-            # self.setStatus("error")
-            self.setError(e)
+            if session:
+                session.fail(e)
+            else:
+                self.setError(e)
             return "error"
+        finally:
+            if session:
+                self.closeJobLogger(session.logger, session.logFile)
+
+    # Opens the job log and returns a PrintSession that streams the job's compiled file from the
+    # blob store. Returns None if the printer thread was terminated.
+    def openSession(self, job, onDone=None):
+        if(self.terminated==1): 
+            return None
+        logger, logFile = self.createJobLogger(job)
+        logger.info(f"Starting {job.name} on {self.name} at {job.date.strftime('%m-%d-%Y %H:%M:%S')}")
+
+        # totals, slicer metadata and the layer index were computed once at upload (Job.compileFile)
+        gcode_meta = job.getGcodeMeta()
+        if gcode_meta["max_layer_height"] != 0:
+            job.setMaxLayerHeight(gcode_meta["max_layer_height"])
+        job.setTime(gcode_meta["total_time"], 0)
+
+        return PrintSession(self, job, job.openCompiled(), logger, logFile, onDone)
+
+    def createJobLogger(self, job):
+        jobName = str(job.file_name_original)
+        if jobName:
+            jobName = "-".join(jobName.split(".")[0].split("_"))
+        cwd = os.getcwd()
+        logBase = cwd.split("server")[0] + "logs"
+        logFile = os.path.join(logBase, self.name, jobName, job.date.strftime('%m-%d-%Y_%H-%M-%S'), "color")
+        os.makedirs(logFile, exist_ok=True)
+        logger = logging.getLogger(logFile)
+        logger.setLevel(logging.DEBUG)
+        console_handler = BatchedStreamHandler(sys.stdout)
+        console_formatter = CustomFormatter("%(asctime)s - %(levelname)s - %(module)s.py:%(lineno)d - %(message)s")
+        console_handler.setFormatter(console_formatter)
+        console_handler.setLevel(logging.INFO)
+        info_file_handler = GzipFileHandler(os.path.join(logFile,"INFO.log.gz"), mode="w")
+        info_file_handler.setLevel(logging.INFO)
+        debug_file_handler = GzipFileHandler(os.path.join(logFile,"DEBUG.log.gz"), mode="w")
+        debug_file_handler.setLevel(logging.DEBUG)
+        for(file_handler) in [info_file_handler, debug_file_handler]:
+            file_handler.setFormatter(console_formatter)
+        # the send loop only queues records, the writer thread formats and writes them
+        writer = getWriter(Config['log_queue_size'], Config['log_batch_size'], Config['log_flush_interval'])
+        logger.addHandler(JobLogHandler(writer, [console_handler, info_file_handler, debug_file_handler]))
+        return logger, logFile
+
+    # the logs are written compressed, closing them finishes the gzip files
+    def closeJobLogger(self, logger, logFile):
+        for handler in list(logger.handlers):
+            handler.close()
+            logger.removeHandler(handler)
+        # ncLogFile = logFile.replace('color', 'noColor')
+        # os.mkdir(ncLogFile)
+        # remove_ansi_codes_with_progress(os.path.join(logFile, "DEBUG.log"))
+        # remove_ansi_codes_with_progress(os.path.join(logFile, "INFO.log"))
+        # compress_with_gzip(os.path.join(ncLogFile, "DEBUG.log"))
+        # compress_with_gzip(os.path.join(ncLogFile, "INFO.log"))
 
     # Function to send "ending" gcode commands
     def endingSequence(self, job=None):
@@ -699,20 +602,9 @@ class Printer(db.Model):
             begin = self.beginPrint(job)
             
             if begin==True: 
-                Printer.repairPorts() 
-                self.connect()
-                if self.getSer():
-                    self.responseCount = 0
-                    job.saveToFolder()
-                    path = job.generatePath()
-                    verdict = self.parseGcode(path, job)  # passes file to code. returns "complete" if successful, "error" if not.
+                if self.prepareJob(job):
+                    verdict = self.parseGcode(job)  # streams the file to the printer. returns "complete" if successful, "error" if not.
                     self.handleVerdict(verdict, job)
-                    job.removeFileFromPath(path)  # remove file from folder after job complete
-                else:
-                    self.getQueue().deleteJob(job.id, self.id)
-                    # self.setStatus("error")
-                    self.setError("Printer not connected")
-                    self.sendStatusToJob(job, job.id, "error")
             else: 
                 self.handleVerdict("misprint", job)    
 
@@ -725,28 +617,61 @@ class Printer(db.Model):
         #     self.sendStatusToJob(job, job.id, "error")
             return
         except Exception as e:
-            print(e)
-            self.setErrorMessage(e)
-            self.getQueue().deleteJob(job.id, self.id)
-            self.setStatus("error")
-            self.sendStatusToJob(job, job.id, "error")
+            self.failJob(job, e)
             return 
             # self.handleVerdict("error", job)
 
+    # Connects to the printer. Returns False (and fails the job) if the printer could not be reached.
+    def prepareJob(self, job):
+        Printer.repairPorts() 
+        self.connect()
+        if self.getSer():
+            self.responseCount = 0
+            return True
+        self.getQueue().deleteJob(job.id, self.id)
+        # self.setStatus("error")
+        self.setError("Printer not connected")
+        self.sendStatusToJob(job, job.id, "error")
+        return False
+
+    def failJob(self, job, e):
+        print(e)
+        self.setErrorMessage(e)
+        self.getQueue().deleteJob(job.id, self.id)
+        self.setStatus("error")
+        self.sendStatusToJob(job, job.id, "error")
+
     def setErrorMessage(self, error):
         self.error = error
         self.setStatus("error")
-        current_app.socketio.emit(
+        current_app.emitter.emit(
             "error_update", {"printerid": self.id, "error": str(self.error)}
         )
             
+    # Waits for the job to be released (True) or cleared (False). Job.setReleased and setStatus wake
+    # it up; the timeout only bounds how long a missed wake-up can hold it.
     def beginPrint(self, job): 
         while True: 
-            time.sleep(1)
+            self.waitFor(lambda: job.getReleased()==1 or self.getStatus() == "complete", 1)
             if job.getReleased()==1: 
                 return True 
             if self.getStatus() == "complete": 
                 return False 
+
+    # Blocks until predicate() is true or timeout seconds went by, checking it again on every wake()
+    def waitFor(self, predicate, timeout):
+        with self.changed:
+            return self.changed.wait_for(predicate, timeout)
+
+    # Tells whoever waits on this printer (update_thread, beginPrint, a paused print, the reactor)
+    # to look at it again. Called when its status, its queue or the release of one of its jobs changes.
+    def wake(self):
+        if self.changed is None:  # loaded from the database, no thread waits on it
+            return
+        with self.changed:
+            self.changed.notify_all()
+        if self.onChange:
+            self.onChange(self)
             
     def handleVerdict(self, verdict, job):
         if verdict == "complete":
@@ -842,8 +767,9 @@ class Printer(db.Model):
                 Printer.hardReset(self.id, newStatus)
             else: 
                 self.status = newStatus
+            self.wake()
 
-            current_app.socketio.emit(
+            current_app.emitter.emit(
                 "status_update", {"printer_id": self.id, "status": newStatus}
             )
         except Exception as e:
@@ -856,48 +782,36 @@ class Printer(db.Model):
         self.disconnect()
         self.error = error
         self.setStatus("error")
-        current_app.socketio.emit(
+        current_app.emitter.emit(
             "error_update", {"printerid": self.id, "error": str(self.error)}
         )
 
     def sendStatusToJob(self, job, job_id, status):
         try:
             job.setStatus(status)
-            data = {
-                "printerid": self.id,
-                "jobid": job_id,
-                "status": status,  # Assuming status is accessible here
-            }
-            
-            response = requests.post(f"{Config.get('base_url')}/updatejobstatus", json=data)
-            if response.status_code == 200:
-                print("Status sent successfully")
-            else:
-                print("Failed to send status:", response.text)
-        except requests.exceptions.RequestException as e:
+            current_app.bus.publish(JobStatusReported(self.id, job_id, status))
+        except Exception as e:
             print(f"Failed to send status to job: {e}")
 
     @classmethod 
     def repairPorts(cls):
         try:
-            response = requests.post(f"{Config.get('base_url')}/repairports")
-
-        except requests.exceptions.RequestException as e:
+            current_app.bus.send(RepairPorts())
+        except Exception as e:
             print(f"Failed to repair ports: {e}")
             
     @classmethod 
     def hardReset(cls, printerid, status):
         try:
-            response = requests.post(f"{Config.get('base_url')}/queuerestore", json={'printerid': printerid, 'status': status})
-
-        except requests.exceptions.RequestException as e:
-            print(f"Failed to repair ports: {e}")   
+            current_app.bus.send(RestoreQueue(printerid, status))
+        except Exception as e:
+            print(f"Failed to restore queue: {e}")   
 
     def setTemps(self, extruder_temp, bed_temp):
         self.extruder_temp = extruder_temp
         self.bed_temp = bed_temp
-        current_app.socketio.emit(
-            'temp_update', {'printerid': self.id, 'extruder_temp': self.extruder_temp, 'bed_temp': self.bed_temp})
+        current_app.emitter.coalesce(
+            'temp_update', self.id, {'printerid': self.id, 'extruder_temp': self.extruder_temp, 'bed_temp': self.bed_temp})
 
 
     def setCanPause(self, canPause):
@@ -907,6 +821,10 @@ class Printer(db.Model):
         except Exception as e:
             print('Error setting canPause:', e)
 
+    def setSendRate(self, rate):
+        self.sendRate = rate
+        current_app.emitter.coalesce('send_rate', self.id, {'printerid': self.id, 'sendRate': rate})
+
     def setColorChangeBuffer(self, buff): 
         self.colorbuff = buff
         current_app.socketio.emit('color_buff', {'printerid': self.id, 'colorChangeBuffer': buff})
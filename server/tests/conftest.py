@@ -0,0 +1,8 @@
+import os
+import sys
+
+# the tests import the server's modules the way app.py does, from the server folder, where
+# models.config finds ./config/config.json
+SERVER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, SERVER)
+os.chdir(SERVER)
@@ -0,0 +1,108 @@
+import gzip
+import hashlib
+import os
+
+import pytest
+
+from Classes.BlobStore import BlobStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return BlobStore(str(tmp_path / "blobs"), member_size=64)
+
+
+def test_put_and_read_back(store):
+    data = b"G1 X10 Y10 E1\n" * 100
+    digest = store.put(data)
+    assert digest == hashlib.sha256(data).hexdigest()
+    assert store.exists(digest)
+    with store.open(digest) as f:
+        assert f.read() == data
+    assert gzip.decompress(store.read(digest)) == data
+
+
+def test_same_content_is_stored_once(store):
+    with store.writer() as first:
+        first.write(b"G28\n")
+    with store.writer() as second:
+        second.write(b"G2")
+        second.write(b"8\n")
+    assert first.hash == second.hash
+    assert first.created and not second.created
+    assert os.listdir(store.tmp) == []
+
+
+def test_members_are_cut_at_fixed_offsets(store):
+    data = bytes(range(256)) * 3
+    with store.writer() as blob:
+        for start in range(0, len(data), 50):
+            blob.write(data[start:start + 50])
+    assert [uncompressed for _, uncompressed in blob.members] == list(range(0, len(data), 64))
+    for offset in (0, 1, 63, 64, 65, 500, len(data) - 1, len(data)):
+        with store.openAt(blob.hash, offset, blob.members) as f:
+            assert f.read() == data[offset:]
+
+
+def test_failed_write_stores_nothing(store):
+    with pytest.raises(RuntimeError):
+        with store.writer() as blob:
+            blob.write(b"G1 X1\n")
+            raise RuntimeError("upload interrupted")
+    assert blob.hash is None
+    assert os.listdir(store.tmp) == []
+    assert not store.exists(hashlib.sha256(b"G1 X1\n").hexdigest())
+
+
+def test_delete_removes_sidecars(store):
+    digest = store.put(b"G28\n")
+    store.writeSidecar(digest, "index", {"lines": 1})
+    assert store.readSidecar(digest, "index") == {"lines": 1}
+    assert store.delete(digest) > 0
+    assert not store.exists(digest)
+    assert store.readSidecar(digest, "index") is None
+    assert store.delete(digest) == 0
+
+
+def test_pins_are_counted(store):
+    digest = store.put(b"G28\n")
+    assert store.pin(digest, digest)
+    store.unpin(digest)
+    assert store.isPinned(digest)
+    store.unpin(digest)
+    assert not store.isPinned(digest)
+    store.unpin(digest)  # unpinning more than pinned does not go negative
+    assert store.pin(digest)
+    store.unpin(digest)
+    assert not store.isPinned(digest)
+
+
+def test_pin_reports_missing_objects(store):
+    digest = store.put(b"G28\n")
+    missing = hashlib.sha256(b"M84\n").hexdigest()
+    assert not store.pin(digest, missing)
+    store.unpin(digest, missing)
+    assert not store.isPinned(digest) and not store.isPinned(missing)
+
+
+def test_writer_pins_new_and_existing_objects(store):
+    with store.writer(pin=True) as first:
+        first.write(b"G28\n")
+    with store.writer(pin=True) as second:
+        second.write(b"G28\n")
+    assert first.created and not second.created
+    store.unpin(first.hash)
+    assert store.isPinned(first.hash)
+    store.unpin(second.hash)
+    assert not store.isPinned(first.hash)
+
+
+def test_replace_rewrites_the_framing(store):
+    data = b"G1 X1\n" * 50
+    digest = store.put(data)
+    with store.writer(replace=True) as blob:
+        blob.write(data)
+    assert blob.hash == digest and blob.created
+    assert len(blob.members) > 1
+    with store.openAt(digest, 100, blob.members) as f:
+        assert f.read() == data[100:]
@@ -0,0 +1,104 @@
+import io
+
+import pytest
+
+from Classes.BlobStore import BlobStore
+from Classes.GcodeIndex import GcodeIndex, layerBytes, readByteRange, readLineRange
+from Classes.GcodeScanner import readLines
+
+# start G-code, three layers (the last one without a height) and the end G-code, no final newline
+FIXTURE = (
+    b"; generated by a slicer\n"
+    b"G28\n"
+    b"M104 S215\n"
+    b";LAYER_CHANGE\n"
+    b";Z:0.2\n"
+    b"G1 Z0.2 F720\n"
+    b"G1 X10 Y10 E1\n"
+    b"G1 X20 Y10 E2\n"
+    b";LAYER_CHANGE\n"
+    b";Z:0.4\n"
+    b"G1 Z0.4\n"
+    b"G1 X10 Y20 E3\n"
+    b";LAYER_CHANGE\n"
+    b"G1 Z0.6\n"
+    b"G1 X10 Y10 E4\n"
+    b"M104 S0\n"
+    b"M84"
+)
+LINES = FIXTURE.splitlines(keepends=True)
+
+
+@pytest.fixture
+def stored(tmp_path, monkeypatch):
+    # small members and checkpoints, so the ranges start in the middle of both
+    monkeypatch.setattr(GcodeIndex, "STEP", 4)
+    store = BlobStore(str(tmp_path / "blobs"), member_size=32)
+    index = GcodeIndex()
+    with store.writer() as blob:
+        for _ in readLines(io.BytesIO(FIXTURE), blob, index, chunk_size=7):
+            pass
+    return store, blob.hash, index.toJson(blob.members)
+
+
+def layerStart(n):
+    return FIXTURE.index(b";LAYER_CHANGE", sum(len(line) for line in LINES[:n]))
+
+
+def test_index(stored):
+    _, _, index = stored
+    assert index["lines"] == len(LINES)
+    assert index["size"] == len(FIXTURE)
+    assert index["checkpoints"] == [sum(len(line) for line in LINES[:n]) for n in range(0, len(LINES), 4)]
+    assert index["layers"] == [[3, layerStart(3), 0.2], [8, layerStart(8), 0.4], [12, layerStart(12), None]]
+
+
+def test_line_ranges(stored):
+    store, digest, index = stored
+    for first in range(len(LINES) + 1):
+        for last in range(first, len(LINES) + 1):
+            assert list(readLineRange(store, digest, index, first, last)) == LINES[first:last]
+
+
+def test_line_ranges_are_clamped(stored):
+    store, digest, index = stored
+    assert list(readLineRange(store, digest, index, -5, 2)) == LINES[:2]
+    assert list(readLineRange(store, digest, index, 14, 100)) == LINES[14:]
+    assert list(readLineRange(store, digest, index, 100, 200)) == []
+    assert list(readLineRange(store, digest, index, 5, 3)) == []
+
+
+def test_byte_ranges(stored):
+    store, digest, index = stored
+    for start in range(0, len(FIXTURE) + 1, 5):
+        for end in range(start, len(FIXTURE) + 1, 9):
+            assert b"".join(readByteRange(store, digest, index, start, end, chunk_size=8)) == FIXTURE[start:end]
+    assert b"".join(readByteRange(store, digest, index, -10, 10 ** 6)) == FIXTURE
+
+
+def test_layer_ranges(stored):
+    store, digest, index = stored
+
+    def layers(first, last):
+        return b"".join(readByteRange(store, digest, index, *layerBytes(index, first, last)))
+
+    # the start G-code goes with the first layer, the end G-code with the last one
+    assert layers(0, 1) == FIXTURE[:layerStart(8)]
+    assert layers(1, 2) == FIXTURE[layerStart(8):layerStart(12)]
+    assert layers(2, 3) == FIXTURE[layerStart(12):]
+    assert layers(0, 3) == FIXTURE
+    assert layers(1, 10) == FIXTURE[layerStart(8):]
+    assert layers(3, 5) == b""
+    assert layers(2, 1) == b""
+
+
+def test_file_without_layers(tmp_path):
+    store = BlobStore(str(tmp_path / "blobs"))
+    data = b"G28\nG1 X1\n"
+    index = GcodeIndex()
+    with store.writer() as blob:
+        for _ in readLines(io.BytesIO(data), blob, index):
+            pass
+    index = index.toJson(blob.members)
+    assert index["layers"] == []
+    assert layerBytes(index, 0, 1) == (0, len(data))
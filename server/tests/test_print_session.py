@@ -0,0 +1,234 @@
+import io
+import logging
+
+import pytest
+
+from Classes import PrintSession as session_module
+from Classes.PrintSession import DONE, PAUSED, RESUMING, SYNC, PrintSession
+
+
+class FakePort:
+    def __init__(self):
+        self.written = []
+
+    def write(self, data):
+        self.written.append(data.decode("utf-8").strip())
+
+
+class FakePrinter:
+    # what PrintSession uses of a Printer, without a serial port or a database
+    def __init__(self, streaming=True):
+        self.ser = FakePort()
+        self.status = "printing"
+        self.streaming = streaming
+        self.terminated = 0
+        self.responseCount = 0
+        self.prevMes = ""
+        self.colorbuff = 0
+        self.sendRate = 0
+        self.error = None
+
+    def handleResponse(self, response, logger):
+        return None if response.startswith("Error") else response
+
+    def isStreaming(self):
+        return self.streaming
+
+    def getStatus(self):
+        return self.status
+
+    def setStatus(self, status):
+        self.status = status
+
+    def setError(self, e):
+        self.error = e
+
+    def setColorChangeBuffer(self, value):
+        self.colorbuff = value
+
+    def setSendRate(self, rate):
+        self.sendRate = rate
+
+
+class FakeJob:
+    def __init__(self, total_lines):
+        self.total_lines = total_lines
+        self.filePause = 0
+        self.sent_lines = 0
+        self.progress = 0
+
+    def getGcodeMeta(self):
+        return {"total_lines": self.total_lines, "layers": []}
+
+    def getFilePause(self):
+        return self.filePause
+
+    def setFilePause(self, value):
+        self.filePause = value
+
+    def setSentLines(self, lines):
+        self.sent_lines = lines
+
+    def setProgress(self, progress):
+        self.progress = progress
+
+    def getTimeStarted(self):
+        return 1
+
+    def getExtruded(self):
+        return 1
+
+    def setTime(self, value, index):
+        pass
+
+    def colorEta(self):
+        return None
+
+    def calculateColorChangeTotal(self):
+        return None
+
+
+@pytest.fixture(autouse=True)
+def window(monkeypatch):
+    monkeypatch.setitem(session_module.Config, "streaming_window", 4)
+    monkeypatch.setitem(session_module.Config, "streaming_rx_buffer", 128)
+
+
+def makeSession(commands, streaming=True):
+    printer = FakePrinter(streaming)
+    finished = []
+    session = PrintSession(printer, FakeJob(len(commands)), io.StringIO("".join(f"{c}\n" for c in commands)),
+                           logging.getLogger("test_print_session"), None, lambda s, verdict: finished.append(verdict))
+    session.finished = finished
+    return session, printer
+
+
+def ack(session, times=1):
+    for _ in range(times):
+        session.onLine("ok")
+
+
+def test_window_fills_and_slides():
+    commands = [f"G1 X{i}" for i in range(10)]
+    session, printer = makeSession(commands)
+    session.start()
+    assert printer.ser.written == commands[:4]
+    ack(session)
+    assert printer.ser.written == commands[:5]
+    ack(session, 2)
+    assert printer.ser.written == commands[:7]
+    assert len(session.inflight) == 4
+    ack(session, 10)
+    assert printer.ser.written == commands
+    assert session.state == DONE and session.finished == ["complete"]
+    assert session.sent_lines == 10 and session.job.progress == 100
+
+
+def test_window_is_bounded_by_the_receive_buffer():
+    commands = ["G1 X100.000 Y100.000 Z10.000 E12.3456 F1800"] * 4  # 44 bytes with the newline
+    session, printer = makeSession(commands)
+    session.start()
+    assert sum(len(c) + 1 for c in printer.ser.written) <= 128
+    assert len(printer.ser.written) == 2
+    ack(session)
+    assert len(printer.ser.written) == 3
+
+
+def test_one_at_a_time_without_streaming():
+    commands = ["G28", "G1 X1", "G1 X2"]
+    session, printer = makeSession(commands, streaming=False)
+    session.start()
+    assert printer.ser.written == ["G28"]
+    ack(session)
+    assert printer.ser.written == ["G28", "G1 X1"]
+
+
+def test_sync_command_is_sent_alone():
+    commands = ["G1 X1", "G1 X2", "M600", "G1 X3", "G1 X4"]
+    session, printer = makeSession(commands)
+    session.start()
+    # everything in flight is acknowledged before the color change is sent
+    assert printer.ser.written == ["G1 X1", "G1 X2"]
+    ack(session)
+    assert printer.ser.written == ["G1 X1", "G1 X2"]
+    ack(session)
+    assert printer.ser.written == ["G1 X1", "G1 X2", "M600"]
+    # and nothing follows it until it is
+    ack(session)
+    assert printer.ser.written == commands[:4] + ["G1 X4"]
+    assert printer.status == "colorchange"
+    ack(session)
+    assert printer.status == "printing"
+
+
+def test_ok_without_command_in_flight_is_ignored():
+    session, printer = makeSession(["G28"])
+    session.onLine("ok")
+    assert session.sent_lines == 0
+    session.start()
+    ack(session)
+    assert session.finished == ["complete"]
+
+
+def test_pause_and_resume():
+    commands = [f"G1 X{i}" for i in range(8)]
+    session, printer = makeSession(commands)
+    session.start()
+    printer.status = "paused"
+    ack(session)
+    # drains what is in flight, then pauses the printer with a command of its own
+    assert printer.ser.written == commands[:4]
+    ack(session, 3)
+    assert printer.ser.written == commands[:4] + ["M601"]
+    assert session.state == SYNC
+    ack(session)
+    assert session.state == PAUSED
+    assert session.sent_lines == 4  # M601 is not a line of the file
+
+    session.tick()
+    assert session.state == PAUSED
+    printer.status = "printing"
+    session.tick()
+    assert printer.ser.written[-1] == "M602"
+    ack(session)
+    assert session.state == RESUMING
+
+    # the printer gets 2 seconds before sending resumes
+    session.tick()
+    assert printer.ser.written[-1] == "M602"
+    session.resume_at = 0
+    session.tick()
+    assert printer.ser.written == commands[:4] + ["M601", "M602"] + commands[4:8]
+    ack(session, 4)
+    assert session.finished == ["complete"]
+    assert session.sent_lines == 8
+
+
+def test_cancel_while_paused():
+    session, printer = makeSession([f"G1 X{i}" for i in range(8)])
+    session.start()
+    printer.status = "paused"
+    ack(session, 4)
+    ack(session)
+    assert session.state == PAUSED
+    printer.status = "complete"
+    session.tick()
+    assert session.finished == ["cancelled"]
+
+
+def test_printer_error_ends_the_print():
+    session, printer = makeSession([f"G1 X{i}" for i in range(8)])
+    session.start()
+    session.onLine("Error: thermal runaway")
+    assert session.state == DONE and session.finished == ["error"]
+    ack(session)
+    assert session.finished == ["error"]
+
+
+def test_terminated_printer_stops_the_print():
+    session, printer = makeSession([f"G1 X{i}" for i in range(8)])
+    session.start()
+    printer.terminated = 1
+    session.tick()
+    assert session.finished == [None]
+    assert session.commands.closed
@@ -0,0 +1,192 @@
+import random
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+from flask import Flask
+
+from Classes.Queue import Queue
+
+PRINTER = 1
+
+
+class Emitter:
+    def __init__(self):
+        self.updates = []
+
+    def emit(self, event, data):
+        assert event == "queue_update"
+        self.updates.append(data)
+
+
+class Client:
+    # the browser's side of queue_update (applyQueueUpdate and setupQueueSocket in client/src/model/sockets.ts)
+    def __init__(self, queue):
+        self.queue = queue
+        self.epoch = None
+        self.seq = None
+        self.jobs = []
+        self.resyncs = 0
+
+    def receive(self, data):
+        if data["op"] == "snapshot":
+            self.jobs, self.epoch, self.seq = data["queue"], data["epoch"], data["seq"]
+        elif data["epoch"] != self.epoch or self.seq is None or data["seq"] > self.seq + 1:
+            self.resyncs += 1
+            self.receive(self.queue.snapshot(PRINTER))
+        elif data["seq"] == self.seq + 1:
+            self.apply(data)
+            self.seq = data["seq"]
+
+    def apply(self, data):
+        ids = [job["id"] for job in self.jobs]
+        if data["op"] == "insert":
+            self.jobs.insert(data["index"], data["job"])
+        elif data["op"] == "remove" and data["jobid"] in ids:
+            self.jobs.pop(ids.index(data["jobid"]))
+        elif data["op"] == "move" and data["jobid"] in ids:
+            self.jobs.insert(data["to"], self.jobs.pop(ids.index(data["jobid"])))
+        elif data["op"] == "reorder":
+            byId = {job["id"]: job for job in self.jobs}
+            self.jobs = [byId[jobid] for jobid in data["order"] if jobid in byId]
+
+
+def makeJob(id, status="inqueue"):
+    return SimpleNamespace(
+        id=id, name=f"job {id}", status=status, date=datetime(2024, 1, 1), printer_id=PRINTER, error_id=0,
+        file_name_original=f"part_{id}.gcode", file_hash=None, progress=0, sent_lines=0, favorite=False,
+        released=0, filePause=0, comments="", extruded=0, td_id=id, time_started=0, printer_name="printer",
+        max_layer_height=0, current_layer_height=0, filament="",
+    )
+
+
+@pytest.fixture
+def emitter():
+    app = Flask(__name__)
+    app.emitter = Emitter()
+    with app.app_context():
+        yield app.emitter
+
+
+def ids(queue):
+    return [job.id for job in queue]
+
+
+def test_ops_are_numbered(emitter):
+    queue = Queue()
+    queue.addToBack(makeJob(1), PRINTER)
+    queue.addToBack(makeJob(2), PRINTER)
+    queue.addToFront(makeJob(3), PRINTER)
+    queue.bump(False, 3, PRINTER)
+    queue.deleteJob(1, PRINTER)
+    queue.reorder([2, 3], PRINTER)
+    assert [(u["op"], u["seq"]) for u in emitter.updates] == [
+        ("insert", 1), ("insert", 2), ("insert", 3), ("move", 4), ("remove", 5), ("reorder", 6)]
+    assert {u["epoch"] for u in emitter.updates} == {queue.snapshot(PRINTER)["epoch"]}
+    assert emitter.updates[2]["index"] == 0
+    assert emitter.updates[3]["to"] == 1
+    assert queue.getSeq() == 6
+    assert ids(queue) == [2, 3]
+
+
+def test_snapshot(emitter):
+    queue = Queue()
+    queue.addToBack(makeJob(1), PRINTER)
+    queue.addToBack(makeJob(2), PRINTER)
+    snapshot = queue.snapshot(PRINTER)
+    assert snapshot["op"] == "snapshot"
+    assert snapshot["seq"] == 2
+    assert [job["id"] for job in snapshot["queue"]] == [1, 2]
+    assert len(emitter.updates) == 2  # a snapshot is not an op
+
+
+def test_front_keeps_the_printing_job_first(emitter):
+    queue = Queue()
+    queue.addToBack(makeJob(1, "printing"), PRINTER)
+    queue.addToBack(makeJob(2), PRINTER)
+    queue.addToFront(makeJob(3), PRINTER)
+    queue.bumpExtreme(True, 2, PRINTER)
+    assert ids(queue) == [1, 2, 3]
+    assert emitter.updates[2]["index"] == 1
+    assert emitter.updates[3]["to"] == 1
+
+
+def test_no_op_changes_are_not_published(emitter):
+    queue = Queue()
+    queue.addToBack(makeJob(1), PRINTER)
+    queue.bump(True, 1, PRINTER)
+    queue.bump(True, 42, PRINTER)
+    queue.bumpExtreme(False, 1, PRINTER)
+    assert queue.deleteJob(42, PRINTER) == "Job not found in queue."
+    with pytest.raises(Exception):
+        queue.addToBack(makeJob(1), PRINTER)
+    assert len(emitter.updates) == 1
+
+
+def test_client_follows_the_queue(emitter):
+    queue = Queue()
+    client = Client(queue)
+    client.receive(queue.snapshot(PRINTER))
+    rng = random.Random(0)
+    next_id = 1
+    for _ in range(500):
+        present = ids(queue)
+        action = rng.randrange(6) if present else 0
+        if action == 0:
+            (queue.addToBack if rng.random() < 0.5 else queue.addToFront)(makeJob(next_id), PRINTER)
+            next_id += 1
+        elif action == 1:
+            queue.deleteJob(rng.choice(present), PRINTER)
+        elif action == 2:
+            queue.bump(rng.random() < 0.5, rng.choice(present), PRINTER)
+        elif action == 3:
+            queue.bumpExtreme(rng.random() < 0.5, rng.choice(present), PRINTER)
+        elif action == 4:
+            queue.removeJob(PRINTER)
+        else:
+            queue.reorder(rng.sample(present, rng.randint(0, len(present))), PRINTER)
+        while emitter.updates:
+            client.receive(emitter.updates.pop(0))
+        assert [job["id"] for job in client.jobs] == ids(queue)
+    assert client.resyncs == 0
+
+
+def test_missed_op_resyncs(emitter):
+    queue = Queue()
+    client = Client(queue)
+    client.receive(queue.snapshot(PRINTER))
+    for id in range(1, 5):
+        queue.addToBack(makeJob(id), PRINTER)
+    del emitter.updates[1]  # lost on the way
+    for update in emitter.updates:
+        client.receive(update)
+    assert client.resyncs == 1
+    assert [job["id"] for job in client.jobs] == [1, 2, 3, 4]
+    assert client.seq == 4
+
+
+def test_new_queue_has_a_new_epoch(emitter):
+    queue = Queue()
+    client = Client(queue)
+    client.receive(queue.snapshot(PRINTER))
+    queue.addToBack(makeJob(1), PRINTER)
+    client.receive(emitter.updates.pop())
+
+    # a reset or a restart: numbered from 0 again, the client must not take it for ops it has seen
+    client.queue = Queue()
+    assert client.queue.snapshot(PRINTER)["epoch"] != client.epoch
+    client.queue.addToBack(makeJob(2), PRINTER)
+    client.receive(emitter.updates.pop())
+    assert client.resyncs == 1
+    assert [job["id"] for job in client.jobs] == [2]
+
+
+def test_watcher_gets_the_size(emitter):
+    queue = Queue()
+    sizes = []
+    queue.watch(sizes.append)
+    queue.addToBack(makeJob(1), PRINTER)
+    queue.addToBack(makeJob(2), PRINTER)
+    queue.bump(False, 1, PRINTER)
+    queue.deleteJob(1, PRINTER)
+    assert sizes == [1, 2, 1]